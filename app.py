@@ -1,267 +1,495 @@
-import json
-import ollama
+# First, so the import-to-ready time covers loading every dependency
+import startup
 import asyncio
-from flask import Flask, request, jsonify
+import os
+from flask import Flask, Response, request, jsonify
+import time
 import uuid
+from serving import run_turn, stream_turn, waiting_turns
+from streaming import sse_sentences
+import deadline
+import metrics
+import tracing
+import resilience
+import hospital_tools
+import intent_router
+from llm_scheduler import NEW_CALL, ONGOING_CALL, Host, LLMScheduler, OverloadedError, turn_priority
+from tool_ledger import FAILED, ToolCallLedger
+from session_store import SessionStore
+from response_cache import ResponseCache
+from speculation import Speculation
+from history_compaction import compact_history
+from messages import (ASSISTANT, RECORD_FORMAT, SYSTEM, USER, Message, describe, release, to_ollama, tool_call,
+                      tool_result)
 
 app = Flask(__name__)
 
-# Doctors list
-doctors = [
-    {"name": "John Doe", "department": "Pulmonology", "specialization": "Surgery",
-     "timings": "Monday to Friday, 3:00 pm to 5:00 pm"},
-    {"name": "Jane Smith", "department": "Cardiology", "specialization": "Heart Surgery",
-     "timings": "Monday, Wednesday, Friday, 10:00 am to 12:00 pm"},
-    {"name": "Emily Johnson", "department": "Neurology", "specialization": "Brain Surgery",
-     "timings": "Tuesday and Thursday, 1:00 pm to 3:00 pm"},
-    {"name": "Michael Brown", "department": "Orthopedics", "specialization": "Knee Replacement",
-     "timings": "Monday to Friday, 9:00 am to 11:00 am"},
-    {"name": "Sarah Lee", "department": "Dermatology", "specialization": "Skin Treatment",
-     "timings": "Monday to Friday, 2:00 pm to 4:00 pm"},
-    {"name": "William Clark", "department": "Ophthalmology", "specialization": "Cataract Surgery",
-     "timings": "Monday to Friday, 10:00 am to 12:00 pm"},
-    {"name": "John Smith", "department": "Pediatrics", "specialization": "Child Care",
-     "timings": "Monday to Friday, 11:00 am to 1:00 pm"}
-]
-
-# Function to return hospital timings
-def get_hospital_timings():
-    return json.dumps({
-        "operating_days": "Monday to Friday",
-        "opening_time": "8:00 AM",
-        "closing_time": "6:00 PM",
-        "closed_days": "Saturday and Sunday"
-    })
-
-# Function to return hospital address
-def get_hospital_address():
-    return json.dumps({
-        "name": "MediCare General Hospital",
-        "street": "1234 Wellness Avenue",
-        "city": "Springfield",
-        "state": "IL",
-        "zipcode": "62704",
-        "country": "USA"
-    })
+# Shared hospital tools plus this server's refill tool
+registry = hospital_tools.registry.extend()
+
 
 # Function to handle prescription refill requests
-def refill_prescription(doctor_name, medication_name, quantity, patient_name):
-    doctor_name_lower = doctor_name.lower()
-    matched_doctor = next((doc for doc in doctors if doctor_name_lower in doc["name"].lower()), None)
+@registry.tool("Handles prescription refill requests by verifying doctor and processing the refill.", params={
+    "doctor_name": "Name of the prescribing doctor",
+    "medication_name": "Name of the medication",
+    "quantity": "Amount of medication requested",
+    "patient_name": "Name of the patient",
+}, side_effects=True)
+def refill_prescription(doctor_name: str, medication_name: str, quantity: str, patient_name: str):
+    matched_doctor = next(iter(hospital_tools.doctor_index.lookup(doctor_name)), None)
 
     if not matched_doctor:
-        return json.dumps({"error": "Doctor not found. Please provide a valid doctor name."})
+        return {"error": "Doctor not found. Please provide a valid doctor name."}
 
     # In a real system, we'd store or process this request
-    return json.dumps({
+    return {
         "status": "success",
         "message": f"Prescription refill request submitted for {patient_name}.",
         "doctor": matched_doctor["name"],
         "medication": medication_name,
         "quantity": quantity
-    })
+    }
 
-# Function to return doctor details
-def get_doctor_details(name):
-    query_name = name.lower()
-    matches = [doctor for doctor in doctors if query_name in doctor["name"].lower()]
 
-    if len(matches) == 1:
-        return json.dumps(matches[0])
-    elif len(matches) > 1:
-        return json.dumps({"multiple_matches": [doctor["name"] for doctor in matches]})
-    return json.dumps({"error": "Doctor not found"})
+# Tool schemas in Ollama's format, built once at startup
+ollama_tools = registry.ollama_tools()
 
-conversation_history = {}
+# Bounded per-call_sid histories of Message records, with idle expiry and LRU eviction
+conversation_history = SessionStore("ollama", to_record=Message.to_record, from_record=Message.from_record,
+                                    release=release, record_format=RECORD_FORMAT)
 
-system_prompt = {
-    "role": "system",
-    "content": (
-        "You are an intelligent IVR assistant for a hospital. Answer politely and professionally. "
-        "Use provided functions for hospital timings, address details, or doctor information when needed. "
-        "If multiple doctors match the name provided, ask the user to specify the full name."
-        "Exactly request the correct parameters for the function call if required, do not make up any parameters. follow the tools properly."
-    )
-}
+# Answers to opening questions, revalidated against fresh tool results on every hit
+response_cache = ResponseCache("ollama", registry)
 
-client = ollama.AsyncClient()
+system_prompt = Message(
+    SYSTEM,
+    "You are an intelligent IVR assistant for a hospital. Answer politely and professionally. "
+    "Use provided functions for hospital timings, address details, or doctor information when needed. "
+    "If multiple doctors match the name provided, ask the user to specify the full name."
+    "Exactly request the correct parameters for the function call if required, do not make up any parameters. follow the tools properly."
+)
 
-# Maximum retry attempts for failed function calls
-MAX_RETRY_ATTEMPTS = 3  # Configurable number of retries
+# Ollama servers to spread requests over, comma-separated; empty uses OLLAMA_HOST (or the local default)
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
 
+# How long Ollama keeps a model loaded after a request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
-# Corrected final_check to clean conversation history and retry failed function calls
-async def final_check(call_sid):
-    available_functions = {
-        "get_hospital_timings": get_hospital_timings,
-        "get_hospital_address": get_hospital_address,
-        "get_doctor_details": get_doctor_details,
-        "refill_prescription": refill_prescription,
-    }
+# Context window for every request and the warm-up; a request with a different size makes Ollama
+# reload the model and lose its prompt cache
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
 
-    # Identify and store failed tool calls before removing them
-    failed_tool_calls = [
-        msg for msg in conversation_history[call_sid]
-        if msg.get("role") == "tool" and "error" in msg.get("content", "").lower()
-    ]
-
-    # Remove error tool responses from conversation history
-    conversation_history[call_sid] = [
-        msg for msg in conversation_history[call_sid]
-        if not (msg.get("role") == "tool" and "error" in msg.get("content", "").lower())
-    ]
-
-    updated_tool_calls = []
-    for message in failed_tool_calls:
-        tool_call_id = message.get("tool_call_id", "unknown_id")
-
-        # Corrected: Get original tool response, not assistant
-        original_call = next(
-            (msg for msg in conversation_history[call_sid]
-             if msg.get("role") == "tool" and msg.get("tool_call_id") == tool_call_id),
-            None
-        )
-
-        if original_call:
-            function_name = original_call.get("function", {}).get("name")
-            arguments = original_call.get("function", {}).get("arguments", {})
-            function_to_call = available_functions.get(function_name)
-
-
-            if function_to_call:
-                # Attempt multiple retries if necessary
-                retry_count = 0
-                function_response = None
-                success = False
-
-                while retry_count < MAX_RETRY_ATTEMPTS and not success:
-                    try:
-                        # Retry the function call
-                        function_response = function_to_call(**arguments) if arguments else function_to_call()
-                        success = True
-                        updated_tool_calls.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": function_response,
-                        })
-                    except Exception as e:
-                        retry_count += 1
-                        success = False
-                        if retry_count >= MAX_RETRY_ATTEMPTS:
-                            # If all retries fail, append the error
-                            updated_tool_calls.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps({"error": f"Retry failed after {MAX_RETRY_ATTEMPTS} attempts: {str(e)}"})
-                            })
-
-    # Add retried results to conversation history
-    conversation_history[call_sid].extend(updated_tool_calls)
+# Offer the same tools block on every request, the final reply included, so consecutive requests share
+# their prompt prefix and Ollama only processes what is new; 0 sends tools on tool selection only
+STABLE_PROMPT_PREFIX = os.getenv("STABLE_PROMPT_PREFIX", "1") == "1"
 
+# Sent with every request, identically, so the model stays resident with one cache layout
+OLLAMA_REQUEST_OPTIONS = {"keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_ctx": OLLAMA_NUM_CTX}}
 
-async def generate_response(model: str, call_sid: str):
-    available_functions = {
-        "get_hospital_timings": get_hospital_timings,
-        "get_hospital_address": get_hospital_address,
-        "get_doctor_details": get_doctor_details,
-    }
+# Tools offered with the final reply request, only to keep its prompt prefix the same as tool selection's
+final_tools = ollama_tools if STABLE_PROMPT_PREFIX else None
+
+metrics.describe("final_reply_without_tools_total",
+                 "Final replies asked again without tools because the model called a tool instead of answering")
+
+
+# Creates an Ollama client on first use; importing ollama (httpx) is most of this module's import time
+def connect_ollama(host):
+    import ollama
+    return ollama.AsyncClient(host=host or None)
+
+
+# Every request goes through the scheduler, which limits in-flight requests per host and queues the rest
+scheduler = LLMScheduler([Host(host, connect_ollama) for host in OLLAMA_HOSTS or [""]],
+                         waiting_turns=waiting_turns)
+
+# Model writing the caller-facing reply
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+
+# Smaller model for the tool-selection call; empty uses OLLAMA_MODEL for both stages
+OLLAMA_TOOL_MODEL = os.getenv("OLLAMA_TOOL_MODEL", "")
+
+# Re-run tool selection on the reply model when the tool model produced invalid arguments
+TOOL_MODEL_FALLBACK = os.getenv("TOOL_MODEL_FALLBACK", "1") == "1"
+
+# Second Ollama instance that slow tool-selection calls are hedged to; empty hedges on the same host
+OLLAMA_HEDGE_HOST = os.getenv("OLLAMA_HEDGE_HOST", "")
+
+# Model used for the hedged request; empty uses the model of the original request
+OLLAMA_HEDGE_MODEL = os.getenv("OLLAMA_HEDGE_MODEL", "")
 
-    response = await client.chat(
-        model=model,
-        messages=conversation_history[call_sid],
-        tools=[
-            {"type": "function", "function": {"name": "get_hospital_timings",
-                                              "description": "Provides operating hours of the hospital",
-                                              "parameters": {"type": "object", "properties": {}}}},
-            {"type": "function", "function": {"name": "get_hospital_address",
-                                              "description": "Provides the full address of the hospital",
-                                              "parameters": {"type": "object", "properties": {}}}},
-            {"type": "function", "function": {"name": "get_doctor_details",
-                                              "description": "Provides details of a specified doctor",
-                                              "parameters": {"type": "object", "properties": {"name": {
-                                                  "type": "string", "description": "Doctor's name"}}},
-                                              "required": ["name"]}},
-            {"type": "function", "function": {
-                "name": "refill_prescription",
-                "description": "Handles prescription refill requests by verifying doctor and processing the refill.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "doctor_name": {"type": "string", "description": "Name of the prescribing doctor"},
-                        "medication_name": {"type": "string", "description": "Name of the medication"},
-                        "quantity": {"type": "string", "description": "Amount of medication requested"},
-                        "patient_name": {"type": "string", "description": "Name of the patient"}
-                    },
-                    "required": ["doctor_name", "medication_name", "quantity", "patient_name"]
-                }
-            }}
-        ],
-    )
-
-    conversation_history[call_sid].append({
-        "role": response["message"].role,
-        "content": response["message"].content
-    })
-
-    for tool in response["message"].get("tool_calls", []):
+# Hedging is on once a second host or model is configured
+hedge_client = startup.Lazy("llm:hedge", lambda: connect_ollama(OLLAMA_HEDGE_HOST)) if OLLAMA_HEDGE_HOST else None
+HEDGING_ENABLED = bool(OLLAMA_HEDGE_HOST or OLLAMA_HEDGE_MODEL)
+
+metrics.describe("tool_model_fallbacks_total", "Tool selections redone on the reply model after invalid arguments")
+
+metrics.describe("chat_turns_total", "Chat turns by number of LLM round trips (single_call or two_call)")
+
+# Maximum retry attempts for failed function calls
+MAX_RETRY_ATTEMPTS = 3  # Configurable number of retries
+
+
+# Retries this turn's failed tool calls from the ledger and records their final outcome
+async def final_check(call_sid, ledger):
+    for record in ledger.failed():
+        # Failed calls already passed validation, so this only looks the function up again
+        function_to_call, arguments = registry.prepare(record.name, record.arguments)
+
+        # Retry with backoff while the tool's circuit breaker still lets calls through and the turn has time
+        # left; a side-effecting tool only when it never started, and otherwise its failure goes to the model
+        retry_count = 0
+        side_effects = registry.has_side_effects(record.name)
+        while (retry_count < MAX_RETRY_ATTEMPTS and record.may_retry(side_effects)
+               and resilience.breaker(record.name).allows() and not deadline.expired()):
+            retry_count += 1
+            outcome = await resilience.retry_call(record.name, function_to_call, arguments, retry_count,
+                                                  registry.timeout(record.name))
+            ledger.record(record.tool_call_id, record.name, record.arguments, outcome)
+
+        # Add the retried result (or the final error) to conversation history
+        conversation_history[call_sid].append(tool_result(record.tool_call_id, record.payload()))
+
+
+# Sends one chat request to the least busy Ollama host once the scheduler has room for it
+async def scheduled_chat(model, **kwargs):
+    async with scheduler.slot() as host:
+        return await host.client.chat(model=model, **kwargs, **OLLAMA_REQUEST_OPTIONS)
+
+
+# Time Ollama spent on the prompt, in seconds; small when the prefix came from its cache
+def prompt_eval_seconds(response):
+    duration = response.get("prompt_eval_duration")
+    return None if duration is None else duration / 1e9
+
+
+# Sends one chat request to Ollama, timed as a turn stage and counted with its token usage.
+# With hedge=True a request slower than usual is duplicated to the hedge host / model.
+async def timed_chat(stage, model, hedge=False, **kwargs):
+    hedge_request = None
+    if hedge and HEDGING_ENABLED:
+        if hedge_client is not None:
+            hedge_request = lambda: hedge_client.get().chat(model=OLLAMA_HEDGE_MODEL or model, **kwargs,
+                                                            **OLLAMA_REQUEST_OPTIONS)
+        else:
+            hedge_request = lambda: scheduled_chat(OLLAMA_HEDGE_MODEL, **kwargs)
+    with tracing.span(stage, model=model):
+        response = await asyncio.wait_for(deadline.hedged(stage, lambda: scheduled_chat(model, **kwargs),
+                                                          hedge_request),
+                                          deadline.stage_timeout())
+    tracing.record_llm_usage("ollama", response.get("model") or model, stage, response.get("prompt_eval_count"),
+                             response.get("eval_count"), prompt_eval_seconds(response))
+    return response
+
+
+# Keeps the call's prompt within the token budget before a request is sent; the final reply needs this
+# as much as the first call, since tool results were added in between
+def compact(call_sid):
+    conversation_history[call_sid] = compact_history(
+        conversation_history[call_sid], describe, lambda summary: Message(SYSTEM, summary), "ollama")[0]
+
+
+# Asks for the final reply. With the tools offered (see STABLE_PROMPT_PREFIX) the model may still ask
+# for a tool instead of answering; it is then asked once more without them.
+async def final_chat(model, call_sid):
+    compact(call_sid)
+    response = await timed_chat("llm_final", model, messages=to_ollama(conversation_history[call_sid]),
+                                tools=final_tools)
+    if final_tools and not response["message"].get("content") and response["message"].get("tool_calls"):
+        metrics.inc("final_reply_without_tools_total")
+        response = await timed_chat("llm_final", model, messages=to_ollama(conversation_history[call_sid]))
+    return response
+
+
+# Runs the tool-selection call and executes any requested tools before the final reply.
+# Returns the first reply directly when the model answered without calling a tool and no separate
+# reply_model is in use.
+async def resolve_tool_calls(model: str, call_sid: str, reply_model: str = None, speculation=None):
+    compact(call_sid)
+
+    response = await timed_chat("llm_first", model, hedge=True, messages=to_ollama(conversation_history[call_sid]),
+                                tools=ollama_tools)
+    tool_calls = response["message"].get("tool_calls") or []
+    answered_by = model
+
+    # The small tool model got the arguments wrong; ask the reply model before anything runs
+    if reply_model and TOOL_MODEL_FALLBACK and registry.validation_errors(
+            [(tool["function"]["name"], tool["function"].get("arguments", {})) for tool in tool_calls]):
+        metrics.inc("tool_model_fallbacks_total", store="ollama")
+        response = await timed_chat("llm_first", reply_model, hedge=True,
+                                    messages=to_ollama(conversation_history[call_sid]), tools=ollama_tools)
+        tool_calls = response["message"].get("tool_calls") or []
+        answered_by = reply_model
+
+    # With a separate reply model the tool model's text is never the answer
+    if not tool_calls and reply_model and answered_by != reply_model:
+        metrics.inc("chat_turns_total", path="two_call")
+        return None
+
+    conversation_history[call_sid].append(Message(ASSISTANT, response["message"].content))
+
+    # Fast path: no tools requested, so the first reply is already the answer
+    if not tool_calls and response["message"].content:
+        metrics.inc("chat_turns_total", path="single_call")
+        return response["message"].content
+
+    metrics.inc("chat_turns_total", path="two_call")
+
+    # Validate and run every requested tool concurrently; results come back in the original call order
+    results = await registry.run_calls([
+        (tool["function"]["name"], tool["function"].get("arguments", {})) for tool in tool_calls
+    ], speculation)
+
+    ledger = ToolCallLedger()
+    for tool, result in zip(tool_calls, results):
         tool_call_id = str(uuid.uuid4())  # Generate unique ID
         function_name = tool["function"]["name"]
         arguments = tool["function"].get("arguments", {})
-        function_to_call = available_functions.get(function_name)
 
         # Add tool call information to the conversation history
-        conversation_history[call_sid].append({
-            "role": "tool",
-            "tool_call_id": tool_call_id,
-            "function": {
-                "name": function_name,
-                "arguments": arguments
-            }
-        })
-
-        if function_to_call:
-            try:
-                function_response = function_to_call(**arguments) if arguments else function_to_call()
-                conversation_history[call_sid].append({
-                    "role": "tool",
-                    "tool_call_id": tool_call_id,
-                    "content": function_response,
-                })
-            except Exception as e:
-                conversation_history[call_sid].append({
-                    "role": "tool",
-                    "tool_call_id": tool_call_id,
-                    "content": json.dumps({"error": f"Function execution failed: {str(e)}"})
-                })
-
-    # Final check to clean history and retry errors
-    await final_check(call_sid)
+        conversation_history[call_sid].append(tool_call(tool_call_id, function_name, arguments))
+
+        record = ledger.record(tool_call_id, function_name, arguments, result)
+        if record.status == FAILED:
+            # Left out of history for now; final_check retries it and records the outcome
+            continue
+
+        conversation_history[call_sid].append(tool_result(tool_call_id, record.payload()))
+
+    # Final check to retry failed calls
+    with tracing.span("final_check", retries=len(ledger.failed())):
+        await final_check(call_sid, ledger)
+    return None
+
+
+# Answers a static FAQ intent from templated tool output without calling the model
+def routed_reply(call_sid):
+    reply = intent_router.answer(conversation_history[call_sid][-1].text)
+    if reply is not None:
+        conversation_history[call_sid].append(Message(ASSISTANT, reply))
+    return reply
+
+
+async def generate_response(model: str, call_sid: str):
+    routed = routed_reply(call_sid)
+    if routed is not None:
+        return routed, conversation_history[call_sid]
+
+    started = time.perf_counter()
+
+    # The tool-selection call may go to a smaller model than the reply
+    tool_model = OLLAMA_TOOL_MODEL or model
+    # Side-effect-free tools the caller's words point at start while the first LLM call is in flight
+    speculation = Speculation(registry, conversation_history[call_sid][-1].text)
+    try:
+        direct_reply = await resolve_tool_calls(tool_model, call_sid, model if tool_model != model else None,
+                                                speculation)
+    finally:
+        speculation.finish()
+
+    if direct_reply is not None:
+        intent_router.observe_llm_turn(time.perf_counter() - started)
+        return direct_reply, conversation_history[call_sid]
 
     # Generate final response only once after corrections
-    final_response = await client.chat(model=model, messages=conversation_history[call_sid])
-    conversation_history[call_sid].append({"role": "assistant", "content": final_response["message"]["content"]})
+    final_response = await final_chat(model, call_sid)
+    conversation_history[call_sid].append(Message(ASSISTANT, final_response["message"]["content"]))
+    intent_router.observe_llm_turn(time.perf_counter() - started)
 
     return final_response["message"]["content"], conversation_history[call_sid]
 
 
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+# Same as generate_response, but yields the final answer token by token as Ollama produces it
+async def generate_response_stream(model: str, call_sid: str):
+    routed = routed_reply(call_sid)
+    if routed is not None:
+        yield routed
+        return
+
+    started = time.perf_counter()
+
+    # The tool-selection call may go to a smaller model than the reply
+    tool_model = OLLAMA_TOOL_MODEL or model
+    # Side-effect-free tools the caller's words point at start while the first LLM call is in flight
+    speculation = Speculation(registry, conversation_history[call_sid][-1].text)
+    try:
+        direct_reply = await resolve_tool_calls(tool_model, call_sid, model if tool_model != model else None,
+                                                speculation)
+    finally:
+        speculation.finish()
+
+    if direct_reply is not None:
+        intent_router.observe_llm_turn(time.perf_counter() - started)
+        yield direct_reply
+        return
+
+    compact(call_sid)
+    final_content = []
+    tool_requested = False
+    # The host stays reserved until the whole reply has streamed
+    with tracing.span("llm_final", model=model, stream=True):
+        async with scheduler.slot() as host:
+            stream = await asyncio.wait_for(
+                host.client.chat(model=model, messages=to_ollama(conversation_history[call_sid]),
+                                 tools=final_tools, stream=True, **OLLAMA_REQUEST_OPTIONS),
+                deadline.stage_timeout())
+            async for part in stream:
+                token = part["message"]["content"]
+                final_content.append(token)
+                tool_requested = tool_requested or bool(part["message"].get("tool_calls"))
+                if part.get("done"):
+                    tracing.record_llm_usage("ollama", model, "llm_final", part.get("prompt_eval_count"),
+                                             part.get("eval_count"), prompt_eval_seconds(part))
+                yield token
+
+    # Called a tool instead of answering (see final_chat); nothing was streamed, so answer in one piece
+    if tool_requested and not "".join(final_content).strip():
+        metrics.inc("final_reply_without_tools_total")
+        final_response = await timed_chat("llm_final", model, messages=to_ollama(conversation_history[call_sid]))
+        final_content = [final_response["message"]["content"]]
+        yield final_content[0]
+
+    conversation_history[call_sid].append(Message(ASSISTANT, "".join(final_content)))
+    intent_router.observe_llm_turn(time.perf_counter() - started)
+
+
+# Records the caller's input in their history
+def start_turn(call_sid, user_input):
+    if call_sid not in conversation_history:
+        conversation_history[call_sid] = [system_prompt]
+
+    conversation_history[call_sid].append(Message(USER, user_input))
+
+
+# The caller's first question, whose answer cannot depend on earlier conversation
+def is_opening_turn(call_sid):
+    return len(conversation_history[call_sid]) == 2
+
+
+# Answers from the response cache when the same opening question was answered before
+async def cached_reply(call_sid, user_input):
+    reply = await response_cache.lookup(user_input)
+    if reply is not None:
+        conversation_history[call_sid].append(Message(ASSISTANT, reply))
+    return reply
+
+
+# One full /chat turn, holding the caller's session lock from input to final answer
+async def handle_turn(call_sid, user_input, turn_deadline=None):
+    with tracing.trace(call_sid), deadline.use(turn_deadline):
+        # Past the deadline the caller hears the fallback reply while the turn completes into their history
+        return await deadline.answer_within(complete_turn(call_sid, user_input))
+
+
+# One full turn under the caller's session lock, from their input to the final answer
+async def complete_turn(call_sid, user_input):
+    async with conversation_history.turn(call_sid):
+        start_turn(call_sid, user_input)
+        opening = is_opening_turn(call_sid)
+        # Callers already in conversation are served before new calls when the LLM is busy
+        with turn_priority(NEW_CALL if opening else ONGOING_CALL):
+            cached = await cached_reply(call_sid, user_input) if opening else None
+            if cached is not None:
+                return cached
+
+            with resilience.observe_tool_calls() as calls:
+                response, updated_conversation = await generate_response(OLLAMA_MODEL, call_sid)
+            if opening:
+                response_cache.store(user_input, calls, response)
+    return response
+
+
+async def handle_turn_stream(call_sid, user_input, turn_deadline=None):
+    with tracing.trace(call_sid), deadline.use(turn_deadline):
+        async for text in deadline.stream_within(complete_turn_stream(call_sid, user_input)):
+            yield text
+
+
+# Streaming version of complete_turn
+async def complete_turn_stream(call_sid, user_input):
+    async with conversation_history.turn(call_sid):
+        start_turn(call_sid, user_input)
+        opening = is_opening_turn(call_sid)
+        # Callers already in conversation are served before new calls when the LLM is busy
+        with turn_priority(NEW_CALL if opening else ONGOING_CALL):
+            cached = await cached_reply(call_sid, user_input) if opening else None
+            if cached is not None:
+                yield cached
+                return
+
+            reply = []
+            with resilience.observe_tool_calls() as calls:
+                async for text in generate_response_stream(OLLAMA_MODEL, call_sid):
+                    reply.append(text)
+                    yield text
+            if opening:
+                response_cache.store(user_input, calls, "".join(reply))
+
 
 @app.route('/chat', methods=['POST'])
 def chat():
+    # The turn's time budget starts now, before it waits for a free slot
+    turn_deadline = deadline.TurnDeadline()
+    # Turn the caller away at once rather than queue them behind a full LLM backlog
+    scheduler.admit()
     data = request.json
-    call_sid = data.get("call_sid")
-    user_input = data.get("user_input", "")
 
-    if call_sid not in conversation_history:
-        conversation_history[call_sid] = [system_prompt]
+    # Runs as its own coroutine on the shared loop so other callers are not blocked
+    response = run_turn(handle_turn(data.get("call_sid"), data.get("user_input", ""), turn_deadline))
+
+    with tracing.span("serialize", call_sid=data.get("call_sid")):
+        return jsonify({"response": response})
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    turn_deadline = deadline.TurnDeadline()
+    scheduler.admit()
+    data = request.json
+
+    # Tool calls resolve first, then the answer is sent one sentence at a time as SSE
+    events = stream_turn(sse_sentences(handle_turn_stream(data.get("call_sid"), data.get("user_input", ""),
+                                                          turn_deadline)))
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Loads the models on every host and primes them with the system prompt and tool schemas,
+# so the first caller after a deploy does not pay for it
+async def prime_models():
+    models = {OLLAMA_MODEL, OLLAMA_TOOL_MODEL or OLLAMA_MODEL}
+    await asyncio.gather(*(
+        host.client.chat(model=model, messages=[system_prompt.to_ollama()], tools=ollama_tools, keep_alive=OLLAMA_KEEP_ALIVE,
+                         options={**OLLAMA_REQUEST_OPTIONS["options"], "num_predict": 1})
+        for host in scheduler.hosts for model in models
+    ))
+
+
+# A full LLM queue answers 503 with the time the backlog should take to clear
+@app.errorhandler(OverloadedError)
+def overloaded(error):
+    return jsonify({"error": str(error)}), 503, {"Retry-After": str(error.retry_after)}
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Readiness probe: 200 once warm-up (if enabled) has finished, with startup timings
+@app.route('/ready', methods=['GET'])
+def ready_endpoint():
+    return jsonify(startup.status()), 200 if startup.ready() else 503
 
-    conversation_history[call_sid].append({"role": "user", "content": user_input})
 
-    response, updated_conversation = loop.run_until_complete(generate_response("llama3.2", call_sid))
+# Recent spans of one call, to follow a slow caller stage by stage
+@app.route('/traces/<call_sid>', methods=['GET'])
+def traces_endpoint(call_sid):
+    return jsonify({"call_sid": call_sid, "spans": tracing.recent_spans(call_sid)})
 
-    return jsonify({"response": response})
 
+# Ready now, or after the models are loaded when WARMUP_ON_BOOT is set
+startup.begin(lambda: run_turn(prime_models()))
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,184 @@
+""" Replay scripted conversations from a JSONL file through a server's turn pipeline, without Flask.
+
+Each input line is one call. The accepted shapes are:
+- a list of caller utterances;
+- {"id": ..., "turns": [...]};
+- a single-turn record with "user_input", "text" or "body" (so requests.jsonl-style files work as-is).
+The id comes from "id", "call_sid" or "request_id", else from the line number.
+
+Calls run with bounded concurrency against the chosen backend. Each one is written to the output as
+soon as it finishes: one JSON line with every turn's reply, tool calls and stage timings. The input
+is read lazily and finished sessions are dropped, so memory stays flat however large the input is.
+Rerunning with the same output resumes: calls already recorded as "ok" are skipped and failed
+calls run again.
+
+Usage: python batch_runner.py conversations.jsonl results.jsonl [--app ollama] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+import uuid
+
+import resilience
+import tracing
+
+APP_MODULES = {"ollama": "app", "gemini": "gemini_llm_approach"}
+
+# Default number of calls replayed at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+
+
+def read_conversations(path):
+    """ Yield (id, turns) per input line, one line at a time """
+    with open(path, encoding="utf-8") as lines:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, list):
+                yield f"line-{number}", entry
+                continue
+            conversation_id = entry.get("id") or entry.get("call_sid") or entry.get("request_id") or f"line-{number}"
+            turns = entry.get("turns")
+            if turns is None:
+                turns = [entry.get("user_input") or entry.get("text") or entry.get("body") or ""]
+            yield str(conversation_id), turns
+
+
+def completed_ids(path):
+    """ Ids already recorded as ok in an earlier run's output; a line cut off by an interruption is ignored """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def open_output(path):
+    """ Open the output for appending, finishing a line left incomplete by an interrupted run """
+    newline_missing = False
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb") as existing:
+            existing.seek(-1, os.SEEK_END)
+            newline_missing = existing.read(1) != b"\n"
+    output = open(path, "a", encoding="utf-8")
+    if newline_missing:
+        output.write("\n")
+    return output
+
+
+def describe_call(name, arguments, outcome):
+    call = {"name": name, "arguments": arguments}
+    if isinstance(outcome, BaseException):
+        call["error"] = f"{type(outcome).__name__}: {outcome}"
+    else:
+        call["result"] = outcome
+    return call
+
+
+def stage_timings(call_sid):
+    """ Milliseconds per stage for each turn of a call, in turn order, from the recorded spans """
+    turns = {}
+    for record in tracing.recent_spans(call_sid, limit=tracing.TRACE_BUFFER_SPANS):
+        stages = turns.setdefault(record["trace_id"], {})
+        stages[record["stage"]] = round(stages.get(record["stage"], 0) + record["duration_ms"], 3)
+    return list(turns.values())
+
+
+async def replay(server, conversation_id, turns):
+    """ Run one call's turns in order and return its output record """
+    call_sid = f"batch-{conversation_id}-{uuid.uuid4().hex[:8]}"
+    record = {"id": conversation_id, "call_sid": call_sid, "status": "ok", "turns": []}
+    start = time.perf_counter()
+    try:
+        for text in turns:
+            turn_start = time.perf_counter()
+            with resilience.observe_tool_calls() as calls:
+                response = await server.handle_turn(call_sid, text)
+            record["turns"].append({
+                "user_input": text,
+                "response": response,
+                "ms": round((time.perf_counter() - turn_start) * 1000, 1),
+                "tool_calls": [describe_call(*call) for call in calls],
+            })
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        # The call is over; keep the session store from growing with the input
+        if call_sid in server.conversation_history:
+            del server.conversation_history[call_sid]
+    record["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    for turn, stages in zip(record["turns"], stage_timings(call_sid)):
+        turn["stages"] = stages
+    return record
+
+
+async def run_batch(server, input_path, output_path, concurrency):
+    done = completed_ids(output_path)
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    totals = {"ok": 0, "error": 0, "skipped": 0}
+
+    with open_output(output_path) as output:
+        async def worker():
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                record = await replay(server, *item)
+                output.write(json.dumps(record, default=str) + "\n")
+                output.flush()
+                totals[record["status"]] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            for conversation_id, turns in read_conversations(input_path):
+                if conversation_id in done:
+                    totals["skipped"] += 1
+                    continue
+                await pending.put((conversation_id, turns))
+            for _ in workers:
+                await pending.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of conversations")
+    parser.add_argument("output", help="JSONL file results are appended to; rerun with the same file to resume")
+    parser.add_argument("--app", choices=sorted(APP_MODULES), default="ollama", help="backend to replay against")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="calls replayed at once")
+    args = parser.parse_args()
+
+    server = importlib.import_module(APP_MODULES[args.app])
+    start = time.perf_counter()
+    try:
+        totals = asyncio.run(run_batch(server, args.input, args.output, args.concurrency))
+    finally:
+        # Refill requests are written behind; make sure they reach the store before exiting
+        if hasattr(server, "refill_queue"):
+            server.refill_queue.close()
+    elapsed = time.perf_counter() - start
+    finished = totals["ok"] + totals["error"]
+    print(json.dumps({**totals, "seconds": round(elapsed, 1),
+                      "calls_per_second": round(finished / elapsed, 2) if elapsed else None}), file=sys.stderr)
+    return 1 if totals["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
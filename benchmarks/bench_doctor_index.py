@@ -0,0 +1,98 @@
+""" Compare DoctorIndex lookups against the original linear substring scan.
+
+Usage: python benchmarks/bench_doctor_index.py [--doctors 50000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doctor_index import DoctorIndex
+
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William",
+               "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+               "Charles", "Karen", "Emily", "Daniel", "Nancy", "Matthew", "Lisa", "Anthony", "Betty", "Mark",
+               "Margaret", "Donald", "Sandra", "Steven", "Ashley", "Paul", "Kimberly", "Andrew", "Donna"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore",
+              "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark",
+              "Ramirez", "Lewis", "Robinson", "Walker", "Young", "Allen", "King", "Wright", "Scott"]
+SURNAME_HEADS = ["ash", "black", "brad", "brook", "cald", "chad", "cran", "dal", "dun", "east", "ell", "fair",
+                 "fern", "gold", "grant", "green", "hal", "har", "hart", "hay", "holl", "kirk", "lang", "lind",
+                 "marsh", "mid", "mor", "new", "north", "oak", "pem", "pres", "rad", "red", "ros", "rud",
+                 "sal", "shel", "stan", "stock", "strat", "sut", "thorn", "wal", "went", "west", "whit", "wood"]
+SURNAME_TAILS = ["bury", "by", "combe", "croft", "dale", "don", "field", "ford", "gate", "ham", "hill", "hurst",
+                 "ingham", "ley", "low", "mere", "more", "ridge", "stead", "stone", "ton", "well", "wick",
+                 "win", "wood", "worth"]
+
+
+def surnames():
+    """ Common surnames plus compound ones ("Ashworth", "Blackmore"), so a large directory has thousands
+    of distinct surname tokens instead of a few dozen """
+    compound = {(head + tail).capitalize() for head in SURNAME_HEADS for tail in SURNAME_TAILS}
+    return LAST_NAMES + sorted(compound - set(LAST_NAMES))
+
+
+def make_doctors(count, rng):
+    # Common surnames are shared by many doctors, like a large provider network; the rest are rarer
+    names = surnames()
+    doctors = []
+    for i in range(count):
+        last_name = rng.choice(LAST_NAMES) if rng.random() < 0.2 else rng.choice(names)
+        doctors.append({"name": f"{rng.choice(FIRST_NAMES)} {last_name}", "department": "General",
+                        "specialization": "General", "timings": "Monday to Friday, 9:00 am to 5:00 pm"})
+    return doctors
+
+
+def misspell(name, rng):
+    """ Swap one vowel-ish letter, the way speech-to-text mishears a name ("Jon Smyth") """
+    letters = list(name)
+    positions = [i for i in range(1, len(letters)) if letters[i].isalpha() and letters[i - 1] != " "]
+    letters[rng.choice(positions)] = rng.choice("aeiouy")
+    return "".join(letters)
+
+
+def linear_scan(doctors, name):
+    query_name = name.lower()
+    return [doctor for doctor in doctors if query_name in doctor["name"].lower()]
+
+
+def timed(lookup, queries):
+    start = time.perf_counter()
+    for query in queries:
+        lookup(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--doctors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    doctors = make_doctors(args.doctors, rng)
+
+    start = time.perf_counter()
+    index = DoctorIndex(doctors)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    exact = [rng.choice(doctors)["name"] for _ in range(args.queries)]
+    # Callers often give only the surname ("Dr. Smith"), which matches every doctor sharing it
+    surname = [rng.choice(doctors)["name"].split()[-1] for _ in range(args.queries)]
+    misspelled = [misspell(rng.choice(doctors)["name"], rng) for _ in range(args.queries)]
+
+    print(f"doctors={args.doctors} distinct_name_tokens={len(index.name_tokens())} index_build_ms={build_ms:.1f}")
+    print(f"exact      scan_ms={timed(lambda q: linear_scan(doctors, q), exact):.3f} "
+          f"index_ms={timed(index.lookup, exact):.3f}")
+    print(f"surname    scan_ms={timed(lambda q: linear_scan(doctors, q), surname):.3f} "
+          f"index_ms={timed(index.lookup, surname):.3f}")
+    print(f"misspelled scan_ms={timed(lambda q: linear_scan(doctors, q), misspelled):.3f} "
+          f"index_ms={timed(index.lookup, misspelled):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" Prompt-prefix reuse: prompt tokens the LLM has to evaluate with and without a stable prompt prefix.
+
+Runs the load test twice against the stand-in server, whose Ollama side keeps a prefix cache of recent
+prompts and charges --prompt-ms-per-token for every token past the longest cached prefix. With
+STABLE_PROMPT_PREFIX=0 the final answer of a tool turn is requested without tools, which changes the
+start of the prompt (Llama templates render tools into the system block) and evaluates it again; with
+STABLE_PROMPT_PREFIX=1 every request of a call starts with the same system prompt and tools. For the
+Gemini server the second run also compares GEMINI_CONTEXT_CACHE.
+
+Usage: python benchmarks/bench_prompt_prefix.py [--app ollama] [--calls 100] [--prompt-ms-per-token 0.5]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_llm
+import load_test
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(load_test.APP_MODULES), default="ollama")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0.5)
+    args = parser.parse_args()
+
+    for stable in (False, True):
+        run_args = argparse.Namespace(
+            app=args.app, calls=args.calls, concurrency=args.concurrency, stream=False, conversations=None,
+            env=[f"STABLE_PROMPT_PREFIX={int(stable)}", f"GEMINI_CONTEXT_CACHE={int(stable)}",
+                 "LLM_MAX_IN_FLIGHT=64", "RESPONSE_CACHE_ENABLED=0"],
+            latency_ms=args.latency_ms, jitter_ms=0.0, fail_rate=0.0, invalid_args_rate=0.0,
+            prompt_ms_per_token=args.prompt_ms_per_token)
+        behaviour = fake_llm.Behaviour(latency_ms=args.latency_ms, jitter_ms=0, seed=1,
+                                       prompt_ms_per_token=args.prompt_ms_per_token)
+        result = load_test.run(run_args, behaviour)
+        evaluated = result["llm"].get("prompt_tokens_evaluated", 0)
+        cached = result["llm"].get("prompt_tokens_cached", 0)
+        print(json.dumps({
+            "app": args.app,
+            "stable_prefix": stable,
+            "errors": result["errors"],
+            "latency_ms": result["latency_ms"],
+            "prompt_tokens_evaluated_per_turn": round(evaluated / result["turns"], 1),
+            "prompt_cache_hit_ratio": round(cached / (cached + evaluated), 3) if cached + evaluated else None,
+        }))
+
+
+if __name__ == "__main__":
+    main()
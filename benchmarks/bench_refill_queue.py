@@ -0,0 +1,100 @@
+""" Refill write throughput: per-request Firestore add() against the write-behind RefillQueue.
+
+Both runs write through an in-process Firestore stand-in that charges a fixed round trip per RPC, so
+the comparison shows what batching and taking the write off the caller's path buy at a given network
+latency. Pass --emulator to use a real Firestore client instead (set FIRESTORE_EMULATOR_HOST to point
+it at the emulator).
+
+Usage: python benchmarks/bench_refill_queue.py [--writes 2000] [--callers 8] [--rtt-ms 30]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from refill_queue import FirestoreSink, MemorySink, RefillQueue
+
+COLLECTION = "prescription_refill_requests"
+
+
+class FakeCollection:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def add(self, data):
+        document_id = f"doc-{time.perf_counter_ns()}"
+        self.sink.commit([(document_id, data)])
+        return None, document_id
+
+
+def refill_record(number):
+    return {"patient_name": f"Patient {number}", "medicine_name": "Atorvastatin", "dosage": "20mg",
+            "doctor_name": "Jane Smith", "status": "order_confirmed"}
+
+
+def run_callers(writes, callers, write_one):
+    """ Issue ``writes`` refills from ``callers`` threads; returns (seconds, per-write latencies) """
+    latencies = []
+
+    def one(number):
+        start = time.perf_counter()
+        write_one(refill_record(number))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(callers) as pool:
+        list(pool.map(one, range(writes)))
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def summarize(name, writes, seconds, latencies, commits):
+    return {"mode": name, "writes": writes, "seconds": round(seconds, 3),
+            "writes_per_second": round(writes / seconds, 1),
+            "caller_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+            "caller_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+            "commits": commits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--callers", type=int, default=8, help="threads submitting refills concurrently")
+    parser.add_argument("--rtt-ms", type=float, default=30.0, help="simulated Firestore round trip per RPC")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--no-fsync", action="store_true", help="skip fsync of the journal on submit")
+    parser.add_argument("--emulator", action="store_true", help="write to a real Firestore client / emulator")
+    args = parser.parse_args()
+
+    if args.emulator:
+        from google.cloud import firestore
+        db = firestore.Client(project=os.getenv("GCLOUD_PROJECT", "demo-refills"))
+        direct_sink = queue_sink = FirestoreSink(db, COLLECTION)
+        add = db.collection(COLLECTION).add
+    else:
+        direct_sink = MemorySink(latency=args.rtt_ms / 1000)
+        queue_sink = MemorySink(latency=args.rtt_ms / 1000)
+        add = FakeCollection(direct_sink).add
+
+    seconds, latencies = run_callers(args.writes, args.callers, add)
+    print(json.dumps(summarize("per_request_add", args.writes, seconds, latencies,
+                               getattr(direct_sink, "commits", None))))
+
+    with tempfile.TemporaryDirectory() as directory:
+        queue = RefillQueue(queue_sink, os.path.join(directory, "journal.jsonl"), batch_size=args.batch_size,
+                            fsync=not args.no_fsync)
+        start = time.perf_counter()
+        _, latencies = run_callers(args.writes, args.callers, queue.submit)
+        queue.flush()
+        seconds = time.perf_counter() - start
+        queue.close()
+        print(json.dumps(summarize("write_behind_queue", args.writes, seconds, latencies,
+                                   getattr(queue_sink, "commits", None))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+""" Multi-process load test for the shared SQLite session backend.
+
+Each worker process runs simulated /chat turns (a little CPU work plus a fake LLM wait) against
+call_sids picked at random from a shared pool, so consecutive turns of one call land on different
+workers. At the end every history is checked for lost or interleaved turns, and throughput is
+reported per worker count.
+
+Usage: python benchmarks/bench_session_backend.py [--workers 1 2 4] [--turns 400]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_backends import SQLiteBackend, load_history
+from session_store import SessionStore
+
+SYSTEM_PROMPT = {"role": "system", "content": "You are an intelligent IVR assistant for a hospital."}
+
+
+def busy_work(milliseconds):
+    """ Stand-in for the CPU part of a turn (request building, JSON, tool code) """
+    end = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+async def run_worker(db_path, worker_id, turns, call_sids, concurrency, cpu_ms, llm_ms):
+    store = SessionStore("bench", backend=SQLiteBackend(db_path))
+    rng = random.Random(worker_id)
+    completed = Counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one_turn(turn):
+        call_sid = rng.choice(call_sids)
+        async with slots, store.turn(call_sid):
+            if call_sid not in store:
+                store[call_sid] = [SYSTEM_PROMPT]
+            store[call_sid].append({"role": "user", "content": f"worker {worker_id} turn {turn}"})
+            busy_work(cpu_ms)
+            await asyncio.sleep(llm_ms / 1000)
+            store[call_sid].append({"role": "assistant", "content": f"reply to worker {worker_id} turn {turn}"})
+        completed[call_sid] += 1
+
+    await asyncio.gather(*(one_turn(turn) for turn in range(turns)))
+    return completed
+
+
+def worker_main(args):
+    return asyncio.run(run_worker(*args))
+
+
+def check_histories(db_path, completed):
+    """ Every completed turn must have left exactly one user and one assistant message, in order """
+    backend = SQLiteBackend(db_path)
+    for call_sid, turns in completed.items():
+        history = load_history(backend._load(call_sid))
+        assert len(history) == 1 + 2 * turns, f"{call_sid}: expected {1 + 2 * turns} messages, got {len(history)}"
+        for user, assistant in zip(history[1::2], history[2::2]):
+            assert assistant["content"] == "reply to " + user["content"], f"{call_sid}: interleaved turns"
+
+
+def run(workers, turns, call_count, concurrency, cpu_ms, llm_ms):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "sessions.db")
+        call_sids = [f"call-{i}" for i in range(call_count)]
+        jobs = [(db_path, worker_id, turns // workers, call_sids, concurrency, cpu_ms, llm_ms)
+                for worker_id in range(workers)]
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(worker_main, jobs)
+        elapsed = time.perf_counter() - start
+
+        completed = sum(results, Counter())
+        check_histories(db_path, completed)
+        return {"workers": workers, "turns": sum(completed.values()), "seconds": round(elapsed, 3),
+                "turns_per_second": round(sum(completed.values()) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--turns", type=int, default=400, help="total turns per run, split across workers")
+    parser.add_argument("--calls", type=int, default=50, help="number of distinct call_sids")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent turns per worker")
+    parser.add_argument("--cpu-ms", type=float, default=5.0)
+    parser.add_argument("--llm-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        print(json.dumps(run(workers, args.turns, args.calls, args.concurrency, args.cpu_ms, args.llm_ms)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+""" Memory held by 10k live sessions, per history representation.
+
+Each session is the same short call: the system prompt, an opening question answered through a tool
+call and its result, then a few follow-up turns. It is built the way each server appends to history
+(the Ollama server also keeps the empty assistant message that requested the tool):
+
+- ollama_dicts: the Ollama server's previous plain dicts, tool results kept as JSON text
+- gemini_content: the Gemini server's previous types.Content objects (needs google-genai)
+- messages: messages.Message records, as an idle history holds them between turns
+- messages+ollama_wire / messages+gemini_wire: the same records with their request format cached,
+  as a history holds them while its turn runs
+
+Memory is measured with tracemalloc after building every session into a SessionStore. The time to
+convert one history to a request is reported for the first request of a turn and for the next one.
+
+Usage: python benchmarks/bench_session_memory.py [--sessions 10000] [--turns 4]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import messages
+from messages import ASSISTANT, SYSTEM, USER, Message
+from session_backends import MemoryBackend
+from session_store import SessionStore
+
+SYSTEM_TEXT = ("You are an intelligent IVR assistant for a hospital. Answer politely and professionally. "
+               "Use provided functions for hospital timings, address details, or doctor information when needed.")
+REPLY_TEXT = ("Dr. Jane Smith is in Cardiology and specializes in Heart Surgery. She sees patients on Monday, "
+              "Wednesday and Friday from 10 am to 12 pm. Is there anything else I can help you with?")
+FOLLOW_UPS = ["Which days does she see patients?", "And where is the hospital?", "What time do you open?",
+              "Thanks, that's all", "Can I also refill my prescription?"]
+
+
+def fresh(text):
+    # A new string object per message, like text decoded from a request or an LLM response
+    return (text + ".")[:-1]
+
+
+def doctor_result():
+    # A fresh dict per call, like a tool result
+    return {"name": "Jane Smith", "department": "Cardiology", "specialization": "Heart Surgery",
+            "timings": "Monday, Wednesday, Friday, 10:00 am to 12:00 pm"}
+
+
+def ollama_dicts(turns):
+    system_prompt = {"role": "system", "content": SYSTEM_TEXT}
+
+    def build():
+        tool_call_id = str(uuid.uuid4())
+        history = [system_prompt, {"role": "user", "content": "Can you tell me about Dr. Jane Smith?"},
+                   {"role": "assistant", "content": ""},
+                   {"role": "tool", "tool_call_id": tool_call_id,
+                    "function": {"name": "get_doctor_details", "arguments": {"name": "Jane Smith"}}},
+                   {"role": "tool", "tool_call_id": tool_call_id, "content": json.dumps(doctor_result())},
+                   {"role": "assistant", "content": fresh(REPLY_TEXT)}]
+        for turn in range(turns - 1):
+            history.append({"role": "user", "content": fresh(FOLLOW_UPS[turn % len(FOLLOW_UPS)])})
+            history.append({"role": "assistant", "content": fresh(REPLY_TEXT)})
+        return history
+
+    return build
+
+
+def gemini_content(turns):
+    from google.genai import types
+
+    system_prompt = types.Content(role="user", parts=[types.Part(text=SYSTEM_TEXT)])
+
+    def text(role, value):
+        return types.Content(role=role, parts=[types.Part(text=value)])
+
+    def build():
+        tool_call_id = str(uuid.uuid4())
+        history = [system_prompt, text("user", "Can you tell me about Dr. Jane Smith?"),
+                   text("model", json.dumps({"tool_call_id": tool_call_id, "function": {
+                       "name": "get_doctor_details", "arguments": {"name": "Jane Smith"}}})),
+                   text("user", json.dumps(doctor_result())),
+                   text("model", fresh(REPLY_TEXT))]
+        for turn in range(turns - 1):
+            history.append(text("user", fresh(FOLLOW_UPS[turn % len(FOLLOW_UPS)])))
+            history.append(text("model", fresh(REPLY_TEXT)))
+        return history
+
+    return build
+
+
+def message_records(turns, wire=None):
+    system_prompt = Message(SYSTEM, SYSTEM_TEXT)
+
+    def build():
+        tool_call_id = str(uuid.uuid4())
+        history = [system_prompt, Message(USER, "Can you tell me about Dr. Jane Smith?"), Message(ASSISTANT, ""),
+                   messages.tool_call(tool_call_id, "get_doctor_details", {"name": "Jane Smith"}),
+                   messages.tool_result(tool_call_id, doctor_result()),
+                   Message(ASSISTANT, fresh(REPLY_TEXT))]
+        for turn in range(turns - 1):
+            history.append(Message(USER, fresh(FOLLOW_UPS[turn % len(FOLLOW_UPS)])))
+            history.append(Message(ASSISTANT, fresh(REPLY_TEXT)))
+        if wire is not None:
+            wire(history)
+        return history
+
+    return build
+
+
+def measure(name, build, sessions):
+    """ Bytes held per session and build time for ``sessions`` live histories """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    store = SessionStore(name, backend=MemoryBackend(), max_sessions=sessions, max_messages=sessions * 100)
+    for index in range(sessions):
+        store[f"call-{index}"] = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return store, {"representation": name, "sessions": sessions, "messages_per_session": len(store["call-0"]),
+                   "mb": round(held / 1e6, 2), "bytes_per_session": held // sessions,
+                   "build_us_per_session": round(elapsed / sessions * 1e6, 1)}
+
+
+def conversion_us(history, convert, repeat=2000):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        messages.release(history)
+        convert(history)
+    cold = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        convert(history)
+    warm = (time.perf_counter() - started) / repeat
+    return {"first_request_us": round(cold * 1e6, 2), "next_request_us": round(warm * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=4, help="caller turns per session")
+    args = parser.parse_args()
+
+    variants = [("ollama_dicts", ollama_dicts(args.turns))]
+    try:
+        variants.append(("gemini_content", gemini_content(args.turns)))
+    except ImportError:
+        print(json.dumps({"representation": "gemini_content", "skipped": "google-genai is not installed"}))
+    variants += [("messages", message_records(args.turns)),
+                 ("messages+ollama_wire", message_records(args.turns, messages.to_ollama)),
+                 ("messages+gemini_wire", message_records(args.turns, messages.to_gemini))]
+
+    for name, build in variants:
+        store, result = measure(name, build, args.sessions)
+        del store
+        print(json.dumps(result))
+
+    history = message_records(args.turns)()
+    for name, convert in (("to_ollama", messages.to_ollama), ("to_gemini", messages.to_gemini)):
+        print(json.dumps({"conversion": name, "messages": len(history), **conversion_us(history, convert)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+""" Cold start: time from launching a server to /ready, and the latency of the first caller's turn.
+
+Each run starts a fresh stand-in LLM server whose first request per model pays --load-ms (an Ollama
+model load), launches the server process, polls /ready, then sends one /chat turn. With
+WARMUP_ON_BOOT=0 the server is ready as soon as it is imported and the first caller pays the model
+load; with WARMUP_ON_BOOT=1 readiness waits for the warm-up and the first turn runs at normal speed.
+
+Usage: python benchmarks/bench_startup.py [--app ollama] [--load-ms 3000] [--runs 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_llm
+import load_test
+
+
+def cold_start(app, warm_up, load_ms, latency_ms):
+    fake = fake_llm.start_server(fake_llm.Behaviour(latency_ms=latency_ms, jitter_ms=0, load_ms=load_ms))
+    fake_url = f"http://127.0.0.1:{fake.server_address[1]}"
+    port = load_test.free_port()
+    launched = time.perf_counter()
+    process = load_test.start_app(app, port, fake_url, {"WARMUP_ON_BOOT": "1" if warm_up else "0",
+                                                        "RESPONSE_CACHE_ENABLED": "0", "INTENT_ROUTER_ENABLED": "0"})
+    try:
+        launch_to_ready = time.perf_counter() - launched
+        status = json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/ready").read())
+        first_turn, ok = load_test.chat_turn(port, "cold-start", "Can you tell me about Dr. Jane Smith?", False)
+        second_turn, _ = load_test.chat_turn(port, "cold-start-2", "Can you tell me about Dr. Jane Smith?", False)
+    finally:
+        process.terminate()
+        process.wait(10)
+        fake.shutdown()
+    return {
+        "warm_up": warm_up,
+        "launch_to_ready_ms": round(launch_to_ready * 1000, 1),
+        "import_ms": round(status["imported_seconds"] * 1000, 1),
+        "import_to_ready_ms": round(status["ready_seconds"] * 1000, 1),
+        "first_turn_ms": round(first_turn * 1000, 1),
+        "second_turn_ms": round(second_turn * 1000, 1),
+        "first_turn_ok": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(load_test.APP_MODULES), default="ollama")
+    parser.add_argument("--load-ms", type=float, default=3000.0, help="simulated model load on first use")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="stand-in LLM latency per request")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    for warm_up in (False, True):
+        results = [cold_start(args.app, warm_up, args.load_ms, args.latency_ms) for _ in range(args.runs)]
+        median = {key: sorted(result[key] for result in results)[len(results) // 2]
+                  for key in results[0] if key.endswith("_ms")}
+        print(json.dumps({"app": args.app, "warm_up": warm_up, "runs": args.runs, "median": median,
+                          "all_first_turns_ok": all(result["first_turn_ok"] for result in results)}))
+
+
+if __name__ == "__main__":
+    main()
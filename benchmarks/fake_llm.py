@@ -0,0 +1,381 @@
+""" Stand-in Ollama and Gemini HTTP servers for load tests.
+
+One server answers both APIs: Ollama's POST /api/chat (plain JSON or NDJSON streaming) and Gemini's
+POST .../models/<model>:generateContent / :streamGenerateContent?alt=sse. Replies follow a tool-call
+script: the caller's last message is matched against rules, and a matching rule becomes a tool call
+for a tool the request declared; once tool results are in the conversation, a canned text reply is
+returned. Latency, jitter, failures (HTTP 500) and invalid tool arguments can be injected, as can
+a one-off model-load delay on the first request for each model. Prompt caching is simulated too: an
+Ollama prompt sharing a prefix with a recent one only evaluates (and is charged --prompt-ms-per-token
+for) the rest, and Gemini cachedContents can be created and referenced by generate requests.
+
+GET /stats returns request counts, POST /stats/reset clears them.
+
+Usage: python benchmarks/fake_llm.py [--port 11500] [--latency-ms 150] [--fail-rate 0.01]
+Then: OLLAMA_HOST=http://127.0.0.1:11500 python app.py
+ or   GEMINI_BASE_URL=http://127.0.0.1:11500 GEMINI_API_KEY=fake python gemini_llm_approach.py
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default tool-call script: (pattern on the caller's words, candidate tool names, arguments).
+# "$1" in an argument is replaced by the pattern's first group. The first candidate the request
+# declares is called, so one script works for both servers' tool names.
+DEFAULT_SCRIPT = [
+    {"match": r"\b(?:dr\.?|doctor)\s+([a-z]+(?: [a-z]+)?)", "tools": ["get_doctor_details"],
+     "arguments": {"name": "$1"}},
+    {"match": r"\brefill\b", "tools": ["refill_prescription", "request_prescription_refill"],
+     "arguments": {"doctor_name": "Jane Smith", "medication_name": "Atorvastatin", "medicine": "Atorvastatin",
+                   "quantity": "30", "dosage": "20mg", "patient_name": "Alex Doe"}},
+    {"match": r"\b(hours|open|close|timings?)\b", "tools": ["get_hospital_timings"], "arguments": {}},
+    {"match": r"\b(address|where|located|directions)\b", "tools": ["get_hospital_address"], "arguments": {}},
+]
+
+REPLY_TEXT = ("Thank you for calling MediCare General Hospital. Here is the information you asked for. "
+              "Is there anything else I can help you with today?")
+
+
+# Parallel slots of a stand-in Ollama model, each keeping its last prompt cached (OLLAMA_NUM_PARALLEL)
+PROMPT_CACHE_SLOTS = 4
+
+
+class Behaviour:
+    """ Latency, failure injection and the tool-call script shared by every request handler """
+
+    def __init__(self, latency_ms=150.0, jitter_ms=50.0, chunk_ms=10.0, fail_rate=0.0, invalid_args_rate=0.0,
+                 script=None, seed=None, load_ms=0.0, prompt_ms_per_token=0.0):
+        self.latency = latency_ms / 1000
+        self.load_time = load_ms / 1000
+        self.loaded = {}  # model -> Event set once it has finished loading
+        self.jitter = jitter_ms / 1000
+        self.chunk_delay = chunk_ms / 1000
+        self.fail_rate = fail_rate
+        self.invalid_args_rate = invalid_args_rate
+        self.script = [dict(rule, pattern=re.compile(rule["match"], re.IGNORECASE)) for rule in script or DEFAULT_SCRIPT]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.prompt_time = prompt_ms_per_token / 1000
+        self.recent_prompts = {}  # model -> recent prompts, the prefix cache of an Ollama server
+        self.cached_contents = {}  # name -> Gemini cachedContent
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def evaluate_prompt(self, model, prompt):
+        """ (tokens evaluated, tokens served from cache): the longest prefix shared with the last prompt of
+        one of the model's PROMPT_CACHE_SLOTS slots is cached, like llama.cpp keeping a KV cache per
+        parallel slot; evaluating costs prompt_ms_per_token per token """
+        with self.lock:
+            recent = self.recent_prompts.setdefault(model, [])
+            shared = max((len(os.path.commonprefix([prompt, previous])) for previous in recent), default=0)
+            recent.append(prompt)
+            del recent[:-PROMPT_CACHE_SLOTS]
+        cached = shared // 4
+        evaluated = max(1, len(prompt) // 4 + 1 - cached)
+        self.count("prompt_tokens_evaluated", evaluated)
+        self.count("prompt_tokens_cached", cached)
+        time.sleep(evaluated * self.prompt_time)
+        return evaluated, cached
+
+    def load(self, model):
+        """ The first request for a model pays the load time; requests arriving meanwhile wait for it """
+        with self.lock:
+            loaded = self.loaded.get(model)
+            first = loaded is None
+            if first:
+                loaded = self.loaded[model] = threading.Event()
+        if first:
+            self.count("model_loads")
+            time.sleep(self.load_time)
+            loaded.set()
+        loaded.wait()
+
+    def wait(self):
+        with self.lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.fail_rate
+
+    def plan(self, user_text, declared_tools, has_tool_results):
+        """ (tool name, arguments) to call, or None to answer with text """
+        if has_tool_results or not declared_tools:
+            return None
+        for rule in self.script:
+            found = rule["pattern"].search(user_text or "")
+            if not found:
+                continue
+            name = next((tool for tool in rule["tools"] if tool in declared_tools), None)
+            if name is None:
+                continue
+            group = found.group(1) if found.groups() else ""
+            arguments = {key: value.replace("$1", group.title()) if isinstance(value, str) else value
+                         for key, value in rule["arguments"].items()}
+            # Only keep arguments the declared tool accepts
+            accepted = declared_tools[name]
+            arguments = {key: value for key, value in arguments.items() if accepted is None or key in accepted}
+            with self.lock:
+                if arguments and self.random.random() < self.invalid_args_rate:
+                    arguments = {}
+            return name, arguments
+        return None
+
+
+def _estimate_tokens(payload):
+    return len(json.dumps(payload)) // 4 + 1
+
+
+def _chunks(text, size=4):
+    words = text.split(" ")
+    for start in range(0, len(words), size):
+        yield " ".join(words[start:start + size]) + (" " if start + size < len(words) else "")
+
+
+class Handler(BaseHTTPRequestHandler):
+    behaviour = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.behaviour.lock:
+                self._send_json(200, dict(self.behaviour.stats))
+        elif self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "0.0.0-fake"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/stats/reset":
+            with self.behaviour.lock:
+                self.behaviour.stats.clear()
+            self._send_json(200, {})
+            return
+
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            self._gemini_cache(request)
+            return
+
+        gemini = re.search(r"/models/([^/:]+):(generateContent|streamGenerateContent)", self.path)
+        if self.path.startswith("/api/chat"):
+            kind = "ollama"
+        elif gemini:
+            kind = "gemini"
+        else:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        self.behaviour.count(f"{kind}_requests")
+        self.behaviour.load(request.get("model", "fake") if kind == "ollama" else gemini.group(1))
+        self.behaviour.wait()
+        if self.behaviour.should_fail():
+            self.behaviour.count(f"{kind}_failures")
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        if kind == "ollama":
+            self._ollama_chat(request)
+        else:
+            self._gemini_generate(request, gemini.group(1), gemini.group(2) == "streamGenerateContent")
+
+    def _ollama_chat(self, request):
+        messages = request.get("messages") or []
+        declared = {tool["function"]["name"]: set(tool["function"].get("parameters", {}).get("properties", {}))
+                    for tool in request.get("tools") or []}
+        # Tool results of this turn are the messages after the caller's last message
+        last_user = max((index for index, message in enumerate(messages) if message.get("role") == "user"), default=-1)
+        has_results = any(message.get("role") == "tool" and message.get("content") for message in messages[last_user + 1:])
+        user_text = messages[last_user].get("content", "") if last_user >= 0 else ""
+        plan = self.behaviour.plan(user_text, declared, has_results)
+
+        model = request.get("model", "fake")
+        prompt_tokens, _ = self.behaviour.evaluate_prompt(model, json.dumps(request.get("tools") or [])
+                                                          + json.dumps(messages))
+        base = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        if plan is not None:
+            self.behaviour.count("ollama_tool_calls")
+            message = {"role": "assistant", "content": "",
+                       "tool_calls": [{"function": {"name": plan[0], "arguments": plan[1]}}]}
+        else:
+            message = {"role": "assistant", "content": REPLY_TEXT}
+        stats = {"done": True, "done_reason": "stop", "prompt_eval_count": prompt_tokens,
+                 "eval_count": _estimate_tokens(message), "total_duration": int(self.behaviour.latency * 1e9),
+                 "prompt_eval_duration": int((self.behaviour.latency * 0.3 + prompt_tokens * self.behaviour.prompt_time) * 1e9)}
+
+        if not request.get("stream", True):
+            self._send_json(200, {**base, "message": message, **stats})
+            return
+
+        self._start_stream("application/x-ndjson")
+        if plan is None:
+            for piece in _chunks(REPLY_TEXT):
+                time.sleep(self.behaviour.chunk_delay)
+                line = {**base, "message": {"role": "assistant", "content": piece}, "done": False}
+                self._write_chunk((json.dumps(line) + "\n").encode("utf-8"))
+            message = {"role": "assistant", "content": ""}
+        self._write_chunk((json.dumps({**base, "message": message, **stats}) + "\n").encode("utf-8"))
+        self._end_stream()
+
+    def _gemini_cache(self, request):
+        with self.behaviour.lock:
+            name = f"cachedContents/fake-{len(self.behaviour.cached_contents) + 1}"
+            self.behaviour.cached_contents[name] = request
+        self.behaviour.count("gemini_caches_created")
+        model = request.get("model", "").split("/")[-1]
+        self._send_json(200, {"name": name, "model": f"models/{model}",
+                              "usageMetadata": {"totalTokenCount": _estimate_tokens(request.get("contents") or [])}})
+
+    def _gemini_generate(self, request, model, stream):
+        contents = request.get("contents") or []
+        tools = request.get("tools") or []
+        cached_tokens = 0
+        if request.get("cachedContent"):
+            with self.behaviour.lock:
+                cache = self.behaviour.cached_contents.get(request["cachedContent"])
+            if cache is None:
+                self._send_json(404, {"error": {"code": 404, "message": "cached content not found", "status": "NOT_FOUND"}})
+                return
+            cached = cache.get("contents") or []
+            cached_tokens = _estimate_tokens(cached) + _estimate_tokens(cache.get("tools") or [])
+            prompt_tokens = cached_tokens + _estimate_tokens(contents)
+            contents, tools = cached + contents, cache.get("tools") or []
+        else:
+            prompt_tokens = _estimate_tokens(contents) + _estimate_tokens(tools)
+        self.behaviour.count("prompt_tokens_cached", cached_tokens)
+        self.behaviour.count("prompt_tokens_evaluated", prompt_tokens - cached_tokens)
+        declared = {}
+        for tool in tools:
+            for declaration in tool.get("functionDeclarations") or tool.get("function_declarations") or []:
+                properties = (declaration.get("parameters") or {}).get("properties")
+                declared[declaration["name"]] = set(properties) if properties is not None else set()
+
+        # The Gemini server records tool results as user messages holding JSON
+        last_text = ""
+        if contents and contents[-1].get("role") == "user":
+            last_text = "".join(part.get("text", "") for part in contents[-1].get("parts", []))
+        try:
+            has_results = isinstance(json.loads(last_text), dict)
+        except ValueError:
+            has_results = False
+        user_texts = [text for text in ("".join(part.get("text", "") for part in content.get("parts", []))
+                                        for content in contents if content.get("role") == "user")
+                      if not text.lstrip().startswith("{")]
+        plan = self.behaviour.plan(user_texts[-1] if user_texts else "", declared, has_results)
+
+        usage = {"promptTokenCount": prompt_tokens}
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        if plan is not None:
+            self.behaviour.count("gemini_tool_calls")
+            parts = [{"functionCall": {"name": plan[0], "args": plan[1]}}]
+        else:
+            parts = [{"text": REPLY_TEXT}]
+        usage["candidatesTokenCount"] = _estimate_tokens(parts)
+        usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+
+        def response(response_parts, final=True):
+            candidate = {"content": {"role": "model", "parts": response_parts}, "index": 0}
+            if final:
+                candidate["finishReason"] = "STOP"
+            return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": model}
+
+        if not stream:
+            self._send_json(200, response(parts))
+            return
+
+        self._start_stream("text/event-stream")
+        pieces = [[{"text": piece}] for piece in _chunks(REPLY_TEXT)] if plan is None else [parts]
+        for index, piece in enumerate(pieces):
+            time.sleep(self.behaviour.chunk_delay)
+            event = json.dumps(response(piece, final=index == len(pieces) - 1))
+            self._write_chunk(f"data: {event}\r\n\r\n".encode("utf-8"))
+        self._end_stream()
+
+
+def start_server(behaviour, host="127.0.0.1", port=0):
+    """ Serve in a background thread; returns the server (its port is server.server_address[1]) """
+    handler = type("BoundHandler", (Handler,), {"behaviour": behaviour})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="time before each LLM reply")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--chunk-ms", type=float, default=10.0, help="delay between streamed chunks")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--invalid-args-rate", type=float, default=0.0,
+                        help="share of tool calls sent without their arguments")
+    parser.add_argument("--script", help="JSON file with tool-call rules replacing the default script")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--load-ms", type=float, default=0.0, help="extra delay on the first request for each model")
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0.0,
+                        help="Ollama prompt evaluation time per token not already in the prefix cache")
+
+
+def behaviour_from_args(args):
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as script_file:
+            script = json.load(script_file)
+    return Behaviour(args.latency_ms, args.jitter_ms, args.chunk_ms, args.fail_rate, args.invalid_args_rate,
+                     script, args.seed, args.load_ms, args.prompt_ms_per_token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(behaviour_from_args(args), args.host, args.port)
+    print(f"Fake Ollama / Gemini server on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
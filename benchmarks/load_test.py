@@ -0,0 +1,217 @@
+""" Load test for the /chat endpoints against the stand-in LLM server.
+
+Starts benchmarks/fake_llm.py in-process, runs the chosen server (app.py for Ollama,
+gemini_llm_approach.py for Gemini) in a subprocess pointed at it, then drives many concurrent
+call_sids through multi-turn conversations. Reports throughput, p50/p95/p99 turn latency, errors,
+server memory growth (RSS, Linux) and LLM requests per turn as one JSON object per run, appended to
+--output so runs can be compared over time.
+
+Usage: python benchmarks/load_test.py --app ollama --calls 200 --concurrency 32 [--stream]
+                                      [--latency-ms 150 --fail-rate 0.01] [--env RESPONSE_CACHE_ENABLED=0]
+"""
+import argparse
+import atexit
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULES = {"ollama": "app", "gemini": "gemini_llm_approach"}
+
+# Runs one server module under a threaded WSGI server on the given port
+SERVE_APP = (
+    "import importlib, logging, sys\n"
+    "from werkzeug.serving import make_server\n"
+    "logging.getLogger('werkzeug').setLevel(logging.WARNING)\n"
+    "module = importlib.import_module(sys.argv[1])\n"
+    "make_server('127.0.0.1', int(sys.argv[2]), module.app, threaded=True).serve_forever()\n"
+)
+
+DEFAULT_CONVERSATIONS = [
+    ["Hi, I'd like to know about Dr. Jane Smith", "Which days does she see patients?", "Thanks, that's all"],
+    ["What are your opening hours?", "And where are you located?"],
+    ["I need a refill of my prescription", "It was prescribed by Dr. Jane Smith", "Thank you"],
+    ["Can you tell me about doctor John Doe?", "Is he a surgeon?"],
+    ["Hello, is this the hospital?", "How do I get to you?"],
+]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def rss_mb(pid):
+    """ Resident memory of a process in MB, None where /proc is unavailable """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def load_conversations(path):
+    if not path:
+        return DEFAULT_CONVERSATIONS
+    conversations = []
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip():
+                entry = json.loads(line)
+                conversations.append(entry["turns"] if isinstance(entry, dict) else entry)
+    return conversations
+
+
+def start_app(app, port, fake_url, extra_env):
+    # Refills and sessions written by the server under test go to a scratch directory, never the checkout,
+    # so a later real run does not replay fake refills into Firestore
+    scratch = tempfile.mkdtemp(prefix="load-test-")
+    atexit.register(shutil.rmtree, scratch, True)
+    env = {**os.environ, "OLLAMA_HOST": fake_url, "GEMINI_BASE_URL": fake_url,
+           "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "fake-key"),
+           "REFILL_JOURNAL_PATH": os.path.join(scratch, "refill_journal.jsonl"),
+           "SESSION_SQLITE_PATH": os.path.join(scratch, "sessions.db"), **extra_env}
+    process = subprocess.Popen([sys.executable, "-c", SERVE_APP, APP_MODULES[app], str(port)], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{APP_MODULES[app]} exited with code {process.returncode} during startup")
+        try:
+            # /ready answers 503 until warm-up is done, which urlopen raises as an HTTPError (an OSError)
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{APP_MODULES[app]} was not ready within 60 seconds")
+
+
+def chat_turn(port, call_sid, text, stream):
+    """ One /chat (or /chat/stream) request; returns (seconds, ok) """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    body = json.dumps({"call_sid": call_sid, "user_input": text})
+    start = time.perf_counter()
+    try:
+        connection.request("POST", "/chat/stream" if stream else "/chat", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        payload = response.read()
+        ok = response.status == 200 and (b"event: done" in payload if stream else b'"response"' in payload)
+    except OSError:
+        ok = False
+    finally:
+        connection.close()
+    return time.perf_counter() - start, ok
+
+
+def run_call(port, conversation, stream):
+    call_sid = f"load-{uuid.uuid4().hex[:12]}"
+    return [chat_turn(port, call_sid, text, stream) for text in conversation]
+
+
+def run(args, behaviour):
+    fake = fake_llm.start_server(behaviour)
+    fake_url = f"http://127.0.0.1:{fake.server_address[1]}"
+    extra_env = dict(pair.split("=", 1) for pair in args.env)
+    conversations = load_conversations(args.conversations)
+
+    port = free_port()
+    process = start_app(args.app, port, fake_url, extra_env)
+    try:
+        # Warm up imports, indexes and connections before measuring
+        for conversation in conversations[:2]:
+            run_call(port, conversation, args.stream)
+        urllib.request.urlopen(urllib.request.Request(f"{fake_url}/stats/reset", b"{}", method="POST")).read()
+        rss_start = rss_mb(process.pid)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(lambda index: run_call(port, conversations[index % len(conversations)], args.stream),
+                                    range(args.calls)))
+        elapsed = time.perf_counter() - start
+        rss_end = rss_mb(process.pid)
+        llm_stats = json.loads(urllib.request.urlopen(f"{fake_url}/stats").read())
+    finally:
+        process.terminate()
+        process.wait(10)
+        fake.shutdown()
+
+    turns = [turn for call in results for turn in call]
+    latencies = sorted(seconds for seconds, _ in turns)
+    errors = sum(1 for _, ok in turns if not ok)
+    llm_requests = llm_stats.get(f"{args.app}_requests", 0)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": git_revision(),
+        "app": args.app,
+        "stream": args.stream,
+        "calls": args.calls,
+        "concurrency": args.concurrency,
+        "turns": len(turns),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(len(turns) / elapsed, 2),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 1)
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "rss_mb": {"start": rss_start, "end": rss_end,
+                   "growth": round(rss_end - rss_start, 1) if rss_start is not None and rss_end is not None else None},
+        "llm_requests_per_turn": round(llm_requests / len(turns), 3),
+        "llm": llm_stats,
+        "fake_llm": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "fail_rate": args.fail_rate,
+                     "invalid_args_rate": args.invalid_args_rate, "prompt_ms_per_token": args.prompt_ms_per_token},
+        "env": extra_env,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(APP_MODULES), default="ollama")
+    parser.add_argument("--calls", type=int, default=200, help="number of simulated calls")
+    parser.add_argument("--concurrency", type=int, default=32, help="calls in progress at once")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--conversations", help="JSONL file of conversations ({\"turns\": [...]} per line)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the server under test")
+    parser.add_argument("--output", default="benchmarks/results.jsonl", help="JSONL file results are appended to")
+    fake_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    result = run(args, fake_llm.behaviour_from_args(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as output:
+            output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+
+# Time a caller may wait for an answer, counted from when the request reached the server
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "6"))
+
+# Extra time a turn may keep running in the background after the caller got the fallback reply
+TURN_BACKGROUND_SECONDS = float(os.getenv("TURN_BACKGROUND_SECONDS", "30"))
+
+# Said to the caller when the deadline passes; the real answer is still added to their history
+FALLBACK_REPLY = os.getenv(
+    "FALLBACK_REPLY",
+    "I'm sorry, that is taking a little longer than expected. Please give me a moment, then ask me again.")
+
+# A hedged duplicate LLM request is sent once the first one runs past this latency percentile
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+
+# Requests observed per stage before hedging starts, so the percentile means something
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Recent latencies per stage the hedge percentile is taken from
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "500"))
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("turn_deadline_fallbacks_total", "Turns answered with the fallback reply because the deadline passed")
+metrics.describe("hedged_requests_total", "Hedged LLM requests by stage and result (sent, won = the hedge answered first)")
+
+_current = contextvars.ContextVar("turn_deadline", default=None)
+_latencies = {}  # stage -> deque of recent seconds
+_background = set()  # turns still finishing after the caller got the fallback
+
+
+class TurnDeadline:
+    """ Time budget of one turn, started when the request arrived and read by every stage of the turn """
+
+    def __init__(self, budget=TURN_DEADLINE_SECONDS, started=None):
+        self.started = time.monotonic() if started is None else started
+        self.expires = self.started + budget
+        # Hard stop for a turn finishing in the background, so a hung request cannot hold the session forever
+        self.abandons = self.expires + TURN_BACKGROUND_SECONDS
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def stage_timeout(self, timeout=None):
+        """ Longest one stage may still take: its own timeout, cut short by the hard stop """
+        left = max(0.0, self.abandons - time.monotonic())
+        return left if timeout is None else min(timeout, left)
+
+
+@contextlib.contextmanager
+def use(deadline):
+    """ Make ``deadline`` the current turn's deadline; None leaves the turn unbounded """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def remaining():
+    """ Seconds left for the current turn, None without a deadline """
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def expired():
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+
+def stage_timeout(timeout=None):
+    """ ``timeout`` bounded by the current turn's hard stop """
+    deadline = _current.get()
+    return timeout if deadline is None else deadline.stage_timeout(timeout)
+
+
+def observe_latency(stage, seconds):
+    _latencies.setdefault(stage, deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+
+def hedge_delay(stage):
+    """ How long to wait for a request of this stage before hedging, None until enough were seen """
+    recent = _latencies.get(stage)
+    if not recent or len(recent) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(recent)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+
+async def hedged(stage, request, hedge_request=None):
+    """ Await ``request()``; if it runs past the stage's latency percentile, also start ``hedge_request()``
+    and return whichever answers first. The loser is cancelled; one failing waits for the other. """
+    started = time.monotonic()
+    delay = hedge_delay(stage) if hedge_request is not None else None
+    primary = asyncio.ensure_future(request())
+    tasks = [primary]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.append(asyncio.ensure_future(hedge_request()))
+                metrics.inc("hedged_requests_total", stage=stage, result="sent")
+
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in tasks if task in done and not task.exception()]
+            if winners:
+                if winners[0] is not primary:
+                    metrics.inc("hedged_requests_total", stage=stage, result="won")
+                observe_latency(stage, time.monotonic() - started)
+                return winners[0].result()
+            if not pending:
+                return primary.result()  # Both failed: raise the original request's error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            else:
+                _retrieve_outcome(task)
+
+
+def _retrieve_outcome(task):
+    # The turn's own error was already raised or logged; this only keeps asyncio from warning again
+    if not task.cancelled():
+        task.exception()
+
+
+def _finish_in_background(task):
+    metrics.inc("turn_deadline_fallbacks_total")
+    _background.add(task)
+
+    def finished(task):
+        _background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Turn finishing after the fallback reply failed", exc_info=task.exception())
+
+    task.add_done_callback(finished)
+
+
+async def answer_within(coro):
+    """ The turn's answer, or FALLBACK_REPLY once the deadline passes while the turn keeps running """
+    if remaining() is None:
+        return await coro
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), remaining())
+    except asyncio.TimeoutError:
+        _finish_in_background(task)
+        return FALLBACK_REPLY
+
+
+async def stream_within(agen):
+    """ Stream the turn's output, or yield FALLBACK_REPLY if nothing was produced before the deadline.
+
+    After the fallback the turn runs on in the background; once the answer has started, the stream is
+    no longer cut short.
+    """
+    if remaining() is None:
+        async for item in agen:
+            yield item
+        return
+
+    items = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put_nowait((True, item))
+        finally:
+            items.put_nowait((False, None))
+
+    task = asyncio.ensure_future(pump())
+    detached = False
+    try:
+        try:
+            produced, item = await asyncio.wait_for(items.get(), remaining())
+        except asyncio.TimeoutError:
+            detached = True
+            _finish_in_background(task)
+            yield FALLBACK_REPLY
+            return
+        while produced:
+            yield item
+            produced, item = await items.get()
+        await task  # Raises the turn's error, if it ended with one
+    finally:
+        # The caller went away; close the turn as an unbounded stream would
+        if not detached and not task.done():
+            task.cancel()
@@ -0,0 +1,146 @@
+import heapq
+import itertools
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+TOKEN = re.compile(r"[a-z]+")
+
+# Titles speech-to-text often keeps in front of a name ("Doctor Jane Smith")
+HONORIFICS = {"dr", "doctor", "doc", "mr", "mrs", "ms", "miss", "prof", "professor"}
+
+# A misheard name token must be at least this similar to a directory token to count
+MIN_TOKEN_SIMILARITY = 0.6
+
+# Fuzzy candidates scoring within this margin of the best one are reported as multiple matches
+FUZZY_MATCH_MARGIN = 0.15
+
+# Never report more than this many doctors back to the model, exact or fuzzy; a common surname
+# such as "Smith" would otherwise list hundreds of names in one tool result
+MAX_MATCHES = 5
+
+_SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ["aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"]) for letter in letters}
+
+
+def soundex(token):
+    """ Four character Soundex key, so "smyth" and "smith" share a bucket """
+    codes = [_SOUNDEX_CODES.get(letter, "0") for letter in token]
+    key = token[0].upper()
+    previous = codes[0]
+    for letter, code in zip(token[1:], codes[1:]):
+        if code != "0" and code != previous:
+            key += code
+        # 'h' and 'w' do not separate letters with the same code
+        if letter not in "hw":
+            previous = code
+    return (key + "000")[:4]
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class DoctorIndex:
+    """ Prebuilt lookup structure over the doctors list.
+
+    Exact lookups keep the original "query is a substring of the name" behaviour, but use a trigram
+    index instead of scanning every doctor. When nothing matches exactly, misspelled or misheard
+    names fall back to ranked fuzzy matching on phonetic (Soundex) keys of the name tokens.
+    """
+
+    def __init__(self, doctors):
+        self.doctors = list(doctors)
+        self._names = [doctor["name"].lower() for doctor in self.doctors]
+        self._trigrams = defaultdict(set)
+        self._token_doctors = defaultdict(set)
+        self._phonetic_tokens = defaultdict(set)
+
+        for doctor_id, name in enumerate(self._names):
+            for gram in trigrams(name):
+                self._trigrams[gram].add(doctor_id)
+            for token in set(TOKEN.findall(name)):
+                self._token_doctors[token].add(doctor_id)
+                self._phonetic_tokens[soundex(token)].add(token)
+
+    def lookup(self, name):
+        """ At most MAX_MATCHES doctors matching the name, best match first. Exact substring matches keep list order """
+        query = name.lower().strip()
+        if not query:
+            return []
+
+        matches = self._substring_matches(query)
+        if not matches:
+            matches = self._fuzzy_matches(query)
+        return [self.doctors[doctor_id] for doctor_id in matches]
+
+    def name_tokens(self):
+        """ Every lowercase token appearing in a doctor's name """
+        return set(self._token_doctors)
+
+    def _substring_matches(self, query):
+        if len(query) < 3:
+            return list(itertools.islice(
+                (doctor_id for doctor_id, name in enumerate(self._names) if query in name), MAX_MATCHES))
+
+        postings = sorted((self._trigrams.get(gram, ()) for gram in trigrams(query)), key=len)
+        if not postings[0]:
+            return []
+        candidates = set(postings[0]).intersection(*postings[1:])
+        # Trigrams can match out of order, so confirm the real substring
+        return heapq.nsmallest(MAX_MATCHES, (doctor_id for doctor_id in candidates if query in self._names[doctor_id]))
+
+    def _fuzzy_matches(self, query):
+        tokens = [token for token in TOKEN.findall(query) if token not in HONORIFICS]
+        if not tokens:
+            return []
+
+        # For each recognised query token: the similar directory tokens and the doctors carrying them
+        token_matches = []
+        for token in tokens:
+            similar = []
+            for candidate in self._phonetic_tokens.get(soundex(token), ()):
+                similarity = SequenceMatcher(None, token, candidate).ratio()
+                if similarity >= MIN_TOKEN_SIMILARITY:
+                    similar.append((similarity, self._token_doctors[candidate]))
+            if similar:
+                token_matches.append(similar)
+
+        if not token_matches:
+            return []
+
+        # Every doctor carrying one similar token per query token scores the same, so score token
+        # combinations (best first) and intersect their doctor sets instead of scoring each doctor
+        combinations = sorted(
+            ((sum(similarity for similarity, _ in combination) / len(tokens), combination)
+             for combination in itertools.product(*token_matches)),
+            key=lambda item: -item[0],
+        )
+
+        scores = {}
+        best_score = None
+        for score, combination in combinations:
+            if best_score is not None and score < best_score - FUZZY_MATCH_MARGIN:
+                break
+            doctor_ids = combination[0][1].intersection(*(ids for _, ids in combination[1:]))
+            if not doctor_ids:
+                continue
+            if best_score is None:
+                if score < MIN_TOKEN_SIMILARITY:
+                    return []
+                best_score = score
+            for doctor_id in heapq.nsmallest(MAX_MATCHES, doctor_ids):
+                scores.setdefault(doctor_id, score)
+
+        if not scores:
+            return self._single_token_matches(token_matches, len(tokens))
+
+        ranked = heapq.nsmallest(MAX_MATCHES, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [doctor_id for doctor_id, _ in ranked]
+
+    def _single_token_matches(self, token_matches, token_count):
+        """ No doctor carries every token, so rank on the closest single token without scoring each doctor """
+        similarity, doctor_ids = max((entry for similar in token_matches for entry in similar), key=lambda entry: entry[0])
+        if similarity / token_count < MIN_TOKEN_SIMILARITY:
+            return []
+        return heapq.nsmallest(MAX_MATCHES, doctor_ids)
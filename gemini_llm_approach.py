@@ -1,45 +1,68 @@
+# First, so the import-to-ready time covers loading every dependency
+import startup
+import asyncio
 import os
 import json
-import asyncio
+import logging
+import time
 import uuid
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from google import genai
 from google.genai import types
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
 from datetime import datetime
-
-# Initialize Firebase (do this once)
-if not firebase_admin._apps:
-    cred = credentials.Certificate("firebase_key.json")  # Replace with your actual path
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+from serving import run_turn, stream_turn
+from streaming import sse_sentences
+import deadline
+import metrics
+import tracing
+import resilience
+import hospital_tools
+import intent_router
+from hospital_tools import get_doctor_details
+from tool_registry import ToolArgumentError
+from tool_ledger import FAILED, INVALID, SUCCEEDED, ToolCallLedger
+from session_store import SessionStore
+from response_cache import ResponseCache
+from speculation import Speculation
+from refill_queue import FirestoreSink, RefillQueue
+from history_compaction import compact_history
+from messages import (ASSISTANT, RECORD_FORMAT, SYSTEM, USER, Message, describe, release, to_gemini, tool_call,
+                      tool_result)
+
+logger = logging.getLogger(__name__)
+
+
+def connect_firestore():
+    """ Initialize Firebase (once) and return a Firestore client; deferred until the first refill commit """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate("firebase_key.json")  # Replace with your actual path
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+
+firestore_db = startup.Lazy("firestore", connect_firestore)
+
+# Write-behind queue for refill records, replaying anything left unacknowledged by a previous run
+refill_queue = RefillQueue(FirestoreSink(firestore_db.get, "prescription_refill_requests"))
 
 app = Flask(__name__)
 
-# Doctors list
-doctors = [
-    {"name": "John Doe", "department": "Pulmonology", "specialization": "Surgery",
-     "timings": "Monday to Friday, 3:00 pm to 5:00 pm"},
-    {"name": "Jane Smith", "department": "Cardiology", "specialization": "Heart Surgery",
-     "timings": "Monday, Wednesday, Friday, 10:00 am to 12:00 pm"},
-    {"name": "Emily Johnson", "department": "Neurology", "specialization": "Brain Surgery",
-     "timings": "Tuesday and Thursday, 1:00 pm to 3:00 pm"},
-    {"name": "Michael Brown", "department": "Orthopedics", "specialization": "Knee Replacement",
-     "timings": "Monday to Friday, 9:00 am to 11:00 am"},
-    {"name": "Sarah Lee", "department": "Dermatology", "specialization": "Skin Treatment",
-     "timings": "Monday to Friday, 2:00 pm to 4:00 pm"},
-    {"name": "William Clark", "department": "Ophthalmology", "specialization": "Cataract Surgery",
-     "timings": "Monday to Friday, 10:00 am to 12:00 pm"},
-    {"name": "John Smith", "department": "Pediatrics", "specialization": "Child Care",
-     "timings": "Monday to Friday, 11:00 am to 1:00 pm"}
-]
+# Shared hospital tools plus this server's Firestore-backed refill tool
+registry = hospital_tools.registry.extend()
 
 
 # Function to handle prescription refill
-def request_prescription_refill(patient_name, doctor_name, medicine, dosage):
+@registry.tool("Handles a prescription refill request after verifying the doctor.", params={
+    "patient_name": "Full name of the patient",
+    "doctor_name": "Full name of the prescribing doctor",
+    "medicine": "Name of the medicine requested",
+    "dosage": "Dosage amount",
+}, timeout=10, side_effects=True)
+def request_prescription_refill(patient_name: str, doctor_name: str, medicine: str, dosage: str):
     try:
         doctor_info = get_doctor_details(doctor_name)
         if "error" in doctor_info or "multiple_matches" in doctor_info:
@@ -58,401 +81,525 @@ def request_prescription_refill(patient_name, doctor_name, medicine, dosage):
             "updated_at": now.isoformat()
         }
 
-        # Add to Firestore
-        doc_ref = db.collection("prescription_refill_requests").add(refill_data)
-        print(f"Added document with ID: {doc_ref[1].id}")
-        doc_id = doc_ref[1].id  
+        # Journal locally and confirm; the Firestore write is committed in the background in batches
+        doc_id = refill_queue.submit(refill_data)
+        logger.info("Queued refill document %s", doc_id)
 
         return {
             "confirmation": f"Prescription refill recorded for patient {patient_name} with prescription ID {doc_id}.",
             "prescription_id": doc_id,
             "details": refill_data
         }
-    except Exception as e:
-        print(f"Error: {str(e)}")
-
-
+    except Exception:
+        logger.exception("Prescription refill failed")
+        raise
 
-# Function to return hospital timings
-def get_hospital_timings(dummy_param=None):
-    return {
-        "operating_days": "Monday to Friday",
-        "opening_time": "8:00 AM",
-        "closing_time": "6:00 PM",
-        "closed_days": "Saturday and Sunday"
-    }
 
 
-# Function to return hospital address
-def get_hospital_address(dummy_param=None):
-    return {
-        "name": "MediCare General Hospital",
-        "street": "1234 Wellness Avenue",
-        "city": "Springfield",
-        "state": "IL",
-        "zipcode": "62704",
-        "country": "USA"
-    }
-
-
-# Function to return doctor details
-def get_doctor_details(name):
-    query_name = name.lower()
-    matches = [doctor for doctor in doctors if query_name in doctor["name"].lower()]
-
-    if len(matches) == 1:
-        return matches[0]
-    elif len(matches) > 1:
-        return {"multiple_matches": [doctor["name"] for doctor in matches]}
-    return {"error": "Doctor not found"}
+# Conversation history
+conversation_history = SessionStore(
+    "gemini",  # Evicts idle and least recently used calls
+    to_record=Message.to_record,
+    from_record=Message.from_record,
+    release=release,
+    record_format=RECORD_FORMAT,
+)
 
+# Answers to opening questions, revalidated against fresh tool results on every hit
+response_cache = ResponseCache("gemini", registry)
 
-# Conversation history
-conversation_history = {}
-
-# Corrected system prompt in types.Content format
-system_prompt = types.Content(
-    role="user",  # Using 'user' for system prompt as 'system' is not supported by Gemini
-    parts=[
-        types.Part(
-            text="""You are an intelligent IVR assistant for a hospital. 
+# System prompt; sent to Gemini as a user turn, since 'system' is not a Gemini content role
+system_prompt = Message(
+    SYSTEM,
+    """You are an intelligent IVR assistant for a hospital. 
                  Answer politely and professionally. Use provided functions for hospital timings, address details, or doctor information when needed. 
                  If multiple doctors match the name provided, ask the user to specify the full name.
                  If a prescription refill request has been placed successfully and the request data is given as input, tell the user that it has been successfully places and give the user the prescription_id of the request.
                  Finally answer anything again if the user asks a question again."""
-        )
-    ]
 )
 
 # Gemini API configuration
 genai_api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=genai_api_key)
-
-# Define function declarations for Gemini
-functions = [
-    {
-        "name": "get_hospital_timings",
-        "description": "Provides operating hours of the hospital.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "dummy_param": {
-                    "type": "string",
-                    "description": "Dummy parameter, not used."
-                }
-            },
-            "required": []
-        },
-    },
-    {
-        "name": "get_hospital_address",
-        "description": "Provides the full address of the hospital.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "dummy_param": {
-                    "type": "string",
-                    "description": "Dummy parameter, not used."
-                }
-            },
-            "required": []
-        },
-    },
-    {
-        "name": "get_doctor_details",
-        "description": "Provides details of a specified doctor.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "name": {
-                    "type": "string",
-                    "description": "Doctor's name to retrieve details."
-                }
-            },
-            "required": ["name"]
-        }
-    },
-    {
-        "name": "request_prescription_refill",
-        "description": "Handles a prescription refill request after verifying the doctor.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "patient_name": {
-                    "type": "string",
-                    "description": "Full name of the patient"
-                },
-                "doctor_name": {
-                    "type": "string",
-                    "description": "Full name of the prescribing doctor"
-                },
-                "medicine": {
-                    "type": "string",
-                    "description": "Name of the medicine requested"
-                },
-                "dosage": {
-                    "type": "string",
-                    "description": "Dosage amount"
-                }
-            },
-            "required": ["patient_name", "doctor_name", "medicine", "dosage"]
-        }
-    }
 
-]
+# Alternative Gemini endpoint, e.g. the stand-in server used by benchmarks/load_test.py
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+def connect_genai():
+    """ Build the Gemini client on first use """
+    return genai.Client(
+        api_key=genai_api_key,
+        http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+    )
+
+
+genai_client = startup.Lazy("genai", connect_genai)
+
+# Function declarations for Gemini, built once from the tool registry
+functions = registry.gemini_declarations()
+
+metrics.describe("chat_turns_total", "Chat turns by number of LLM round trips (single_call or two_call)")
 
 tools = types.Tool(function_declarations=functions)
 config = types.GenerateContentConfig(tools=[tools])
 
-# Available functions mapping
-available_functions = {
-    "get_hospital_timings": get_hospital_timings,
-    "get_hospital_address": get_hospital_address,
-    "get_doctor_details": get_doctor_details,
-    "request_prescription_refill": request_prescription_refill,
-}
-
-# Retry logic for failed function calls
-MAX_RETRY_ATTEMPTS = 2
+# Set to 1 to keep the system prompt and tool declarations in a Gemini context cache and send only the
+# conversation. Off by default: this prompt is below the models' minimum cached size, so the cache is refused
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
 
+# Lifetime of the cached prefix; it is recreated a minute before it expires
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
 
-async def final_check(call_sid):
-    """ Retry failed function calls if necessary """
-    failed_tool_calls = [
-        msg for msg in conversation_history[call_sid]
-        if msg.role == "user" and "error" in msg.parts[0].text.lower()
-    ]
-
-    # Remove error responses from conversation history
-    conversation_history[call_sid] = [
-        msg for msg in conversation_history[call_sid]
-        if not (msg.role == "user" and "error" in msg.parts[0].text.lower())
-    ]
-
-    updated_tool_calls = []
-    for message in failed_tool_calls:
-        tool_call_id = json.loads(message.parts[0].text).get("tool_call_id")
-        original_call = next(
-            (msg for msg in conversation_history[call_sid]
-             if msg.role == "model" and tool_call_id in str(msg.parts)),
-            None
-        )
-
-        if original_call:
-            function_name = json.loads(original_call.parts[0].text).get("function").get("name")
-            arguments = json.loads(original_call.parts[0].text).get("function").get("arguments", {})
-            function_to_call = available_functions.get(function_name)
-
-            if function_to_call:
-                retry_count = 0
-                function_response = None
-                success = False
-
-                while retry_count < MAX_RETRY_ATTEMPTS and not success:
-                    try:
-                        function_response = function_to_call(**arguments) if arguments else function_to_call()
-                        success = True
-                        updated_tool_calls.append(
-                            types.Content(role="user", parts=[types.Part(text=json.dumps(function_response))])
-                        )
-                    except Exception as e:
-                        retry_count += 1
-                        success = False
-                        if retry_count >= MAX_RETRY_ATTEMPTS:
-                            updated_tool_calls.append(
-                                types.Content(role="model", parts=[
-                                    types.Part(text=json.dumps(
-                                        {"error": f"Retry failed after {MAX_RETRY_ATTEMPTS} attempts: {str(e)}"}
-                                    ))
-                                ])
-                            )
-
-    # Add retried results to conversation history
-    conversation_history[call_sid].extend(updated_tool_calls)
+# Wait before trying again to create a cache the model refused
+CONTEXT_CACHE_RETRY_SECONDS = 600
 
+_prefix_caches = {}  # model -> (cache name or None, valid until)
+_prefix_cache_lock = asyncio.Lock()
 
-async def generate_response(model: str, call_sid: str):
-    """ Generate a response using Gemini with function calling support """
+# Retry logic for failed function calls
+MAX_RETRY_ATTEMPTS = 2
 
-    # Use conversation history directly since it's in types.Content format
+# Model writing the caller-facing reply
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+# Smaller model for the function-selection call (e.g. gemini-2.0-flash-lite); empty uses GEMINI_MODEL
+GEMINI_TOOL_MODEL = os.getenv("GEMINI_TOOL_MODEL", "")
+
+# Re-run function selection on the reply model when the tool model produced invalid arguments
+TOOL_MODEL_FALLBACK = os.getenv("TOOL_MODEL_FALLBACK", "1") == "1"
+
+# Model that slow function-selection calls are hedged to (e.g. gemini-2.0-flash-lite); empty disables hedging
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL", "")
+
+metrics.describe("tool_model_fallbacks_total", "Tool selections redone on the reply model after invalid arguments")
+
+
+async def final_check(call_sid, ledger):
+    """ Retry this turn's failed function calls from the ledger and record their final outcome """
+    for record in ledger.failed():
+        # Failed calls already passed validation, so this only looks the function up again
+        function_to_call, arguments = registry.prepare(record.name, record.arguments)
+
+        # Retry with backoff while the tool's circuit breaker still lets calls through and the turn has time
+        # left; a side-effecting tool only when it never started, and otherwise its failure goes to the model
+        retry_count = 0
+        side_effects = registry.has_side_effects(record.name)
+        while (retry_count < MAX_RETRY_ATTEMPTS and record.may_retry(side_effects)
+               and resilience.breaker(record.name).allows() and not deadline.expired()):
+            retry_count += 1
+            outcome = await resilience.retry_call(record.name, function_to_call, arguments, retry_count,
+                                                  registry.timeout(record.name))
+            ledger.record(record.tool_call_id, record.name, record.arguments, outcome)
+
+        # Add the retried result (or the final error) to conversation history
+        payload = record.payload()
+        if record.status != SUCCEEDED:
+            payload = dict(payload, tool_call_id=record.tool_call_id)
+        conversation_history[call_sid].append(tool_result(record.tool_call_id, payload))
+
+
+def record_usage(stage, model, usage):
+    """ Count a Gemini request and its prompt / response tokens, including prompt tokens read from a cache """
+    tracing.record_llm_usage("gemini", model, stage, usage and usage.prompt_token_count,
+                             usage and usage.candidates_token_count,
+                             cached_tokens=usage and usage.cached_content_token_count)
+
+
+async def prefix_cache(model):
+    """ Name of the context cache holding the system prompt and tools for this model, or None """
+    if not GEMINI_CONTEXT_CACHE:
+        return None
+    name, valid_until = _prefix_caches.get(model, (None, 0))
+    if time.monotonic() < valid_until:
+        return name
+    async with _prefix_cache_lock:
+        name, valid_until = _prefix_caches.get(model, (None, 0))
+        if time.monotonic() < valid_until:
+            return name
+        try:
+            cache = await genai_client.get().aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+                contents=[system_prompt.to_gemini()], tools=[tools], ttl=f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s"))
+            _prefix_caches[model] = (cache.name, time.monotonic() + GEMINI_CONTEXT_CACHE_TTL_SECONDS - 60)
+        except Exception as e:
+            logger.warning("Context cache unavailable for %s, sending the full prompt: %s", model, e)
+            _prefix_caches[model] = (None, time.monotonic() + CONTEXT_CACHE_RETRY_SECONDS)
+        return _prefix_caches[model][0]
+
+
+async def request_layout(model, history):
+    """ Contents and config for a request; the system prompt and tools are referenced from the model's
+    context cache when it has one, so every request shares the same cached prefix """
+    name = await prefix_cache(model)
+    if name is None or not history or history[0].role != SYSTEM:
+        return to_gemini(history), config
+    return to_gemini(history[1:]), types.GenerateContentConfig(cached_content=name)
+
+
+async def timed_generate(stage, model, history, hedge=False):
+    """ One generate_content request, timed as a turn stage and counted with its token usage.
+    With hedge=True a request slower than usual is duplicated to GEMINI_HEDGE_MODEL """
+    async def generate(target):
+        request_contents, request_config = await request_layout(target, history)
+        return await genai_client.get().aio.models.generate_content(model=target, contents=request_contents,
+                                                                    config=request_config)
+
+    hedge_request = None
+    if hedge and GEMINI_HEDGE_MODEL:
+        hedge_request = lambda: generate(GEMINI_HEDGE_MODEL)
+    with tracing.span(stage, model=model):
+        response = await asyncio.wait_for(deadline.hedged(stage, lambda: generate(model), hedge_request),
+                                          deadline.stage_timeout())
+    record_usage(stage, response.model_version or model, response.usage_metadata)
+    return response
+
+
+def compact(call_sid):
+    """ Keep the call's prompt within the token budget before a request is sent, the final one included """
+    conversation_history[call_sid] = compact_history(
+        conversation_history[call_sid], describe, lambda summary: Message(SYSTEM, summary), "gemini")[0]
+
+
+async def resolve_tool_calls(model: str, call_sid: str, reply_model: str = None, speculation=None):
+    """ Run the first Gemini call and any requested functions; returns the reply text if no tool was needed
+    and no separate reply_model is in use """
+
+    compact(call_sid)
     user_messages = conversation_history[call_sid]
 
     # Debug: Print conversation history
 
-    # Generate content using Gemini
-    response = client.models.generate_content(
-        model=model,
-        contents=user_messages,
-        config=config
-    )
+    # Generate content using Gemini's async client so other turns keep running meanwhile
+    response = await timed_generate("llm_first", model, user_messages, hedge=True)
 
     # Validate if response is valid
     if not response.candidates or not response.candidates[0].content.parts:
         raise ValueError("Empty or invalid response from Gemini")
 
-    # ✅ Loop through all parts returned in the response
-    for part in response.candidates[0].content.parts:
-        if part.function_call:
-            function_call_data = part.function_call
-            function_name = function_call_data.name
-            arguments = function_call_data.args
-            tool_call_id = str(uuid.uuid4())
-
+    parts = response.candidates[0].content.parts
+    answered_by = model
+
+    # Function calls before the first text part are validated and run concurrently
+    first_text = next((index for index, part in enumerate(parts) if not part.function_call), len(parts))
+    call_parts = parts[:first_text]
+
+    # The small tool model got the arguments wrong; ask the reply model before anything runs
+    if reply_model and TOOL_MODEL_FALLBACK and registry.validation_errors(
+            [(part.function_call.name, part.function_call.args) for part in call_parts]):
+        metrics.inc("tool_model_fallbacks_total", store="gemini")
+        response = await timed_generate("llm_first", reply_model, user_messages, hedge=True)
+        if not response.candidates or not response.candidates[0].content.parts:
+            raise ValueError("Empty or invalid response from Gemini")
+        parts = response.candidates[0].content.parts
+        first_text = next((index for index, part in enumerate(parts) if not part.function_call), len(parts))
+        call_parts = parts[:first_text]
+        answered_by = reply_model
+
+    results = await registry.run_calls([(part.function_call.name, part.function_call.args) for part in call_parts],
+                                       speculation)
+
+    # ✅ Record the calls and their results in the original call order
+    ledger = ToolCallLedger()
+    for part, result in zip(call_parts, results):
+        function_call_data = part.function_call
+        function_name = function_call_data.name
+        arguments = function_call_data.args
+        tool_call_id = str(uuid.uuid4())
+
+        # Add tool call information to the conversation history
+        conversation_history[call_sid].append(tool_call(tool_call_id, function_name, arguments))
+
+        record = ledger.record(tool_call_id, function_name, arguments, result)
+        if record.status == FAILED:
+            # Left out of history for now; final_check retries it and records the outcome
+            continue
+
+        # Add the function result (or why the call was rejected) to conversation history
+        payload = record.payload()
+        if record.status == INVALID:
+            payload = dict(payload, tool_call_id=tool_call_id)
+        conversation_history[call_sid].append(tool_result(tool_call_id, payload))
+
+    # With a separate reply model the tool model's text is never the answer
+    if first_text < len(parts) and (not reply_model or answered_by == reply_model):
+        # If no function_call, treat as regular text and append to conversation history
+        text = parts[first_text].text
+
+        # One LLM round trip even when function calls came with the text
+        metrics.inc("chat_turns_total", path="single_call")
+        if call_parts:
+            # Failed calls are not in history yet; settle them before the reply is recorded
+            with tracing.span("final_check", retries=len(ledger.failed())):
+                await final_check(call_sid, ledger)
+        conversation_history[call_sid].append(Message(ASSISTANT, text))
+        return text
+
+    metrics.inc("chat_turns_total", path="two_call")
 
-            # Add tool call information to the conversation history
-            conversation_history[call_sid].append(
-                types.Content(
-                    role="model",  # Use 'model' to log tool calls
-                    parts=[types.Part(text=json.dumps({
-                        "tool_call_id": tool_call_id,
-                        "function": {
-                            "name": function_name,
-                            "arguments": arguments
-                        }
-                    }))]
-                )
-            )
-
-            # Check if the function is available
-            function_to_call = available_functions.get(function_name)
-
-            if function_to_call:
-                try:
-                    # Call the function and get the result
-                    function_response = function_to_call(**arguments) if arguments else function_to_call()
-
-                    # Add the function result to conversation history
-                    conversation_history[call_sid].append(
-                        types.Content(
-                            role="user",
-                            parts=[types.Part(text=json.dumps(function_response))]  # Append function response to conversation history
-                        )
-                    )
-                except Exception as e:
-                    conversation_history[call_sid].append(
-                        types.Content(
-                            role="user",
-                            parts=[types.Part(text=json.dumps({"error": f"Function execution failed: {str(e)}", "tool_call_id": tool_call_id}))]
-                        )
-                    )
-            else:
-                # If function not found, log an error
-                conversation_history[call_sid].append(
-                    types.Content(
-                        role="user",
-                        parts=[types.Part(text=json.dumps({"error": f"Unknown function '{function_name}'","tool_call_id": tool_call_id}))]
-                    )
-                )
-        else:
-            # If no function_call, treat as regular text and append to conversation history
+    # ✅ Run final check to retry any errors or failed function calls
+    with tracing.span("final_check", retries=len(ledger.failed())):
+        await final_check(call_sid, ledger)
+    return None
+
+
+async def final_part_output(call_sid: str, part):
+    """ Turn one part of the final Gemini response into reply text, running a late function call if needed """
+    if part.function_call:
+        final_function_call_data = part.function_call
+        function_name = final_function_call_data.name
+        arguments = final_function_call_data.args
+        tool_call_id = str(uuid.uuid4())
+
+        try:
+            function_to_call, arguments = registry.prepare(function_name, arguments)
+        except ToolArgumentError as e:
             conversation_history[call_sid].append(
-                types.Content(
-                    role="model",
-                    parts=[types.Part(text=part.text)]
-                )
-            )
+                tool_result(tool_call_id, {"invalid_call": str(e), "tool_call_id": tool_call_id}))
+            return json.dumps({"invalid_call": str(e)})
 
-            return part.text, conversation_history[call_sid]
+        try:
+            # Call the function and get the result
+            function_response = await resilience.guarded_call(function_name, function_to_call, arguments,
+                                                              registry.timeout(function_name))
+            result = tool_result(tool_call_id, function_response)
+        except Exception as e:
+            result = tool_result(tool_call_id, {"error": f"Function execution failed: {str(e)}",
+                                                "tool_call_id": tool_call_id})
+        # Append function response to conversation history; its JSON is also the reply text
+        conversation_history[call_sid].append(result)
+        return result.content()
 
-    # ✅ Run final check to retry any errors or failed function calls
-    await final_check(call_sid)
-                   
+    # Treat as normal text
+    return part.text
+
+
+def routed_reply(call_sid):
+    """ Answer a static FAQ intent from templated tool output without calling Gemini """
+    reply = intent_router.answer(conversation_history[call_sid][-1].text or "")
+    if reply is not None:
+        conversation_history[call_sid].append(Message(ASSISTANT, reply))
+    return reply
+
+
+async def generate_response(model: str, call_sid: str):
+    """ Generate a response using Gemini with function calling support """
+    routed = routed_reply(call_sid)
+    if routed is not None:
+        return routed, conversation_history[call_sid]
+
+    started = time.perf_counter()
+
+    # The function-selection call may go to a smaller model than the reply
+    tool_model = GEMINI_TOOL_MODEL or model
+    # Side-effect-free tools the caller's words point at start while the first LLM call is in flight
+    speculation = Speculation(registry, conversation_history[call_sid][-1].text or "")
+    try:
+        direct_reply = await resolve_tool_calls(tool_model, call_sid, model if tool_model != model else None,
+                                                speculation)
+    finally:
+        speculation.finish()
+
+    if direct_reply is not None:
+        intent_router.observe_llm_turn(time.perf_counter() - started)
+        return direct_reply, conversation_history[call_sid]
 
     # ✅ Generate final response after processing function calls
-    final_response = client.models.generate_content(
-        model=model,
-        contents=conversation_history[call_sid],
-        config=config
-    )
+    compact(call_sid)
+    final_response = await timed_generate("llm_final", model, conversation_history[call_sid])
 
-   
     # ✅ Loop again for the final response if needed
-    final_output = []
-    for part in final_response.candidates[0].content.parts:
-        if part.function_call:
-            final_function_call_data = part.function_call
-            function_name = final_function_call_data.name
-            arguments = final_function_call_data.args
-            tool_call_id = str(uuid.uuid4())
-
-            # Check if the function is available
-            function_to_call = available_functions.get(function_name)
-
-            if function_to_call:
-                try:
-                    # Call the function and get the result
-                    function_response = function_to_call(**arguments) if arguments else function_to_call()
-                    conversation_history[call_sid].append(
-                        types.Content(
-                            role="user",
-                            parts=[types.Part(text=json.dumps(function_response))]  # Append function response to conversation history
-                        )
-                    )
-                    final_output.append(json.dumps(function_response))
-                except Exception as e:
-                    conversation_history[call_sid].append(
-                        types.Content(
-                            role="user",
-                            parts=[types.Part(text=json.dumps({"error": f"Function execution failed: {str(e)}","tool_call_id": tool_call_id}))]
-                        )
-                    )
-                    final_output.append(json.dumps({"error": f"Function execution failed: {str(e)}", "tool_call_id": tool_call_id}))
-            else:
-                conversation_history[call_sid].append(
-                    types.Content(
-                        role="user",
-                        parts=[types.Part(text=json.dumps({"error": f"Unknown function '{function_name}'", "tool_call_id": tool_call_id}))]
-                    )
-                )
-                final_output.append(json.dumps({"error": f"Unknown function '{function_name}'"}))
-        else:
-            # Treat as normal text and append to final output
-            final_output.append(part.text)
-
+    final_output = [await final_part_output(call_sid, part) for part in final_response.candidates[0].content.parts]
     final_reply = "\n".join(final_output)
 
-    conversation_history[call_sid].append(
-        types.Content(
-            role="model",
-            parts=[types.Part(text=final_reply)]
-        )
-    )
+    conversation_history[call_sid].append(Message(ASSISTANT, final_reply))
+    intent_router.observe_llm_turn(time.perf_counter() - started)
 
     # ✅ Return combined results and updated conversation history
     return final_reply, conversation_history[call_sid]
 
 
+async def generate_response_stream(model: str, call_sid: str):
+    """ Same as generate_response, but yields the final answer as Gemini streams it """
+    routed = routed_reply(call_sid)
+    if routed is not None:
+        yield routed
+        return
 
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+    started = time.perf_counter()
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """ Flask endpoint to handle chat requests """
-    data = request.json
-    call_sid = data.get("call_sid")
-    user_input = data.get("user_input", "")
+    # The function-selection call may go to a smaller model than the reply
+    tool_model = GEMINI_TOOL_MODEL or model
+    # Side-effect-free tools the caller's words point at start while the first LLM call is in flight
+    speculation = Speculation(registry, conversation_history[call_sid][-1].text or "")
+    try:
+        direct_reply = await resolve_tool_calls(tool_model, call_sid, model if tool_model != model else None,
+                                                speculation)
+    finally:
+        speculation.finish()
 
+    if direct_reply is not None:
+        intent_router.observe_llm_turn(time.perf_counter() - started)
+        yield direct_reply
+        return
+
+    compact(call_sid)
+    final_output = []
+    usage = None
+    with tracing.span("llm_final", model=model, stream=True):
+        request_contents, request_config = await request_layout(model, conversation_history[call_sid])
+        stream = await asyncio.wait_for(genai_client.get().aio.models.generate_content_stream(
+            model=model,
+            contents=request_contents,
+            config=request_config
+        ), deadline.stage_timeout())
+        async for chunk in stream:
+            usage = chunk.usage_metadata or usage
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                text = await final_part_output(call_sid, part)
+                if text:
+                    final_output.append(text)
+                    yield text
+    record_usage("llm_final", model, usage)
+
+    conversation_history[call_sid].append(Message(ASSISTANT, "".join(final_output)))
+    intent_router.observe_llm_turn(time.perf_counter() - started)
+
+
+def start_turn(call_sid, user_input):
+    """ Record the caller's input in their history """
     if call_sid not in conversation_history:
         conversation_history[call_sid] = [
             system_prompt  # Correctly formatted system prompt
         ]
 
     # Append user input to conversation history
-    conversation_history[call_sid].append(
-        types.Content(
-            role="user",
-            parts=[types.Part(text=user_input)]
-        )
-    )
+    conversation_history[call_sid].append(Message(USER, user_input))
+
+
+def is_opening_turn(call_sid):
+    """ The caller's first question, whose answer cannot depend on earlier conversation """
+    return len(conversation_history[call_sid]) == 2
+
+
+async def cached_reply(call_sid, user_input):
+    """ Answer from the response cache when the same opening question was answered before """
+    reply = await response_cache.lookup(user_input)
+    if reply is not None:
+        conversation_history[call_sid].append(Message(ASSISTANT, reply))
+    return reply
+
+
+async def handle_turn(call_sid, user_input, turn_deadline=None):
+    """ One /chat turn; past the deadline the caller hears the fallback reply while the turn completes
+    into their history """
+    with tracing.trace(call_sid), deadline.use(turn_deadline):
+        return await deadline.answer_within(complete_turn(call_sid, user_input))
+
+
+async def complete_turn(call_sid, user_input):
+    """ One full turn, holding the caller's session lock from input to final answer """
+    async with conversation_history.turn(call_sid):
+        start_turn(call_sid, user_input)
+        opening = is_opening_turn(call_sid)
+        cached = await cached_reply(call_sid, user_input) if opening else None
+        if cached is not None:
+            return cached
+
+        with resilience.observe_tool_calls() as calls:
+            response, updated_conversation = await generate_response(GEMINI_MODEL, call_sid)
+        if opening:
+            response_cache.store(user_input, calls, response)
+    return response
+
+
+async def handle_turn_stream(call_sid, user_input, turn_deadline=None):
+    """ Streaming version of handle_turn """
+    with tracing.trace(call_sid), deadline.use(turn_deadline):
+        async for text in deadline.stream_within(complete_turn_stream(call_sid, user_input)):
+            yield text
+
+
+async def complete_turn_stream(call_sid, user_input):
+    """ Streaming version of complete_turn """
+    async with conversation_history.turn(call_sid):
+        start_turn(call_sid, user_input)
+        opening = is_opening_turn(call_sid)
+        cached = await cached_reply(call_sid, user_input) if opening else None
+        if cached is not None:
+            yield cached
+            return
+
+        reply = []
+        with resilience.observe_tool_calls() as calls:
+            async for text in generate_response_stream(GEMINI_MODEL, call_sid):
+                reply.append(text)
+                yield text
+        if opening:
+            response_cache.store(user_input, calls, "".join(reply))
+
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """ Flask endpoint to handle chat requests """
+    # The turn's time budget starts now, before it waits for a free slot
+    turn_deadline = deadline.TurnDeadline()
+    data = request.json
 
     # Generate and return response
-    response, updated_conversation = loop.run_until_complete(
-        generate_response("gemini-2.0-flash", call_sid)
-    )
+    # Runs as its own coroutine on the shared loop so other callers are not blocked
+    response = run_turn(handle_turn(data.get("call_sid"), data.get("user_input", ""), turn_deadline))
+
+    with tracing.span("serialize", call_sid=data.get("call_sid")):
+        return jsonify({"response": response})
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """ Flask endpoint that streams the answer one sentence at a time as Server-Sent Events """
+    turn_deadline = deadline.TurnDeadline()
+    data = request.json
+
+    # Tool calls resolve first, then the final answer is streamed
+    events = stream_turn(sse_sentences(handle_turn_stream(data.get("call_sid"), data.get("user_input", ""),
+                                                          turn_deadline)))
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def prime_models():
+    """ Create the Firestore and Gemini clients and prime the models with the system prompt and tool schemas """
+    await asyncio.to_thread(firestore_db.get)
+
+    async def prime(model):
+        # Creates the model's context cache, then sends the prefix once
+        request_contents, request_config = await request_layout(model, [system_prompt])
+        await genai_client.get().aio.models.generate_content(
+            model=model, contents=request_contents or [Message(USER, "Hello").to_gemini()],
+            config=request_config.model_copy(update={"max_output_tokens": 1}))
+
+    await asyncio.gather(*(prime(model) for model in {GEMINI_MODEL, GEMINI_TOOL_MODEL or GEMINI_MODEL}))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """ Prometheus scrape endpoint """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/ready', methods=['GET'])
+def ready_endpoint():
+    """ Readiness probe: 200 once warm-up (if enabled) has finished, with startup timings """
+    return jsonify(startup.status()), 200 if startup.ready() else 503
+
+
+@app.route('/traces/<call_sid>', methods=['GET'])
+def traces_endpoint(call_sid):
+    """ Recent spans of one call, to follow a slow caller stage by stage """
+    return jsonify({"call_sid": call_sid, "spans": tracing.recent_spans(call_sid)})
 
-    return jsonify({"response": response})
 
+# Ready now, or after the backends are primed when WARMUP_ON_BOOT is set
+startup.begin(lambda: run_turn(prime_models()))
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,93 @@
+import os
+
+import metrics
+
+# Approximate prompt size (in tokens) a history may reach before it gets compacted
+COMPACTION_TOKEN_BUDGET = int(os.getenv("COMPACTION_TOKEN_BUDGET", "3000"))
+
+# Number of most recent caller turns that are always sent verbatim
+COMPACTION_KEEP_TURNS = int(os.getenv("COMPACTION_KEEP_TURNS", "4"))
+
+# The rolling summary keeps its most recent part when it grows past this
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "1500"))
+
+# Each summarized message is clipped to this many characters
+SUMMARY_CHARS_PER_MESSAGE = 200
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+metrics.describe("prompt_tokens_before_compaction_total", "Estimated history tokens before compaction")
+metrics.describe("prompt_tokens_after_compaction_total", "Estimated history tokens sent after compaction")
+metrics.describe("history_compactions_total", "Turns whose history had to be compacted, by stage (tools, summary)")
+
+
+def estimate_tokens(text):
+    """ Rough token count (about four characters per token) that needs no tokenizer """
+    return len(text) // 4 + 1
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def compact_history(history, describe, make_summary, name, budget=COMPACTION_TOKEN_BUDGET,
+                    keep_turns=COMPACTION_KEEP_TURNS):
+    """ Fit a history into the token budget before it is sent to the model.
+
+    ``describe(message)`` returns ``(kind, text)`` with kind one of system, summary, user, assistant
+    or tool; ``make_summary(text)`` builds the backend's summary message. The first message is the
+    system prompt and is always kept. Over budget, tool payloads from already answered turns are
+    dropped first; if that is not enough, turns older than the last ``keep_turns`` are folded into a
+    rolling summary placed right after the system prompt. Returns (history, tokens_before, tokens_after).
+    """
+    described = [describe(message) for message in history]
+    tokens_before = sum(estimate_tokens(text) for _, text in described)
+    metrics.inc("prompt_tokens_before_compaction_total", tokens_before, store=name)
+
+    if tokens_before <= budget:
+        metrics.inc("prompt_tokens_after_compaction_total", tokens_before, store=name)
+        return history, tokens_before, tokens_before
+
+    summary = ""
+    start = 1
+    if len(described) > 1 and described[1][0] == "summary":
+        summary = described[1][1][len(SUMMARY_PREFIX):]
+        start = 2
+
+    # Split into turns, each starting at a caller message
+    turns = []
+    for message, (kind, text) in zip(history[start:], described[start:]):
+        if kind == "user" or not turns:
+            turns.append([])
+        turns[-1].append((message, kind, text))
+
+    # Stage 1: tool payloads of answered turns are stale, the assistant's reply already used them
+    turns = [turn if index == len(turns) - 1 else [entry for entry in turn if entry[1] != "tool"]
+             for index, turn in enumerate(turns)]
+    metrics.inc("history_compactions_total", store=name, stage="tools")
+
+    def total_tokens():
+        return (estimate_tokens(described[0][1]) + (estimate_tokens(SUMMARY_PREFIX + summary) if summary else 0)
+                + sum(estimate_tokens(text) for turn in turns for _, _, text in turn))
+
+    # Stage 2: fold everything but the last keep_turns turns into the rolling summary, and keep
+    # folding the oldest remaining turn while it still does not fit (the current turn always stays)
+    if total_tokens() > budget:
+        metrics.inc("history_compactions_total", store=name, stage="summary")
+        while len(turns) > 1 and (len(turns) > keep_turns or total_tokens() > budget):
+            oldest = turns.pop(0)
+            lines = [f"{'Caller' if kind == 'user' else 'Assistant'}: {_clip(text, SUMMARY_CHARS_PER_MESSAGE)}"
+                     for _, kind, text in oldest if kind in ("user", "assistant") and text.strip()]
+            summary = "\n".join(([summary] if summary else []) + lines)
+            if len(summary) > SUMMARY_MAX_CHARS:
+                summary = summary[-SUMMARY_MAX_CHARS:].split("\n", 1)[-1]
+
+    compacted = [history[0]]
+    if summary:
+        compacted.append(make_summary(SUMMARY_PREFIX + summary))
+    compacted.extend(message for turn in turns for message, _, _ in turn)
+
+    tokens_after = total_tokens()
+    metrics.inc("prompt_tokens_after_compaction_total", tokens_after, store=name)
+    return compacted, tokens_before, tokens_after
@@ -0,0 +1,62 @@
+from doctor_index import DoctorIndex
+from tool_registry import ToolRegistry
+
+# Tools shared by both servers; each server extends this registry with its own refill tool
+registry = ToolRegistry()
+
+# Doctors list
+doctors = [
+    {"name": "John Doe", "department": "Pulmonology", "specialization": "Surgery",
+     "timings": "Monday to Friday, 3:00 pm to 5:00 pm"},
+    {"name": "Jane Smith", "department": "Cardiology", "specialization": "Heart Surgery",
+     "timings": "Monday, Wednesday, Friday, 10:00 am to 12:00 pm"},
+    {"name": "Emily Johnson", "department": "Neurology", "specialization": "Brain Surgery",
+     "timings": "Tuesday and Thursday, 1:00 pm to 3:00 pm"},
+    {"name": "Michael Brown", "department": "Orthopedics", "specialization": "Knee Replacement",
+     "timings": "Monday to Friday, 9:00 am to 11:00 am"},
+    {"name": "Sarah Lee", "department": "Dermatology", "specialization": "Skin Treatment",
+     "timings": "Monday to Friday, 2:00 pm to 4:00 pm"},
+    {"name": "William Clark", "department": "Ophthalmology", "specialization": "Cataract Surgery",
+     "timings": "Monday to Friday, 10:00 am to 12:00 pm"},
+    {"name": "John Smith", "department": "Pediatrics", "specialization": "Child Care",
+     "timings": "Monday to Friday, 11:00 am to 1:00 pm"}
+]
+
+# Name index over the doctors list, built once at startup
+doctor_index = DoctorIndex(doctors)
+
+
+# Function to return hospital timings
+@registry.tool("Provides operating hours of the hospital.")
+def get_hospital_timings():
+    return {
+        "operating_days": "Monday to Friday",
+        "opening_time": "8:00 AM",
+        "closing_time": "6:00 PM",
+        "closed_days": "Saturday and Sunday"
+    }
+
+
+# Function to return hospital address
+@registry.tool("Provides the full address of the hospital.")
+def get_hospital_address():
+    return {
+        "name": "MediCare General Hospital",
+        "street": "1234 Wellness Avenue",
+        "city": "Springfield",
+        "state": "IL",
+        "zipcode": "62704",
+        "country": "USA"
+    }
+
+
+# Function to return doctor details
+@registry.tool("Provides details of a specified doctor.", params={"name": "Doctor's name to retrieve details."})
+def get_doctor_details(name: str):
+    matches = doctor_index.lookup(name)
+
+    if len(matches) == 1:
+        return matches[0]
+    elif len(matches) > 1:
+        return {"multiple_matches": [doctor["name"] for doctor in matches]}
+    return {"error": "Doctor not found"}
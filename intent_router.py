@@ -0,0 +1,117 @@
+import os
+import re
+import time
+
+import hospital_tools
+import metrics
+
+# Minimum confidence for answering an intent without the LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Set to 0 to send every turn to the LLM
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "1") == "1"
+
+# Longer utterances usually carry more than one request and are left to the model
+MAX_ROUTED_WORDS = 20
+
+# Weight of the running average of LLM turn latency, used to estimate the latency a routed turn saved
+LLM_LATENCY_SMOOTHING = 0.1
+
+# Pattern weights: a strong pattern alone clears the threshold, a weak one never does
+STRONG = 0.95
+WEAK = 0.5
+
+# Static intents: the tool answering it, the reply template filled from the tool output, and the
+# (pattern, weight) pairs that signal it
+INTENTS = {
+    "hospital_timings": {
+        "tool": hospital_tools.get_hospital_timings,
+        "template": ("The hospital is open {operating_days}, from {opening_time} to {closing_time}. "
+                     "It is closed on {closed_days}."),
+        "patterns": [
+            # Opening and closing only count for the hospital itself, not "when does the cafeteria open"
+            (r"\b(what time|when) (do|does|will|are|is) (you|the hospital) (open|close|be open|closed?)\b", STRONG),
+            (r"\b(opening|operating|business|working) (hours|times|days)\b", STRONG),
+            (r"\b(your|the hospital'?s?) (hours|timings?)\b", STRONG),
+            (r"\b(are|is) (you|the hospital) open\b", STRONG),
+            (r"^(are you )?open on (the )?(weekends?|saturdays?|sundays?)\b", STRONG),
+            (r"\b(hours|timings?|schedule|open|closed)\b", WEAK),
+        ],
+    },
+    "hospital_address": {
+        "tool": hospital_tools.get_hospital_address,
+        "template": "{name} is located at {street}, {city}, {state} {zipcode}, {country}.",
+        "patterns": [
+            (r"\b(your|the hospital'?s?|hospital) (address|location)\b", STRONG),
+            (r"\bwhat is the address\b", STRONG),
+            (r"\bwhere (are you|is the hospital)( located)?\b", STRONG),
+            (r"\bhow (do|can) i (get|find|reach) (to )?(you|the hospital)\b", STRONG),
+            (r"\b(address|located|location|directions)\b", WEAK),
+        ],
+    },
+}
+
+# Words that tie the question to a doctor, a prescription or earlier conversation; the LLM handles those
+BLOCKERS = re.compile(
+    r"\b(doctors?|dr|he|she|his|her|him|it|its|they|their|them|that|refill|prescriptions?|medicines?|medications?|"
+    r"appointments?|department|pharmacy|lab|emergency|not|no|but)\b")
+
+_compiled = {intent: [(re.compile(pattern), weight) for pattern, weight in spec["patterns"]]
+             for intent, spec in INTENTS.items()}
+_doctor_tokens = hospital_tools.doctor_index.name_tokens()
+_llm_turn_seconds = None
+
+metrics.describe("intent_router_turns_total", "Turns seen by the intent router, by routed intent (none = sent to the LLM)")
+metrics.describe("intent_router_latency_saved_seconds_total",
+                 "Estimated LLM latency saved by routed turns, from the running average LLM turn time")
+
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^a-z0-9' ]+", " ", text.lower()).split())
+
+
+def classify(text):
+    """ (intent, confidence) for an utterance; intent is None when nothing static applies """
+    normalized = _normalize(text)
+    words = normalized.split()
+    if not words or len(words) > MAX_ROUTED_WORDS or BLOCKERS.search(normalized) \
+            or _doctor_tokens.intersection(words):
+        return None, 0.0
+
+    scores = {intent: max((weight for pattern, weight in patterns if pattern.search(normalized)), default=0.0)
+              for intent, patterns in _compiled.items()}
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, runner_up) = ranked[0], ranked[1]
+    if best_score == 0:
+        return None, 0.0
+    # Asking about two intents at once ("hours and address") is left to the model
+    return best, best_score - runner_up if runner_up >= WEAK else best_score
+
+
+def answer(text):
+    """ Templated reply for a confidently recognised static intent, or None to use the LLM """
+    if not INTENT_ROUTER_ENABLED:
+        return None
+
+    start = time.perf_counter()
+    intent, confidence = classify(text)
+    if intent is None or confidence < INTENT_CONFIDENCE_THRESHOLD:
+        metrics.inc("intent_router_turns_total", intent="none")
+        return None
+
+    spec = INTENTS[intent]
+    reply = spec["template"].format(**spec["tool"]())
+    metrics.inc("intent_router_turns_total", intent=intent)
+    if _llm_turn_seconds is not None:
+        metrics.inc("intent_router_latency_saved_seconds_total",
+                    max(_llm_turn_seconds - (time.perf_counter() - start), 0.0), intent=intent)
+    return reply
+
+
+def observe_llm_turn(seconds):
+    """ Feed the duration of a turn answered by the LLM into the running average """
+    global _llm_turn_seconds
+    if _llm_turn_seconds is None:
+        _llm_turn_seconds = seconds
+    else:
+        _llm_turn_seconds += LLM_LATENCY_SMOOTHING * (seconds - _llm_turn_seconds)
@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+import tracing
+from startup import Lazy
+
+# Requests one LLM host works on at once; more wait in the scheduler's queue instead of inside the server
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+
+# Requests and turns allowed to wait for a host or a turn slot; new turns are turned away with 503 beyond this
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+
+# Calls remembered for host affinity, least recently active forgotten first
+LLM_AFFINITY_CALLS = int(os.getenv("LLM_AFFINITY_CALLS", "10000"))
+
+# Turn priorities: a caller already in conversation is served before a new call
+ONGOING_CALL = 0
+NEW_CALL = 1
+
+PRIORITY_NAMES = {ONGOING_CALL: "ongoing", NEW_CALL: "new"}
+
+metrics.describe("llm_queue_depth", "LLM requests waiting for a host, by priority", kind="gauge")
+metrics.describe("llm_queue_wait_seconds", "Time LLM requests waited for a host, by priority", kind="histogram")
+metrics.describe("llm_in_flight", "LLM requests being worked on, by host", kind="gauge")
+metrics.describe("llm_admission_rejections_total", "Turns turned away because the LLM backlog was full")
+
+_priority = contextvars.ContextVar("llm_priority", default=NEW_CALL)
+
+
+class OverloadedError(Exception):
+    """ The LLM queue is full; the client should try again after ``retry_after`` seconds """
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM backend overloaded, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+@contextlib.contextmanager
+def turn_priority(priority):
+    """ LLM requests made inside this context queue with the given priority """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class Host:
+    """ One LLM server; its client is made by ``connect(url)`` when the first request goes to it """
+
+    def __init__(self, url, connect):
+        self.url = url or "default"
+        self._client = Lazy(f"llm:{self.url}", lambda: connect(url))
+        self.in_flight = 0
+
+    @property
+    def client(self):
+        return self._client.get()
+
+
+class LLMScheduler:
+    """ Admission control in front of one or more LLM hosts.
+
+    At most ``max_in_flight`` requests run per host. The rest wait in a priority queue (ongoing calls
+    first, then arrival order) and go to the host with the fewest outstanding requests as soon as one
+    frees up. ``admit`` turns new turns away while the queue is full, so a spike gets fast 503s with
+    Retry-After instead of every caller slowing down together.
+
+    A call's requests go back to the host that served it last whenever that host has room, since its
+    prompt cache already holds the call's conversation.
+
+    ``waiting_turns`` counts turns queued in front of the scheduler (e.g. for a serving slot); admission
+    counts them against ``max_queue`` too, since they are the backlog the LLM queue would otherwise see.
+    """
+
+    def __init__(self, hosts, max_in_flight=LLM_MAX_IN_FLIGHT, max_queue=LLM_MAX_QUEUE, waiting_turns=lambda: 0):
+        self.hosts = hosts
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.waiting_turns = waiting_turns
+        self._waiting = []  # heap of (priority, arrival, future, call_sid)
+        self._arrivals = itertools.count()
+        self._service_seconds = 1.0  # moving average of how long a request holds a host
+        self._affinity = OrderedDict()  # call_sid -> host that served it last
+
+    def queued(self):
+        return sum(1 for _, _, waiter, _ in self._waiting if not waiter.done())
+
+    def backlog(self):
+        """ LLM requests waiting for a host plus turns waiting in front of the scheduler """
+        return self.queued() + self.waiting_turns()
+
+    def admit(self):
+        """ Raise OverloadedError when the backlog is full; safe to call from a Flask thread """
+        if self.backlog() >= self.max_queue:
+            metrics.inc("llm_admission_rejections_total")
+            raise OverloadedError(self.retry_after())
+
+    def retry_after(self):
+        """ Whole seconds until the current backlog is likely to have drained """
+        capacity = self.max_in_flight * len(self.hosts)
+        return max(1, math.ceil(self._service_seconds * (self.backlog() + 1) / capacity))
+
+    def _free_host(self, preferred=None):
+        if preferred is not None and preferred.in_flight < self.max_in_flight:
+            return preferred
+        host = min(self.hosts, key=lambda candidate: candidate.in_flight)
+        return host if host.in_flight < self.max_in_flight else None
+
+    def _start(self, host, call_sid):
+        host.in_flight += 1
+        metrics.set_gauge("llm_in_flight", host.in_flight, host=host.url)
+        if call_sid is not None and len(self.hosts) > 1:
+            self._affinity[call_sid] = host
+            self._affinity.move_to_end(call_sid)
+            if len(self._affinity) > LLM_AFFINITY_CALLS:
+                self._affinity.popitem(last=False)
+
+    def _report_depth(self):
+        for priority, name in PRIORITY_NAMES.items():
+            depth = sum(1 for queued, _, waiter, _ in self._waiting if queued == priority and not waiter.done())
+            metrics.set_gauge("llm_queue_depth", depth, priority=name)
+
+    async def acquire(self):
+        """ Wait for a free host and return it; pair with ``release`` """
+        priority = _priority.get()
+        call_sid = tracing.current_call_sid()
+        host = self._free_host(self._affinity.get(call_sid))
+        if host is not None and not self.queued():
+            self._start(host, call_sid)
+            metrics.observe("llm_queue_wait_seconds", 0, priority=PRIORITY_NAMES[priority])
+            return host
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._arrivals), waiter, call_sid))
+        self._report_depth()
+        started = time.monotonic()
+        try:
+            host = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # A host was handed over just as the turn gave up; pass it on
+                self.release(waiter.result())
+            self._report_depth()
+            raise
+        metrics.observe("llm_queue_wait_seconds", time.monotonic() - started, priority=PRIORITY_NAMES[priority])
+        return host
+
+    def release(self, host, held_seconds=None):
+        host.in_flight -= 1
+        metrics.set_gauge("llm_in_flight", host.in_flight, host=host.url)
+        if held_seconds is not None:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * held_seconds
+        while self._waiting and self._free_host() is not None:
+            _, _, waiter, call_sid = heapq.heappop(self._waiting)
+            if waiter.done():
+                continue  # Cancelled while waiting
+            free = self._free_host(self._affinity.get(call_sid))
+            self._start(free, call_sid)
+            waiter.set_result(free)
+        self._report_depth()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """ Hold a host for the duration of one request (or one whole streamed reply) """
+        host = await self.acquire()
+        started = time.monotonic()
+        try:
+            yield host
+        finally:
+            self.release(host, time.monotonic() - started)
@@ -0,0 +1,123 @@
+import json
+
+from history_compaction import SUMMARY_PREFIX
+
+# Roles of a history message. A tool call is an assistant message with a name and arguments,
+# a tool result is a tool message with the result the model was shown.
+SYSTEM = "system"
+USER = "user"
+ASSISTANT = "assistant"
+TOOL = "tool"
+
+# Tag of the stored record layout (Message.to_record); histories stored under another tag are not read
+RECORD_FORMAT = "messages/1"
+
+_GEMINI_ROLES = {SYSTEM: "user", USER: "user", ASSISTANT: "model", TOOL: "user"}
+
+
+class Message:
+    """ One entry of a conversation history, shared by the Ollama and Gemini servers.
+
+    Tool calls and results keep their name, arguments and result as Python values; they are turned
+    into JSON text only when a request is built. The converted text and wire dicts are cached on the
+    message while its turn runs, so every request of the turn reuses them, and ``release`` drops them
+    again once the history goes idle. Messages are never modified after they are appended.
+    """
+
+    __slots__ = ("role", "text", "tool_call_id", "name", "args", "result", "_content", "_ollama", "_gemini")
+
+    def __init__(self, role, text=None, tool_call_id=None, name=None, args=None, result=None):
+        self.role = role
+        self.text = text
+        self.tool_call_id = tool_call_id
+        self.name = name
+        self.args = args
+        self.result = result
+        self._content = None
+        self._ollama = None
+        self._gemini = None
+
+    @property
+    def is_tool_call(self):
+        return self.name is not None and self.role == ASSISTANT
+
+    def content(self):
+        """ The message as the model reads it: its text, or the JSON of a tool call or result """
+        if self.role != TOOL and not self.is_tool_call:
+            return self.text or ""
+        if self._content is None:
+            if self.role == TOOL:
+                self._content = json.dumps(self.result)
+            else:
+                self._content = json.dumps({"tool_call_id": self.tool_call_id,
+                                            "function": {"name": self.name, "arguments": self.args}})
+        return self._content
+
+    def to_ollama(self):
+        """ The message in Ollama's chat format """
+        if self._ollama is None:
+            if self.is_tool_call:
+                self._ollama = {"role": TOOL, "tool_call_id": self.tool_call_id,
+                                "function": {"name": self.name, "arguments": self.args}}
+            elif self.role == TOOL:
+                self._ollama = {"role": TOOL, "tool_call_id": self.tool_call_id, "content": self.content()}
+            else:
+                self._ollama = {"role": self.role, "content": self.text}
+        return self._ollama
+
+    def to_gemini(self):
+        """ The message as a Gemini content dict; Gemini has no system role, so the prompt is a user turn """
+        if self._gemini is None:
+            self._gemini = {"role": _GEMINI_ROLES[self.role], "parts": [{"text": self.content()}]}
+        return self._gemini
+
+    def release(self):
+        self._content = self._ollama = self._gemini = None
+
+    def to_record(self):
+        """ JSON-compatible record for a session backend, leaving out empty fields """
+        record = {"role": self.role}
+        for field in ("text", "tool_call_id", "name", "args", "result"):
+            value = getattr(self, field)
+            if value is not None:
+                record[field] = value
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record["role"], record.get("text"), record.get("tool_call_id"), record.get("name"),
+                   record.get("args"), record.get("result"))
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content()[:60]!r})"
+
+
+def tool_call(tool_call_id, name, args):
+    return Message(ASSISTANT, tool_call_id=tool_call_id, name=name, args=args)
+
+
+def tool_result(tool_call_id, result):
+    return Message(TOOL, tool_call_id=tool_call_id, result=result)
+
+
+def to_ollama(history):
+    return [message.to_ollama() for message in history]
+
+
+def to_gemini(history):
+    return [message.to_gemini() for message in history]
+
+
+def release(history):
+    """ Drop the cached request formats of an idle history; they are rebuilt on its next turn """
+    for message in history:
+        message.release()
+
+
+def describe(message):
+    """ How history compaction sees a message: (kind, text) """
+    if message.role == SYSTEM:
+        return ("summary" if message.text.startswith(SUMMARY_PREFIX) else "system"), message.text
+    if message.role == TOOL or message.is_tool_call:
+        return "tool", message.content()
+    return message.role, message.text or ""
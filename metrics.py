@@ -0,0 +1,89 @@
+import threading
+
+# Counters and gauges shared by both servers, exported in Prometheus text format on /metrics
+_lock = threading.Lock()
+_values = {}
+_metadata = {}
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_buckets = {}
+
+# Latency buckets in seconds, from a fast tool call to a slow local LLM reply
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def describe(name, help_text, kind="counter", buckets=DEFAULT_BUCKETS):
+    """ Register a metric's HELP text and TYPE; histograms also get their bucket bounds """
+    _metadata[name] = (help_text, kind)
+    if kind == "histogram":
+        _buckets[name] = tuple(buckets)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """ Increase a counter """
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """ Set a gauge to an absolute value """
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """ Record one observation in a histogram """
+    bounds = _buckets.get(name, DEFAULT_BUCKETS)
+    key = _key(name, labels)
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            counts = _histograms[key] = [0] * len(bounds) + [0.0, 0]
+        for index, bound in enumerate(bounds):
+            if value <= bound:
+                counts[index] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+def get(name, **labels):
+    """ Current value of a counter or gauge, 0 if never recorded """
+    return _values.get(_key(name, labels), 0)
+
+
+def render():
+    """ Render every metric in Prometheus text exposition format """
+    with _lock:
+        values = sorted(_values.items())
+        histograms = sorted((key, list(counts)) for key, counts in _histograms.items())
+
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name not in seen:
+            seen.add(name)
+            help_text, kind = _metadata.get(name, ("", "untyped"))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    def sample(name, labels, value):
+        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    for (name, labels), value in values:
+        header(name)
+        sample(name, labels, value)
+
+    for (name, labels), counts in histograms:
+        header(name)
+        for bound, count in zip(_buckets.get(name, DEFAULT_BUCKETS), counts):
+            sample(f"{name}_bucket", labels + (("le", f"{bound:g}"),), count)
+        sample(f"{name}_bucket", labels + (("le", "+Inf"),), counts[-1])
+        sample(f"{name}_sum", labels, round(counts[-2], 6))
+        sample(f"{name}_count", labels, counts[-1])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,304 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so only one process may use a journal path
+    fcntl = None
+
+# Local journal keeping refills that are confirmed to the caller but not yet committed to Firestore.
+# Each process locks a slot of its own: this path, or refill_journal.1.jsonl, .2 ... when it is taken
+REFILL_JOURNAL_PATH = os.getenv("REFILL_JOURNAL_PATH", "refill_journal.jsonl")
+
+# Journal slots tried before giving up; one per worker process sharing REFILL_JOURNAL_PATH
+REFILL_JOURNAL_SLOTS = int(os.getenv("REFILL_JOURNAL_SLOTS", "64"))
+
+# Records per Firestore batch commit (Firestore allows at most 500 writes per batch)
+REFILL_BATCH_SIZE = min(int(os.getenv("REFILL_BATCH_SIZE", "100")), 500)
+
+# Longest a confirmed refill waits before its batch is committed
+REFILL_FLUSH_INTERVAL_SECONDS = float(os.getenv("REFILL_FLUSH_INTERVAL_SECONDS", "0.5"))
+
+# fsync the journal on every submit; turning it off trades crash durability for latency
+REFILL_JOURNAL_FSYNC = os.getenv("REFILL_JOURNAL_FSYNC", "1") == "1"
+
+# Acknowledged entries after which the journal is rewritten with only the pending ones
+REFILL_JOURNAL_COMPACT_EVERY = 1000
+
+# Wait after a failed commit before the batch is tried again, doubling up to the maximum
+COMMIT_RETRY_DELAY_SECONDS = 0.5
+COMMIT_RETRY_MAX_DELAY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("refill_writes_queued_total", "Refill records confirmed and queued for Firestore")
+metrics.describe("refill_writes_committed_total", "Refill records committed to Firestore")
+metrics.describe("refill_batches_total", "Batch commits sent to Firestore")
+metrics.describe("refill_commit_failures_total", "Batch commits that failed and will be retried")
+metrics.describe("refill_writes_replayed_total", "Unacknowledged refill records replayed from the journal at startup")
+metrics.describe("refill_queue_depth", "Refill records waiting to be committed", kind="gauge")
+
+
+def journal_slot(path, slot):
+    """ Path of journal slot ``slot``: the configured path itself for slot 0 """
+    if slot == 0:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{slot}{extension}"
+
+
+def claim_journal(path, slots=REFILL_JOURNAL_SLOTS):
+    """ Lock the first journal slot no other process holds and return (slot path, lock file).
+
+    The lock lives in a separate ``.lock`` file because compaction replaces the journal itself. It is
+    released when the process exits, so a restarted worker takes over (and replays) a dead one's slot.
+    """
+    if fcntl is None:
+        return path, None
+    for slot in range(slots):
+        slot_path = journal_slot(path, slot)
+        lock = open(slot_path + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            continue
+        return slot_path, lock
+    raise RuntimeError(f"All {slots} refill journal slots of {path} are locked by other processes; "
+                       f"raise REFILL_JOURNAL_SLOTS or use a separate REFILL_JOURNAL_PATH")
+
+
+def new_document_id():
+    """ A Firestore-style 20 character document ID, assigned locally so the caller can be told right away """
+    return uuid.uuid4().hex[:20]
+
+
+class FirestoreSink:
+    """ Commits refill batches to a Firestore collection with ``batch().set``.
+
+    Writing under the locally assigned document ID makes replays idempotent: a batch that was
+    committed but not acknowledged before a crash overwrites the same documents instead of adding
+    duplicates. Honors FIRESTORE_EMULATOR_HOST like any Firestore client. ``db`` may also be a function
+    returning the client, so it is only created when the first batch is committed.
+    """
+
+    def __init__(self, db, collection):
+        self.db = db
+        self.collection = collection
+
+    def commit(self, records):
+        db = self.db() if callable(self.db) else self.db
+        batch = db.batch()
+        collection = db.collection(self.collection)
+        for document_id, data in records:
+            batch.set(collection.document(document_id), data)
+        batch.commit()
+
+
+class MemorySink:
+    """ In-process stand-in for Firestore, with optional per-commit latency and failures to inject """
+
+    def __init__(self, latency=0.0, fail_commits=0):
+        self.documents = {}
+        self.commits = 0
+        self.latency = latency
+        self.fail_commits = fail_commits
+        self._lock = threading.Lock()
+
+    def commit(self, records):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_commits:
+                self.fail_commits -= 1
+                raise ConnectionError("injected commit failure")
+            self.commits += 1
+            self.documents.update(records)
+
+
+class RefillQueue:
+    """ Write-behind queue for refill records.
+
+    ``submit`` assigns the document ID, appends the record to the on-disk journal and returns at once;
+    a background thread commits queued records in batches of up to REFILL_BATCH_SIZE, at least every
+    REFILL_FLUSH_INTERVAL_SECONDS. Committed IDs are acknowledged in the journal, and anything still
+    unacknowledged when the process starts is replayed, so a confirmed refill is never lost.
+
+    Processes sharing ``journal_path`` (e.g. gunicorn workers) each lock a journal slot of their own,
+    see ``claim_journal``; ``journal_path`` is then the slot this queue writes to.
+    """
+
+    def __init__(self, sink, journal_path=REFILL_JOURNAL_PATH, batch_size=REFILL_BATCH_SIZE,
+                 flush_interval=REFILL_FLUSH_INTERVAL_SECONDS, fsync=REFILL_JOURNAL_FSYNC):
+        self.sink = sink
+        self.journal_path, self._journal_lock = claim_journal(journal_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._pending = {}  # document_id -> data, in submit order
+        self._in_flight = set()
+        self._acked_since_compaction = 0
+        self._flush_waiters = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._replay()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="refill-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, data):
+        """ Queue a refill record and return its document ID once it is safely journaled """
+        document_id = new_document_id()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("refill queue is closed")
+            self._write_journal({"id": document_id, "data": data}, self.fsync)
+            self._pending[document_id] = data
+            metrics.inc("refill_writes_queued_total")
+            metrics.set_gauge("refill_queue_depth", len(self._pending))
+            self._condition.notify_all()
+        return document_id
+
+    def flush(self, timeout=None):
+        """ Wait until everything submitted so far is committed. Returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._pending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self, timeout=5):
+        """ Commit what is queued (best effort within ``timeout``) and stop the writer thread """
+        with self._condition:
+            if self._closed:
+                return
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        self._journal.close()
+        if self._journal_lock is not None:
+            self._journal_lock.close()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash mid-write
+                if "ack" in entry:
+                    for document_id in entry["ack"]:
+                        self._pending.pop(document_id, None)
+                else:
+                    self._pending[entry["id"]] = entry["data"]
+        if self._pending:
+            metrics.inc("refill_writes_replayed_total", len(self._pending))
+        metrics.set_gauge("refill_queue_depth", len(self._pending))
+        # Start from a journal holding only what is still pending
+        self._rewrite_journal()
+
+    def _write_journal(self, entry, sync):
+        self._journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        if sync:
+            os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self):
+        temporary_path = self.journal_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as journal:
+            for document_id, data in self._pending.items():
+                journal.write(json.dumps({"id": document_id, "data": data}, separators=(",", ":")) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temporary_path, self.journal_path)
+
+    def _next_batch(self):
+        """ Wait for a full batch, the flush interval or a flush() call, then claim up to batch_size records """
+        with self._condition:
+            oldest_waiting_since = None
+            while not self._closed:
+                waiting = len(self._pending) - len(self._in_flight)
+                if waiting >= self.batch_size or (waiting and self._flush_waiters):
+                    break
+                if not waiting:
+                    oldest_waiting_since = None
+                    self._condition.wait()
+                    continue
+                if oldest_waiting_since is None:
+                    oldest_waiting_since = time.monotonic()
+                remaining = oldest_waiting_since + self.flush_interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            for document_id, data in self._pending.items():
+                if document_id not in self._in_flight:
+                    batch.append((document_id, data))
+                    if len(batch) == self.batch_size:
+                        break
+            self._in_flight.update(document_id for document_id, _ in batch)
+            return batch
+
+    def _run(self):
+        retry_delay = COMMIT_RETRY_DELAY_SECONDS
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+
+            try:
+                self.sink.commit(batch)
+            except Exception as e:
+                logger.warning("Refill batch commit failed, retrying in %gs: %s", retry_delay, e)
+                metrics.inc("refill_commit_failures_total")
+                with self._condition:
+                    self._in_flight.difference_update(document_id for document_id, _ in batch)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, COMMIT_RETRY_MAX_DELAY_SECONDS)
+                continue
+
+            retry_delay = COMMIT_RETRY_DELAY_SECONDS
+            metrics.inc("refill_batches_total")
+            metrics.inc("refill_writes_committed_total", len(batch))
+            with self._condition:
+                document_ids = [document_id for document_id, _ in batch]
+                self._write_journal({"ack": document_ids}, False)
+                for document_id in document_ids:
+                    self._pending.pop(document_id, None)
+                    self._in_flight.discard(document_id)
+                self._acked_since_compaction += len(document_ids)
+                if self._acked_since_compaction >= REFILL_JOURNAL_COMPACT_EVERY:
+                    self._journal.close()
+                    self._rewrite_journal()
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._acked_since_compaction = 0
+                metrics.set_gauge("refill_queue_depth", len(self._pending))
+                self._condition.notify_all()
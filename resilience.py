@@ -0,0 +1,216 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import time
+
+import deadline
+import metrics
+import tracing
+from tool_executor import call_tool
+
+# Default time limit for one tool call; tools can set their own with @registry.tool(..., timeout=...)
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "5"))
+
+# Exponential backoff between retries: base * 2^(attempt - 1), capped, with full jitter
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "2"))
+
+# Consecutive failures that open a tool's circuit, and how long it stays open before a trial call
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Breaker states, exported as the value of the tool_breaker_state gauge
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+metrics.describe("tool_breaker_state", "Circuit breaker state per tool (0 closed, 1 half-open, 2 open)", kind="gauge")
+metrics.describe("tool_breaker_trips_total", "Times a tool's circuit breaker opened")
+metrics.describe("tool_breaker_rejections_total", "Tool calls failed fast because the tool's circuit was open")
+metrics.describe("tool_timeouts_total", "Tool calls that ran past their time limit")
+metrics.describe("tool_retries_total", "Retry attempts of failed tool calls")
+metrics.describe("tool_calls_total", "Tool calls by tool and result (ok, empty, error, timeout, rejected)")
+
+
+class ToolTimeoutError(Exception):
+    """ A tool call ran past its time limit """
+
+
+class CircuitOpenError(Exception):
+    """ The tool failed repeatedly and is not being called until its breaker resets """
+
+
+class CircuitBreaker:
+    """ Consecutive-failure breaker for one tool.
+
+    Closed, calls go through. After BREAKER_FAILURE_THRESHOLD failures in a row it opens and calls
+    fail fast; once BREAKER_RESET_SECONDS have passed a single trial call is let through (half-open)
+    and its outcome closes or re-opens the circuit. Only used from the event loop thread.
+    """
+
+    def __init__(self, name, threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allows(self):
+        """ Whether a call may go through right now, without claiming the half-open trial """
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return self.state == CLOSED or not self._trial_running
+
+    def acquire(self):
+        if not self.allows():
+            metrics.inc("tool_breaker_rejections_total", tool=self.name)
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable, please try again later")
+        if self.state != CLOSED:
+            self._set_state(HALF_OPEN)
+            self._trial_running = True
+
+    def release(self):
+        """ The call was cancelled before it finished; it says nothing about the tool's health """
+        self._trial_running = False
+
+    def succeeded(self):
+        self.failures = 0
+        self._trial_running = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+
+    def failed(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                metrics.inc("tool_breaker_trips_total", tool=self.name)
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge("tool_breaker_state", state, tool=self.name)
+
+
+_breakers = {}
+
+# Collects (name, arguments, outcome) of every guarded call made within observe_tool_calls()
+_observed_calls = contextvars.ContextVar("observed_tool_calls", default=None)
+
+
+def breaker(name):
+    """ The circuit breaker of a tool, created on first use """
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+        metrics.set_gauge("tool_breaker_state", CLOSED, tool=name)
+    return _breakers[name]
+
+
+@contextlib.contextmanager
+def observe_tool_calls():
+    """ List filling up with (name, arguments, result or exception) for each tool call made in this context.
+
+    Contexts nest: when this one ends, its calls are also added to the enclosing observer's list.
+    """
+    calls = []
+    token = _observed_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _observed_calls.reset(token)
+        outer = _observed_calls.get()
+        if outer is not None:
+            outer.extend(calls)
+
+
+@contextlib.contextmanager
+def unobserved():
+    """ Tool calls made (or tasks created) in this context are not added to any observer's list """
+    token = _observed_calls.set(None)
+    try:
+        yield
+    finally:
+        _observed_calls.reset(token)
+
+
+def _observe(name, arguments, outcome):
+    calls = _observed_calls.get()
+    if calls is not None:
+        calls.append((name, arguments, outcome))
+
+
+async def observed(name, arguments, call):
+    """ Await a call started outside the current observer and record its outcome as made here """
+    try:
+        result = await call
+    except Exception as e:
+        _observe(name, arguments, e)
+        raise
+    _observe(name, arguments, result)
+    return result
+
+
+def retry_delay(attempt):
+    """ Backoff before retry number ``attempt`` (1-based), with full jitter so callers spread out """
+    ceiling = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+async def guarded_call(name, function, arguments=None, timeout=None):
+    """ Call a tool behind its circuit breaker and time limit.
+
+    Raises CircuitOpenError without calling when the circuit is open and ToolTimeoutError when the
+    call runs too long. Exceptions and empty (None) results count as failures for the breaker.
+    A timed-out sync tool keeps its executor thread until it returns; only the wait is abandoned.
+    """
+    circuit = breaker(name)
+    try:
+        circuit.acquire()
+    except CircuitOpenError as e:
+        metrics.inc("tool_calls_total", tool=name, result="rejected")
+        _observe(name, arguments, e)
+        raise
+    # A turn with a deadline never waits on a tool past its hard stop
+    timeout = deadline.stage_timeout(timeout or TOOL_TIMEOUT_SECONDS)
+    try:
+        with tracing.span("tool", tool=name):
+            result = await asyncio.wait_for(call_tool(function, arguments), timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("tool_timeouts_total", tool=name)
+        metrics.inc("tool_calls_total", tool=name, result="timeout")
+        circuit.failed()
+        error = ToolTimeoutError(f"{name} did not respond within {timeout:.3g} seconds")
+        _observe(name, arguments, error)
+        raise error
+    except asyncio.CancelledError:
+        circuit.release()
+        raise
+    except Exception as e:
+        metrics.inc("tool_calls_total", tool=name, result="error")
+        circuit.failed()
+        _observe(name, arguments, e)
+        raise
+
+    _observe(name, arguments, result)
+    if result is None:
+        metrics.inc("tool_calls_total", tool=name, result="empty")
+        circuit.failed()
+    else:
+        metrics.inc("tool_calls_total", tool=name, result="ok")
+        circuit.succeeded()
+    return result
+
+
+async def retry_call(name, function, arguments=None, attempt=1, timeout=None):
+    """ One retry attempt: wait out the backoff, then make a guarded call. Returns the result or the exception """
+    await asyncio.sleep(retry_delay(attempt))
+    metrics.inc("tool_retries_total", tool=name)
+    try:
+        return await guarded_call(name, function, arguments, timeout)
+    except Exception as e:
+        return e
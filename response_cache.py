@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+import metrics
+from resilience import guarded_call
+
+# Set to 0 to generate every answer with the model
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+
+# Maximum cached answers per server, least recently used evicted first
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+# Cached answers older than this are regenerated
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+
+# Words that do not change what the caller is asking
+FILLER_WORDS = {"um", "uh", "erm", "hmm", "please", "hi", "hello", "hey", "ok", "okay", "so", "well"}
+
+metrics.describe("response_cache_lookups_total", "Answer cache lookups by result (hit, miss, stale)")
+metrics.describe("response_cache_stores_total", "Answers stored in the cache, or skipped as uncacheable")
+metrics.describe("response_cache_entries", "Answers currently cached", kind="gauge")
+
+
+def normalize(text):
+    """ Cache key for an utterance: lowercase words without punctuation or filler """
+    words = re.sub(r"[^a-z0-9 ]+", " ", text.lower().replace("'", "")).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def results_digest(calls):
+    """ Stable hash of (name, arguments, result) triples """
+    payload = json.dumps([[name, arguments, result] for name, arguments, result in calls],
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedAnswer:
+    __slots__ = ("answer", "calls", "digest", "stored_at")
+
+    def __init__(self, answer, calls, digest):
+        self.answer = answer
+        self.calls = calls  # (name, arguments) of the tools the answer was built from
+        self.digest = digest
+        self.stored_at = time.monotonic()
+
+
+class ResponseCache:
+    """ Answers to opening questions, keyed on the normalized utterance.
+
+    Only turns that start a call are cached, so an answer never depends on earlier conversation, and
+    only when every tool the model used is side-effect free and succeeded. On lookup those tools are
+    re-run and their results hashed; if the hash differs from the one stored with the answer (doctor
+    data changed, say) the entry is dropped as stale and the turn goes to the model. Used from the
+    event loop thread only.
+    """
+
+    def __init__(self, name, registry, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        self.name = name
+        self.registry = registry
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    async def lookup(self, text):
+        """ The cached answer for this opening utterance, or None """
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+
+        key = normalize(text)
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.inc("response_cache_lookups_total", store=self.name, result="miss")
+            return None
+        if time.monotonic() - entry.stored_at > self.ttl_seconds or await self._current_digest(entry) != entry.digest:
+            self._discard(key)
+            metrics.inc("response_cache_lookups_total", store=self.name, result="stale")
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.inc("response_cache_lookups_total", store=self.name, result="hit")
+        return entry.answer
+
+    def store(self, text, calls, answer):
+        """ Cache an answer given the (name, arguments, outcome) tool calls that produced it """
+        if not RESPONSE_CACHE_ENABLED or not answer:
+            return
+        if any(self.registry.has_side_effects(name) or isinstance(outcome, Exception) or outcome is None
+               for name, _, outcome in calls):
+            metrics.inc("response_cache_stores_total", store=self.name, result="uncacheable")
+            return
+
+        key = normalize(text)
+        self._entries[key] = CachedAnswer(answer, [(name, arguments) for name, arguments, _ in calls],
+                                          results_digest(calls))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.inc("response_cache_stores_total", store=self.name, result="stored")
+        metrics.set_gauge("response_cache_entries", len(self._entries), store=self.name)
+
+    async def _current_digest(self, entry):
+        """ Digest of the entry's tool calls re-run now, or None when one of them fails.
+
+        The calls run concurrently behind each tool's breaker and time limit, so a slow or failing tool
+        makes the entry stale within its timeout (or at once while its circuit is open).
+        """
+        async def revalidate(name, arguments):
+            function, prepared = self.registry.prepare(name, arguments)
+            return await guarded_call(name, function, prepared, self.registry.timeout(name))
+
+        results = await asyncio.gather(*(revalidate(name, arguments) for name, arguments in entry.calls),
+                                       return_exceptions=True)
+        if any(isinstance(result, Exception) for result in results):
+            return None
+        return results_digest([(name, arguments, result) for (name, arguments), result in zip(entry.calls, results)])
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        metrics.set_gauge("response_cache_entries", len(self._entries), store=self.name)
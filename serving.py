@@ -0,0 +1,121 @@
+import asyncio
+import os
+import queue
+import threading
+
+# Maximum number of chat turns allowed to run on the event loop at the same time
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", "32"))
+
+_loop = None
+_loop_lock = threading.Lock()
+_turn_slots = None
+_waiting_turns = 0
+_waiting_lock = threading.Lock()
+
+
+def get_loop():
+    """ Return the shared background event loop, starting it on first use """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="chat-event-loop", daemon=True).start()
+    return _loop
+
+
+def _get_turn_slots():
+    global _turn_slots
+    # Created lazily so the semaphore belongs to the background loop
+    if _turn_slots is None:
+        _turn_slots = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+    return _turn_slots
+
+
+def waiting_turns():
+    """ Turns submitted by Flask threads that do not hold a turn slot yet """
+    return _waiting_turns
+
+
+class _Waiting:
+    """ Counts a turn as waiting from submission until it holds a turn slot or ends without one.
+
+    It is counted on the submitting thread, so admission sees a burst even while the loop is busy.
+    """
+
+    def __init__(self):
+        global _waiting_turns
+        self._counted = True
+        with _waiting_lock:
+            _waiting_turns += 1
+
+    def done(self, *_):
+        global _waiting_turns
+        with _waiting_lock:
+            if self._counted:
+                self._counted = False
+                _waiting_turns -= 1
+
+
+async def _limited(coro, waiting):
+    """ Run a coroutine once a turn slot is free """
+    async with _get_turn_slots():
+        waiting.done()
+        return await coro
+
+
+async def _limited_stream(agen, waiting):
+    """ Hold a turn slot for as long as the async generator keeps producing """
+    async with _get_turn_slots():
+        waiting.done()
+        try:
+            async for item in agen:
+                yield item
+        finally:
+            # Close the turn explicitly so it releases its session lock even if the client went away
+            await agen.aclose()
+
+
+def run_turn(coro, timeout=None):
+    """ Schedule a turn on the shared loop and block the calling Flask worker thread until it finishes """
+    waiting = _Waiting()
+    future = asyncio.run_coroutine_threadsafe(_limited(coro, waiting), get_loop())
+    # Also uncounts a turn that was cancelled or failed before it got a slot
+    future.add_done_callback(waiting.done)
+    return future.result(timeout)
+
+
+def stream_turn(agen, timeout=None):
+    """ Drive an async generator on the shared loop, yielding its items to a Flask streaming response.
+
+    The whole generator runs as one task, so context variables set during the turn stay visible
+    across its yields; items are handed to the Flask thread through a queue.
+    """
+    items = queue.Queue()
+    waiting = _Waiting()
+
+    async def pump():
+        try:
+            async for item in _limited_stream(agen, waiting):
+                items.put((True, item))
+        except Exception as e:
+            items.put((False, e))
+        finally:
+            items.put((False, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    future.add_done_callback(waiting.done)
+    try:
+        while True:
+            try:
+                produced, item = items.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("stream produced nothing within the timeout")
+            if produced:
+                yield item
+            elif item is None:
+                return
+            else:
+                raise item
+    finally:
+        # Also runs when the client disconnects mid-stream; the turn closes and releases its session lock
+        future.cancel()
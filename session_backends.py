@@ -0,0 +1,208 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Which store holds histories between turns: memory (single process), sqlite or redis
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Stored histories expire after this long without a turn
+SESSION_BACKEND_TTL_SECONDS = int(os.getenv("SESSION_BACKEND_TTL_SECONDS", "3600"))
+
+# A worker that dies mid-turn releases its call's lock after this long
+SESSION_LOCK_LEASE_SECONDS = float(os.getenv("SESSION_LOCK_LEASE_SECONDS", "120"))
+
+# Give up waiting for another worker's turn on the same call after this long
+SESSION_LOCK_TIMEOUT_SECONDS = float(os.getenv("SESSION_LOCK_TIMEOUT_SECONDS", "30"))
+
+# Histories larger than this are zlib-compressed before storing
+COMPRESS_ABOVE_BYTES = 1024
+
+
+def dump_history(records, record_format=None):
+    """ Serialize a list of JSON-compatible message records as compactly as possible.
+
+    ``record_format`` names the record layout; it is stored in front of the data so a reader expecting
+    another layout (e.g. after a deploy changed it) can tell the history apart instead of misreading it.
+    """
+    raw = json.dumps(records, separators=(",", ":")).encode()
+    header = b"@" + record_format.encode() + b"\0" if record_format else b""
+    if len(raw) > COMPRESS_ABOVE_BYTES:
+        return header + b"z" + zlib.compress(raw)
+    return header + b"j" + raw
+
+
+def load_history(data, record_format=None):
+    """ Inverse of dump_history; None when the data was written with a different ``record_format`` """
+    if data[:1] == b"@":
+        stored_format, _, data = data[1:].partition(b"\0")
+        if stored_format.decode(errors="replace") != record_format:
+            return None
+    elif record_format:
+        return None  # Written before the layout was tagged
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]))
+    return json.loads(data[1:])
+
+
+class MemoryBackend:
+    """ Keeps nothing outside the process; only serializes turns on the same call_sid """
+
+    persistent = False
+
+    def __init__(self):
+        self._locks = {}  # call_sid -> [asyncio.Lock, number of turns holding or waiting]
+
+    @contextlib.asynccontextmanager
+    async def lock(self, call_sid):
+        entry = self._locks.setdefault(call_sid, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[call_sid]
+
+    async def load(self, call_sid):
+        return None
+
+    async def save(self, call_sid, data):
+        pass
+
+
+class SQLiteBackend(MemoryBackend):
+    """ Histories in a local SQLite database in WAL mode, shared by every worker process on the host """
+
+    persistent = True
+
+    def __init__(self, path=SESSION_SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        # One thread owns the connection, which also serializes this process's writes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-sqlite")
+        self._connection = None
+        self._saves = 0
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=SESSION_LOCK_TIMEOUT_SECONDS,
+                                               isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (call_sid TEXT PRIMARY KEY, data BLOB, updated_at REAL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS session_locks (call_sid TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        return self._connection
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _try_lock(self, call_sid, owner):
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO session_locks VALUES (?, ?, ?) ON CONFLICT(call_sid) DO UPDATE "
+            "SET owner = excluded.owner, expires_at = excluded.expires_at WHERE session_locks.expires_at < ?",
+            (call_sid, owner, now + SESSION_LOCK_LEASE_SECONDS, now))
+        return cursor.rowcount == 1
+
+    def _unlock(self, call_sid, owner):
+        self._connect().execute("DELETE FROM session_locks WHERE call_sid = ? AND owner = ?", (call_sid, owner))
+
+    @contextlib.asynccontextmanager
+    async def lock(self, call_sid):
+        # Turns in this process queue on the local lock; only the head of the queue polls the database
+        async with super().lock(call_sid):
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + SESSION_LOCK_TIMEOUT_SECONDS
+            delay = 0.005
+            while not await self._run(self._try_lock, call_sid, owner):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for the session lock on {call_sid}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            try:
+                yield
+            finally:
+                await self._run(self._unlock, call_sid, owner)
+
+    def _load(self, call_sid):
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE call_sid = ? AND updated_at > ?",
+            (call_sid, time.time() - SESSION_BACKEND_TTL_SECONDS)).fetchone()
+        return row[0] if row else None
+
+    def _save(self, call_sid, data):
+        connection = self._connect()
+        connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (call_sid, data, time.time()))
+        self._saves += 1
+        # Expired histories are purged every so often rather than on every write
+        if self._saves % 1000 == 0:
+            connection.execute("DELETE FROM sessions WHERE updated_at < ?",
+                               (time.time() - SESSION_BACKEND_TTL_SECONDS,))
+
+    async def load(self, call_sid):
+        return await self._run(self._load, call_sid)
+
+    async def save(self, call_sid, data):
+        await self._run(self._save, call_sid, data)
+
+
+class RedisBackend(MemoryBackend):
+    """ Histories in Redis (or any Redis-protocol store), shared by workers across hosts """
+
+    persistent = True
+
+    # Deletes the lock only if this worker still owns it
+    UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url=SESSION_REDIS_URL):
+        super().__init__()
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        self._redis = redis_asyncio.from_url(url)
+
+    @contextlib.asynccontextmanager
+    async def lock(self, call_sid):
+        async with super().lock(call_sid):
+            key = f"session-lock:{call_sid}"
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + SESSION_LOCK_TIMEOUT_SECONDS
+            delay = 0.005
+            while not await self._redis.set(key, owner, nx=True, px=int(SESSION_LOCK_LEASE_SECONDS * 1000)):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for the session lock on {call_sid}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            try:
+                yield
+            finally:
+                await self._redis.eval(self.UNLOCK_SCRIPT, 1, key, owner)
+
+    async def load(self, call_sid):
+        return await self._redis.get(f"session:{call_sid}")
+
+    async def save(self, call_sid, data):
+        await self._redis.set(f"session:{call_sid}", data, ex=SESSION_BACKEND_TTL_SECONDS)
+
+
+def make_backend(kind=SESSION_BACKEND):
+    """ Build the session backend selected by SESSION_BACKEND """
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown SESSION_BACKEND '{kind}', expected memory, sqlite or redis")
@@ -0,0 +1,147 @@
+import contextlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import tracing
+from session_backends import dump_history, load_history, make_backend
+
+# Sessions idle for longer than this are dropped (a finished call never sends another turn)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+
+# Most live sessions kept in memory; the least recently used one is evicted beyond this
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+
+# Memory cap expressed as the total number of history messages across all sessions
+MAX_SESSION_MESSAGES = int(os.getenv("MAX_SESSION_MESSAGES", "500000"))
+
+# How often expired sessions and the message cap are checked
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "30"))
+
+metrics.describe("sessions_live", "Conversation histories currently held in memory", kind="gauge")
+metrics.describe("session_evictions_total",
+                 "Conversation histories evicted, by reason (ttl, lru, memory, format = stored in another layout)")
+
+
+class SessionStore:
+    """ Conversation histories keyed by call_sid, with idle-TTL expiry and LRU eviction.
+
+    Used like the plain dict it replaces (``store[call_sid]``, ``call_sid in store``), so the
+    servers' history handling stays the same. Every access counts as activity for the session.
+
+    With a persistent backend (SQLite, Redis) the in-memory histories are only a cache: ``turn()``
+    takes the call's cross-process lock, reloads the latest history and saves it back afterwards.
+    ``to_record``/``from_record`` convert messages to and from JSON-compatible records for storage,
+    and ``release(history)`` runs when a turn ends, to drop what the history only needs during a turn.
+    Stored histories are tagged with ``record_format``; one stored under another tag is treated as missing.
+    """
+
+    def __init__(self, name, ttl_seconds=SESSION_TTL_SECONDS, max_sessions=MAX_SESSIONS,
+                 max_messages=MAX_SESSION_MESSAGES, sweep_interval=SESSION_SWEEP_INTERVAL,
+                 backend=None, to_record=None, from_record=None, release=None, record_format=None):
+        self.name = name
+        self.backend = backend or make_backend()
+        self._to_record = to_record or (lambda message: message)
+        self._from_record = from_record or (lambda record: record)
+        self._release = release
+        self.record_format = record_format
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()  # call_sid -> (history, last access time), oldest first
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+
+    def __contains__(self, call_sid):
+        with self._lock:
+            entry = self._sessions.get(call_sid)
+            if entry is None:
+                return False
+            if time.monotonic() - entry[1] > self.ttl_seconds:
+                self._evict(call_sid, "ttl")
+                return False
+            return True
+
+    def __getitem__(self, call_sid):
+        with self._lock:
+            history, _ = self._sessions[call_sid]
+            self._touch(call_sid, history)
+            return history
+
+    def __setitem__(self, call_sid, history):
+        with self._lock:
+            is_new = call_sid not in self._sessions
+            self._touch(call_sid, history)
+            if is_new:
+                while len(self._sessions) > self.max_sessions:
+                    self._evict(next(iter(self._sessions)), "lru")
+                metrics.set_gauge("sessions_live", len(self._sessions), store=self.name)
+
+    def __delitem__(self, call_sid):
+        with self._lock:
+            del self._sessions[call_sid]
+            metrics.set_gauge("sessions_live", len(self._sessions), store=self.name)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @contextlib.asynccontextmanager
+    async def turn(self, call_sid):
+        """ Hold the call's lock for a whole turn, syncing the history with the shared backend around it """
+        async with contextlib.AsyncExitStack() as stack:
+            # The history_load stage includes waiting for the lock behind another turn of the same call
+            with tracing.span("history_load", store=self.name):
+                await stack.enter_async_context(self.backend.lock(call_sid))
+                if self.backend.persistent:
+                    data = await self.backend.load(call_sid)
+                    records = None if data is None else load_history(data, self.record_format)
+                    if data is not None and records is None:
+                        metrics.inc("session_evictions_total", store=self.name, reason="format")
+                    with self._lock:
+                        if records is not None:
+                            self[call_sid] = [self._from_record(record) for record in records]
+                        elif call_sid in self._sessions:
+                            # Expired in the shared store (or unreadable), so the cached copy is stale too
+                            del self[call_sid]
+            try:
+                yield
+            finally:
+                history = self._sessions[call_sid][0] if call_sid in self._sessions else None
+                if self.backend.persistent and history is not None:
+                    with tracing.span("history_save", store=self.name):
+                        await self.backend.save(call_sid,
+                                                dump_history([self._to_record(message) for message in history],
+                                                             self.record_format))
+                if self._release is not None and history is not None:
+                    self._release(history)
+
+    def _touch(self, call_sid, history):
+        now = time.monotonic()
+        self._sessions[call_sid] = (history, now)
+        self._sessions.move_to_end(call_sid)
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+
+    def _evict(self, call_sid, reason):
+        del self._sessions[call_sid]
+        metrics.inc("session_evictions_total", store=self.name, reason=reason)
+        metrics.set_gauge("sessions_live", len(self._sessions), store=self.name)
+
+    def _sweep(self, now):
+        """ Drop expired sessions, then least recently used ones while over the message cap """
+        self._last_sweep = now
+        # Oldest first, so stop at the first session that is still fresh
+        while self._sessions:
+            call_sid, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._evict(call_sid, "ttl")
+
+        total_messages = sum(len(history) for history, _ in self._sessions.values())
+        while total_messages > self.max_messages and len(self._sessions) > 1:
+            call_sid, (history, _) = next(iter(self._sessions.items()))
+            total_messages -= len(history)
+            self._evict(call_sid, "memory")
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import re
+
+import hospital_tools
+import intent_router
+import metrics
+from resilience import guarded_call, observed, unobserved
+
+# Set to 0 to stop running predicted tool calls alongside the first LLM call
+SPECULATIVE_TOOLS_ENABLED = os.getenv("SPECULATIVE_TOOLS_ENABLED", "1") == "1"
+
+TOKEN = re.compile(r"[a-z]+")
+
+metrics.describe("speculative_tool_calls_total",
+                 "Tool calls started before the model asked for them, by result (hit = reused, wasted = not asked for)")
+metrics.describe("speculation_hit_ratio", "Share of speculative tool calls whose result was reused", kind="gauge")
+
+_doctor_tokens = hospital_tools.doctor_index.name_tokens()
+_hits = 0
+_started = 0
+
+
+def _call_key(name, arguments):
+    """ Arguments compared case- and whitespace-insensitively, so "Jane  Smith" reuses "jane smith" """
+    normalized = {argument: " ".join(value.lower().split()) if isinstance(value, str) else value
+                  for argument, value in (arguments or {}).items()}
+    return name, json.dumps(normalized, sort_keys=True, default=str)
+
+
+def predict_doctor_calls(text):
+    """ get_doctor_details for each run of doctor-name words in the utterance, e.g. "jane smith" """
+    calls = []
+    run = []
+    for token in TOKEN.findall(text.lower()) + [""]:
+        if token in _doctor_tokens:
+            run.append(token)
+        elif run:
+            calls.append(("get_doctor_details", {"name": " ".join(run)}))
+            run = []
+    return calls
+
+
+def predict_static_calls(text):
+    """ The hours or address tool when the utterance leans towards that intent, even below the router threshold """
+    intent, confidence = intent_router.classify(text)
+    if intent is None or confidence < intent_router.WEAK:
+        return []
+    return [(intent_router.INTENTS[intent]["tool"].__name__, {})]
+
+
+# Each predictor maps the caller's words to (tool name, arguments) guesses
+PREDICTORS = [predict_doctor_calls, predict_static_calls]
+
+
+def _retrieve_outcome(task):
+    # Unclaimed calls may fail; their exception is expected and must not be logged as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class Speculation:
+    """ Predicted tool calls running while the first LLM request is in flight.
+
+    ``claim`` hands over a running call when the model asks for the same tool with the same arguments;
+    ``finish`` cancels whatever was not claimed. Only side-effect-free tools are ever started.
+    """
+
+    def __init__(self, registry, text):
+        global _started
+        self._tasks = {}
+        if not SPECULATIVE_TOOLS_ENABLED:
+            return
+
+        for predictor in PREDICTORS:
+            for name, arguments in predictor(text):
+                if registry.has_side_effects(name):
+                    continue
+                key = _call_key(name, arguments)
+                if key in self._tasks:
+                    continue
+                try:
+                    function, prepared = registry.prepare(name, arguments)
+                except Exception:
+                    continue
+                # Recorded for the turn only once the model claims it (see claim), so a wasted
+                # prediction never counts among the tools an answer was built from
+                with unobserved():
+                    task = asyncio.ensure_future(guarded_call(name, function, prepared, registry.timeout(name)))
+                task.add_done_callback(_retrieve_outcome)
+                self._tasks[key] = task
+                _started += 1
+
+    def claim(self, name, arguments):
+        """ An awaitable for the running speculative call matching this request, or None.
+
+        Awaiting it records the call's outcome with the claiming turn's observed tool calls.
+        """
+        global _hits
+        task = self._tasks.pop(_call_key(name, arguments), None)
+        if task is None:
+            return None
+        _hits += 1
+        metrics.inc("speculative_tool_calls_total", tool=name, result="hit")
+        metrics.set_gauge("speculation_hit_ratio", round(_hits / _started, 4))
+        return observed(name, arguments, task)
+
+    def finish(self):
+        """ Cancel the speculative calls the model did not ask for """
+        for (name, _), task in self._tasks.items():
+            task.cancel()
+            metrics.inc("speculative_tool_calls_total", tool=name, result="wasted")
+        if self._tasks:
+            metrics.set_gauge("speculation_hit_ratio", round(_hits / _started, 4))
+        self._tasks.clear()
@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+# Imported first by the servers, so this is as close to process start as the import-to-ready time gets
+IMPORT_STARTED = time.monotonic()
+
+# Set to 1 to load the model and prime the backend at boot; /ready reports ready only once that is done
+WARMUP_ON_BOOT = os.getenv("WARMUP_ON_BOOT", "0") == "1"
+
+# Wait between warm-up attempts while the backend is not reachable yet
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("startup_seconds", "Seconds from server import to each startup phase (imported, ready)", kind="gauge")
+metrics.describe("backend_init_seconds", "Time taken to initialize each backend client on first use", kind="gauge")
+
+_state = {"ready": False, "imported_seconds": None, "ready_seconds": None, "warmup_attempts": 0, "warmup_error": None}
+_state_lock = threading.Lock()
+
+
+class Lazy:
+    """ A backend client built on first use instead of at import, exactly once across threads """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    metrics.set_gauge("backend_init_seconds", round(time.perf_counter() - started, 4),
+                                      backend=self.name)
+        return self._value
+
+
+def _mark(phase):
+    seconds = round(time.monotonic() - IMPORT_STARTED, 4)
+    metrics.set_gauge("startup_seconds", seconds, phase=phase)
+    with _state_lock:
+        _state[f"{phase}_seconds"] = seconds
+        if phase == "ready":
+            _state["ready"] = True
+
+
+def begin(warm_up=None):
+    """ Called at the end of the server's import. Reports ready at once, or after ``warm_up()`` succeeds
+    in a background thread when WARMUP_ON_BOOT is set. """
+    _mark("imported")
+    if not (WARMUP_ON_BOOT and warm_up):
+        _mark("ready")
+        return
+
+    def run():
+        while True:
+            with _state_lock:
+                _state["warmup_attempts"] += 1
+            try:
+                warm_up()
+            except Exception as e:
+                logger.warning("Warm-up failed, retrying in %gs: %s", WARMUP_RETRY_SECONDS, e)
+                with _state_lock:
+                    _state["warmup_error"] = f"{type(e).__name__}: {e}"
+                time.sleep(WARMUP_RETRY_SECONDS)
+                continue
+            with _state_lock:
+                _state["warmup_error"] = None
+            _mark("ready")
+            return
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+
+def ready():
+    return _state["ready"]
+
+
+def status():
+    """ Readiness and startup timings, as returned by /ready """
+    with _state_lock:
+        return dict(_state)
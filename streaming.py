@@ -0,0 +1,52 @@
+import json
+import re
+
+# Punctuation followed by whitespace, or a line break, ends a sentence
+SENTENCE_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+# Words whose trailing period does not end a sentence ("Dr. Smith", "10 a.m. to")
+ABBREVIATIONS = {"dr", "mr", "mrs", "ms", "st", "jr", "sr", "vs", "a.m", "p.m", "e.g", "i.e"}
+
+
+def split_sentences(buffer):
+    """ Split complete sentences off the buffer, returning (sentences, unfinished remainder) """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(buffer):
+        if match.group()[0] != "\n":
+            words = buffer[start:match.start()].split()
+            if words and words[-1].lower() in ABBREVIATIONS:
+                continue
+        sentence = buffer[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+async def sentence_chunks(text_stream):
+    """ Re-chunk a stream of model tokens so each item is one complete sentence """
+    buffer = ""
+    async for text in text_stream:
+        if not text:
+            continue
+        buffer += text
+        sentences, buffer = split_sentences(buffer)
+        for sentence in sentences:
+            yield sentence
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def sse_event(data, event=None):
+    """ Format one Server-Sent Events message """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+async def sse_sentences(text_stream):
+    """ Stream sentences as SSE messages, followed by a final 'done' event """
+    async for sentence in sentence_chunks(text_stream):
+        yield sse_event({"text": sentence})
+    yield sse_event({}, event="done")
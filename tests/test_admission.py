@@ -0,0 +1,55 @@
+""" A burst larger than the turn slots plus LLM_MAX_QUEUE is turned away with 503 instead of queueing """
+import http.client
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ollama")
+
+import fake_llm
+import load_test
+
+TURN_SLOTS = 2
+MAX_QUEUE = 4
+BURST = 20
+
+
+@pytest.fixture
+def ollama_server():
+    fake = fake_llm.start_server(fake_llm.Behaviour(latency_ms=400, jitter_ms=0, chunk_ms=0))
+    port = load_test.free_port()
+    process = load_test.start_app("ollama", port, f"http://127.0.0.1:{fake.server_address[1]}", {
+        "INTENT_ROUTER_ENABLED": "0", "RESPONSE_CACHE_ENABLED": "0",
+        "MAX_CONCURRENT_TURNS": str(TURN_SLOTS), "LLM_MAX_QUEUE": str(MAX_QUEUE)})
+    try:
+        yield port
+    finally:
+        process.terminate()
+        process.wait(10)
+        fake.shutdown()
+
+
+def post_chat(port, call_sid):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request("POST", "/chat", json.dumps({"call_sid": call_sid, "user_input": "Hello"}),
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader("Retry-After")
+    finally:
+        connection.close()
+
+
+def test_burst_beyond_the_backlog_is_rejected(ollama_server):
+    with ThreadPoolExecutor(BURST) as pool:
+        responses = list(pool.map(lambda index: post_chat(ollama_server, f"caller-{index}"), range(BURST)))
+
+    rejected = [retry_after for status, retry_after in responses if status == 503]
+    # Turns waiting for a turn slot count against the queue, so the burst cannot all wait
+    assert rejected, "no turn was turned away"
+    assert all(retry_after and int(retry_after) >= 1 for retry_after in rejected)
+    assert all(status in (200, 503) for status, _ in responses)
+    # A full queue's worth of turns is still served
+    assert len(responses) - len(rejected) >= MAX_QUEUE
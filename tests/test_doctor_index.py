@@ -0,0 +1,24 @@
+""" Lookups report at most MAX_MATCHES doctors, whether the name matched exactly or fuzzily """
+from doctor_index import MAX_MATCHES, DoctorIndex
+
+
+def directory(count):
+    return [{"name": f"{first} Smith"} for first in ["Jane", "John", "Mary", "Paul"] * count]
+
+
+def test_common_surname_is_capped():
+    index = DoctorIndex(directory(50))
+    matches = index.lookup("smith")
+    assert len(matches) == MAX_MATCHES
+    # Exact matches keep list order
+    assert matches == index.doctors[:MAX_MATCHES]
+    assert len(index.lookup("th")) == MAX_MATCHES
+
+
+def test_misheard_surname_is_capped():
+    assert len(DoctorIndex(directory(50)).lookup("smyth")) == MAX_MATCHES
+
+
+def test_unique_name_still_matches_once():
+    doctors = directory(50) + [{"name": "Ada Lovelace"}]
+    assert DoctorIndex(doctors).lookup("lovelace") == [doctors[-1]]
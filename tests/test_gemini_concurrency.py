@@ -0,0 +1,45 @@
+""" Gemini turns of different callers overlap instead of queueing behind each other """
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+import fake_llm
+import load_test
+
+LATENCY_SECONDS = 0.5
+TURNS = 8
+
+
+@pytest.fixture
+def gemini_server():
+    fake = fake_llm.start_server(fake_llm.Behaviour(latency_ms=LATENCY_SECONDS * 1000, jitter_ms=0, chunk_ms=0))
+    port = load_test.free_port()
+    # Every turn must reach the model: no FAQ templates, no cached answers, no context cache round trip
+    process = load_test.start_app("gemini", port, f"http://127.0.0.1:{fake.server_address[1]}", {
+        "INTENT_ROUTER_ENABLED": "0", "RESPONSE_CACHE_ENABLED": "0", "GEMINI_CONTEXT_CACHE": "0"})
+    try:
+        yield port
+    finally:
+        process.terminate()
+        process.wait(10)
+        fake.shutdown()
+
+
+def test_turns_overlap(gemini_server):
+    # The first turn creates the Gemini client; keep it out of the measurement
+    assert load_test.chat_turn(gemini_server, "warm-up", "Hello, is this the hospital?", False)[1]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(TURNS) as pool:
+        results = list(pool.map(lambda index: load_test.chat_turn(gemini_server, f"caller-{index}",
+                                                                  "Hello, is this the hospital?", False),
+                                range(TURNS)))
+    elapsed = time.perf_counter() - started
+
+    assert all(ok for _, ok in results)
+    # One model call per turn: overlapping turns finish in about one latency, serialized ones in TURNS of them.
+    # The bound leaves room for a loaded machine while staying well under the serialized time
+    assert elapsed < TURNS * LATENCY_SECONDS / 2, f"{TURNS} turns took {elapsed:.2f}s with {LATENCY_SECONDS}s LLM latency"
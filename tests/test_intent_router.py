@@ -0,0 +1,29 @@
+""" Only questions about the hospital itself are answered from a template """
+import pytest
+
+import intent_router
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("What time do you open?", "hospital_timings"),
+    ("When does the hospital close?", "hospital_timings"),
+    ("Are you open on weekends?", "hospital_timings"),
+    ("Where are you located?", "hospital_address"),
+    ("What is the address?", "hospital_address"),
+])
+def test_hospital_questions_are_routed(text, intent):
+    routed, confidence = intent_router.classify(text)
+    assert routed == intent and confidence >= intent_router.INTENT_CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize("text", [
+    # Follow-ups about something named earlier in the call, e.g. the pharmacy
+    "Where is it?",
+    "Is it open on Sundays?",
+    # Places inside the hospital with their own hours
+    "What time does the cafeteria open?",
+    "Is the gift shop open on weekends?",
+])
+def test_other_subjects_go_to_the_llm(text):
+    _, confidence = intent_router.classify(text)
+    assert confidence < intent_router.INTENT_CONFIDENCE_THRESHOLD
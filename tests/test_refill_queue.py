@@ -0,0 +1,47 @@
+import os
+
+from refill_queue import MemorySink, RefillQueue
+
+
+class FailingSink(MemorySink):
+    """ Never commits, so everything submitted stays in the journal """
+
+    def commit(self, records):
+        raise ConnectionError("Firestore is down")
+
+
+def test_processes_sharing_a_path_get_their_own_journal(tmp_path):
+    path = str(tmp_path / "refill_journal.jsonl")
+    first = RefillQueue(FailingSink(), path, flush_interval=60)
+    second = RefillQueue(FailingSink(), path, flush_interval=60)
+    try:
+        assert first.journal_path == path
+        assert second.journal_path == str(tmp_path / "refill_journal.1.jsonl")
+        first_id = first.submit({"patient_name": "Alex Doe"})
+        second_id = second.submit({"patient_name": "Sam Roe"})
+    finally:
+        first.close(timeout=0.1)
+        second.close(timeout=0.1)
+
+    # Each queue journals only its own refills, so neither rewrites away the other's
+    for queue, own_id, other_id in ((first, first_id, second_id), (second, second_id, first_id)):
+        with open(queue.journal_path, encoding="utf-8") as journal:
+            contents = journal.read()
+        assert own_id in contents and other_id not in contents
+
+
+def test_released_slot_is_replayed_by_the_next_owner(tmp_path):
+    path = str(tmp_path / "refill_journal.jsonl")
+    crashed = RefillQueue(FailingSink(), path, flush_interval=60)
+    document_id = crashed.submit({"patient_name": "Alex Doe"})
+    crashed.close(timeout=0.1)
+
+    sink = MemorySink()
+    restarted = RefillQueue(sink, path)
+    try:
+        assert restarted.journal_path == path
+        assert restarted.flush(timeout=5)
+        assert document_id in sink.documents
+    finally:
+        restarted.close()
+    assert os.path.exists(path + ".lock")
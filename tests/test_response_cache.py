@@ -0,0 +1,70 @@
+""" Cached answers are revalidated behind each tool's time limit, and only from tools the turn used """
+import asyncio
+import time
+
+import resilience
+import speculation
+from response_cache import ResponseCache
+from tool_registry import ToolRegistry
+
+registry = ToolRegistry()
+status = {"hang": False}
+
+
+@registry.tool("Slow but healthy lookup")
+async def slow_lookup():
+    await asyncio.sleep(0.2)
+    return {"open": True}
+
+
+@registry.tool("Lookup that may stop answering", timeout=0.1)
+async def stalling_lookup():
+    if status["hang"]:
+        await asyncio.sleep(10)
+    return {"address": "1234 Wellness Avenue"}
+
+
+@registry.tool("Lookup that is down")
+def broken_lookup():
+    raise ConnectionError("backend down")
+
+
+def cache_with_answer():
+    cache = ResponseCache("test", registry)
+    cache.store("hours and address", [("slow_lookup", {}, {"open": True}), ("slow_lookup", {}, {"open": True}),
+                                      ("stalling_lookup", {}, {"address": "1234 Wellness Avenue"})], "Open now.")
+    return cache
+
+
+def test_revalidation_runs_the_tools_concurrently():
+    started = time.perf_counter()
+    assert asyncio.run(cache_with_answer().lookup("hours and address")) == "Open now."
+    assert time.perf_counter() - started < 0.35
+
+
+def test_stalled_tool_makes_the_entry_stale_within_its_time_limit():
+    status["hang"] = True
+    try:
+        started = time.perf_counter()
+        assert asyncio.run(cache_with_answer().lookup("hours and address")) is None
+        assert time.perf_counter() - started < 1
+    finally:
+        status["hang"] = False
+
+
+def test_only_claimed_speculative_calls_are_recorded(monkeypatch):
+    monkeypatch.setattr(speculation, "SPECULATIVE_TOOLS_ENABLED", True)
+    monkeypatch.setattr(speculation, "PREDICTORS", [lambda text: [("slow_lookup", {}), ("broken_lookup", {})]])
+
+    async def turn():
+        with resilience.observe_tool_calls() as calls:
+            predicted = speculation.Speculation(registry, "when are you open")
+            try:
+                # The model only asks for slow_lookup; the failed broken_lookup prediction is wasted
+                await registry.run_calls([("slow_lookup", {})], predicted)
+            finally:
+                predicted.finish()
+            await asyncio.sleep(0.05)
+        return calls
+
+    assert asyncio.run(turn()) == [("slow_lookup", {}, {"open": True})]
@@ -0,0 +1,40 @@
+""" Histories are stored with a record-format tag; one stored in another layout is treated as missing """
+import asyncio
+
+from messages import RECORD_FORMAT, USER, Message
+from session_backends import SQLiteBackend, dump_history, load_history
+from session_store import SessionStore
+
+
+def message_store(path):
+    return SessionStore("test", backend=SQLiteBackend(path), to_record=Message.to_record,
+                        from_record=Message.from_record, record_format=RECORD_FORMAT)
+
+
+def test_tagged_history_round_trips():
+    records = [{"role": "user", "text": "hello"}] * 100  # Large enough to be compressed
+    assert load_history(dump_history(records, RECORD_FORMAT), RECORD_FORMAT) == records
+    assert load_history(dump_history(records, "messages/0"), RECORD_FORMAT) is None
+
+
+def test_history_in_an_old_layout_is_treated_as_missing(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def scenario():
+        backend = SQLiteBackend(path)
+        # An Ollama history as stored before the Message records, untagged
+        await backend.save("old-call", dump_history([{"role": "user", "content": "hello"}]))
+        # ... and a Gemini one with its "model" role
+        await backend.save("old-gemini-call", dump_history([{"role": "model", "parts": [{"text": "hi"}]}]))
+
+        store = message_store(path)
+        for call_sid in ("old-call", "old-gemini-call"):
+            async with store.turn(call_sid):
+                assert call_sid not in store
+                store[call_sid] = [Message(USER, "hello again")]
+
+        fresh = message_store(path)
+        async with fresh.turn("old-call"):
+            return [message.text for message in fresh["old-call"]]
+
+    assert asyncio.run(scenario()) == ["hello again"]
@@ -0,0 +1,62 @@
+""" final_check retries failed tool calls, but never re-runs a side-effecting tool that was started """
+import asyncio
+import time
+
+import pytest
+
+import app as ollama_app
+from messages import TOOL
+from tool_ledger import FAILED, ToolCallLedger
+
+runs = {"slow_write": 0, "flaky_read": 0}
+
+# The server's tools plus two test tools, swapped in per test so the server's own registry (and the
+# tool schemas later tests send to the model) stays unchanged
+registry = ollama_app.registry.extend()
+
+
+@pytest.fixture(autouse=True)
+def test_registry(monkeypatch):
+    monkeypatch.setattr(ollama_app, "registry", registry)
+
+
+@registry.tool("Writes something, slower than its time limit", timeout=0.1, side_effects=True)
+def slow_write():
+    runs["slow_write"] += 1
+    time.sleep(0.3)
+    return {"status": "written"}
+
+
+@registry.tool("Reads something, failing on the first attempt")
+def flaky_read():
+    runs["flaky_read"] += 1
+    if runs["flaky_read"] == 1:
+        raise ConnectionError("first attempt fails")
+    return {"status": "read"}
+
+
+async def first_attempt_then_final_check(call_sid, name):
+    ollama_app.conversation_history[call_sid] = [ollama_app.system_prompt]
+    ledger = ToolCallLedger()
+    [outcome] = await registry.run_calls([(name, {})])
+    record = ledger.record(f"{name}-1", name, {}, outcome)
+    assert record.status == FAILED
+    await ollama_app.final_check(call_sid, ledger)
+    return record, ollama_app.conversation_history[call_sid][-1]
+
+
+def test_side_effecting_tool_that_timed_out_is_not_run_again():
+    record, message = asyncio.run(first_attempt_then_final_check("retry-slow-write", "slow_write"))
+    time.sleep(0.5)  # Let any abandoned executor thread finish
+
+    assert runs["slow_write"] == 1
+    assert record.status == FAILED and record.attempts == 1
+    # The model is told the call failed instead
+    assert message.role == TOOL and "error" in message.result
+
+
+def test_tool_without_side_effects_is_retried():
+    record, message = asyncio.run(first_attempt_then_final_check("retry-flaky-read", "flaky_read"))
+
+    assert runs["flaky_read"] == 2
+    assert message.result == {"status": "read"}
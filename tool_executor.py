@@ -0,0 +1,22 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bound on blocking tool functions (Firestore writes etc.) running at the same time
+TOOL_EXECUTOR_WORKERS = int(os.getenv("TOOL_EXECUTOR_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_EXECUTOR_WORKERS, thread_name_prefix="tool-call")
+
+
+async def call_tool(function, arguments=None):
+    """ Await async tools directly and run sync tools on the bounded executor. Unknown tools (None) return None """
+    if function is None:
+        return None
+
+    arguments = arguments or {}
+    if asyncio.iscoroutinefunction(function):
+        return await function(**arguments)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(function, **arguments))
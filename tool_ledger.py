@@ -0,0 +1,79 @@
+from resilience import CircuitOpenError
+from tool_registry import ToolArgumentError
+
+# Status of a tool call in the ledger
+SUCCEEDED = "succeeded"
+FAILED = "failed"      # raised or returned nothing; final_check retries it
+INVALID = "invalid"    # rejected by argument validation; retrying cannot help
+
+
+class ToolCallRecord:
+    __slots__ = ("tool_call_id", "name", "arguments", "status", "result", "error", "attempts", "started")
+
+    def __init__(self, tool_call_id, name, arguments):
+        self.tool_call_id = tool_call_id
+        self.name = name
+        self.arguments = arguments
+        self.status = None
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.started = False  # whether any attempt reached the tool; an open breaker rejects without calling it
+
+    def settle(self, outcome):
+        """ Record the outcome of one attempt: a result, or the exception it raised """
+        self.attempts += 1
+        self.started = self.started or not isinstance(outcome, (CircuitOpenError, ToolArgumentError))
+        if isinstance(outcome, ToolArgumentError):
+            self.status, self.error = INVALID, str(outcome)
+        elif isinstance(outcome, Exception):
+            self.status, self.error = FAILED, str(outcome)
+        elif outcome is None:
+            self.status, self.error = FAILED, "Function returned no result"
+        else:
+            self.status, self.result, self.error = SUCCEEDED, outcome, None
+
+    def may_retry(self, side_effects):
+        """ Whether running the call again is safe. A tool with side effects that was started may have
+        done its work even though it failed or timed out (its thread keeps running), so it is never re-run """
+        return self.status == FAILED and not (side_effects and self.started)
+
+    def payload(self):
+        """ What the model is shown for this call """
+        if self.status == SUCCEEDED:
+            return self.result
+        if self.status == INVALID:
+            return {"invalid_call": self.error}
+        if self.attempts > 1:
+            return {"error": f"Retry failed after {self.attempts - 1} attempts: {self.error}"}
+        return {"error": f"Function execution failed: {self.error}"}
+
+
+class ToolCallLedger:
+    """ The tool calls of one turn, keyed by tool_call_id with an explicit status.
+
+    Failed calls are tracked in their own index, so retry handling costs O(failures) no matter how
+    long the call's history is, and a message merely containing the word "error" is never mistaken
+    for a failed tool call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._failed = {}
+
+    def record(self, tool_call_id, name, arguments, outcome):
+        record = self._calls.get(tool_call_id) or ToolCallRecord(tool_call_id, name, arguments)
+        self._calls[tool_call_id] = record
+        record.settle(outcome)
+        if record.status == FAILED:
+            self._failed[tool_call_id] = record
+        else:
+            self._failed.pop(tool_call_id, None)
+        return record
+
+    def get(self, tool_call_id):
+        return self._calls.get(tool_call_id)
+
+    def failed(self):
+        """ Failed calls in the order they were made """
+        return list(self._failed.values())
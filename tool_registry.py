@@ -0,0 +1,175 @@
+import asyncio
+import inspect
+
+from resilience import guarded_call
+
+# JSON schema types for the Python annotations tools use
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+class ToolArgumentError(ValueError):
+    """ The model asked for an unknown tool or passed arguments that do not fit its signature """
+
+
+class ToolSpec:
+    def __init__(self, name, function, description, parameters, required, timeout=None, side_effects=False):
+        self.name = name
+        self.function = function
+        self.description = description
+        self.parameters = parameters  # argument name -> (python type, description)
+        self.required = required
+        self.timeout = timeout  # seconds; None uses TOOL_TIMEOUT_SECONDS
+        self.side_effects = side_effects  # writes or triggers something, so never re-run or run speculatively
+
+
+class ToolRegistry:
+    """ Tools declared once with ``@registry.tool``, from which every backend's tool payload is built.
+
+    The JSON schema comes from the function signature: annotated types become schema types and
+    parameters without a default are required. Payloads are built once and cached, and model-supplied
+    arguments are validated and coerced against the same signature before a tool runs.
+    """
+
+    def __init__(self, tools=None):
+        self._tools = dict(tools or {})
+        self._payloads = {}
+
+    def tool(self, description, params=None, timeout=None, side_effects=False):
+        """ Decorator registering a function as a tool. ``params`` maps argument names to descriptions """
+        params = params or {}
+
+        def register(function):
+            parameters = {}
+            required = []
+            for argument in inspect.signature(function).parameters.values():
+                annotation = argument.annotation if argument.annotation in JSON_TYPES else str
+                parameters[argument.name] = (annotation, params.get(argument.name, ""))
+                if argument.default is inspect.Parameter.empty:
+                    required.append(argument.name)
+            self._tools[function.__name__] = ToolSpec(function.__name__, function, description, parameters, required,
+                                                     timeout, side_effects)
+            self._payloads.clear()
+            return function
+
+        return register
+
+    def extend(self):
+        """ A new registry starting with these tools, for backend-specific additions """
+        return ToolRegistry(self._tools)
+
+    def names(self):
+        return list(self._tools)
+
+    def _schema(self, spec):
+        return {
+            "type": "object",
+            "properties": {name: {"type": JSON_TYPES[annotation], "description": description}
+                           for name, (annotation, description) in spec.parameters.items()},
+            "required": list(spec.required),
+        }
+
+    def ollama_tools(self):
+        """ Tool list in the format ollama's chat(tools=...) expects """
+        if "ollama" not in self._payloads:
+            self._payloads["ollama"] = [
+                {"type": "function", "function": {"name": spec.name, "description": spec.description,
+                                                  "parameters": self._schema(spec)}}
+                for spec in self._tools.values()
+            ]
+        return self._payloads["ollama"]
+
+    def gemini_declarations(self):
+        """ Function declarations for Gemini; tools without arguments get no parameters block """
+        if "gemini" not in self._payloads:
+            declarations = []
+            for spec in self._tools.values():
+                declaration = {"name": spec.name, "description": spec.description}
+                if spec.parameters:
+                    declaration["parameters"] = self._schema(spec)
+                declarations.append(declaration)
+            self._payloads["gemini"] = declarations
+        return self._payloads["gemini"]
+
+    def prepare(self, name, arguments):
+        """ Validate and coerce the model's arguments, returning (function, arguments) ready to call """
+        spec = self._tools.get(name)
+        if spec is None:
+            raise ToolArgumentError(f"Unknown function '{name}'")
+
+        arguments = dict(arguments or {})
+        prepared = {}
+        for argument, value in arguments.items():
+            if argument not in spec.parameters:
+                # Models sometimes add made-up arguments; they are ignored rather than failing the call
+                continue
+            annotation = spec.parameters[argument][0]
+            try:
+                prepared[argument] = _coerce(value, annotation)
+            except (TypeError, ValueError):
+                raise ToolArgumentError(
+                    f"Argument '{argument}' of {name} must be of type {JSON_TYPES[annotation]}, got {value!r}")
+
+        missing = [argument for argument in spec.required if prepared.get(argument) in (None, "")]
+        if missing:
+            raise ToolArgumentError(f"Missing required argument(s) for {name}: {', '.join(missing)}")
+        return spec.function, prepared
+
+    def timeout(self, name):
+        """ The tool's own time limit, None when it uses the default """
+        spec = self._tools.get(name)
+        return spec.timeout if spec else None
+
+    def validation_errors(self, calls):
+        """ ToolArgumentErrors of the (name, arguments) pairs that would be rejected, without running anything """
+        errors = []
+        for name, arguments in calls:
+            try:
+                self.prepare(name, arguments)
+            except ToolArgumentError as e:
+                errors.append(e)
+        return errors
+
+    def has_side_effects(self, name):
+        """ Whether calling the tool changes anything; unknown tools are assumed to """
+        spec = self._tools.get(name)
+        return spec is None or spec.side_effects
+
+    async def run_calls(self, calls, speculation=None):
+        """ Validate and run (name, arguments) pairs concurrently behind each tool's breaker and time limit.
+
+        Results keep the call order. Invalid calls come back as ToolArgumentError without running,
+        failed ones as the exception they raised (CircuitOpenError when the tool is failing fast).
+        Calls a ``speculation`` already started are reused instead of run again.
+        """
+        prepared = []
+        for name, arguments in calls:
+            try:
+                prepared.append((name,) + self.prepare(name, arguments))
+            except ToolArgumentError as e:
+                prepared.append(e)
+
+        def run(name, function, arguments):
+            started = speculation.claim(name, arguments) if speculation is not None else None
+            return started if started is not None else guarded_call(name, function, arguments, self.timeout(name))
+
+        results = iter(await asyncio.gather(
+            *(run(name, function, arguments)
+              for name, function, arguments in (call for call in prepared if not isinstance(call, Exception))),
+            return_exceptions=True))
+        return [call if isinstance(call, Exception) else next(results) for call in prepared]
+
+
+def _coerce(value, annotation):
+    if value is None or isinstance(value, annotation) and not (annotation is int and isinstance(value, bool)):
+        return value
+    if annotation is str:
+        if isinstance(value, (dict, list)):
+            raise TypeError(value)
+        return str(value)
+    if annotation is bool:
+        if isinstance(value, str) and value.strip().lower() in ("true", "yes", "1", "false", "no", "0"):
+            return value.strip().lower() in ("true", "yes", "1")
+        raise ValueError(value)
+    if annotation is int and isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return annotation(value)
@@ -0,0 +1,143 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import metrics
+
+# Set to 1 to log every finished span as a JSON line on the "tracing" logger
+TRACE_LOG_SPANS = os.getenv("TRACE_LOG_SPANS", "0") == "1"
+
+# Spans slower than this are always logged, so a slow caller can be followed without logging everything
+TRACE_SLOW_SPAN_SECONDS = float(os.getenv("TRACE_SLOW_SPAN_SECONDS", "2"))
+
+# Most recent finished spans kept in memory for /traces
+TRACE_BUFFER_SPANS = int(os.getenv("TRACE_BUFFER_SPANS", "10000"))
+
+logger = logging.getLogger("tracing")
+if TRACE_LOG_SPANS and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+metrics.describe("turn_stage_seconds", "Latency of each stage of a chat turn", kind="histogram")
+metrics.describe("tool_call_seconds", "Latency of each tool call by tool", kind="histogram")
+metrics.describe("turn_stage_errors_total", "Stages of a chat turn that ended with an exception, by stage and error type")
+metrics.describe("llm_calls_total", "LLM requests by backend, model and stage")
+metrics.describe("llm_tokens_total", "LLM tokens by backend, model, stage and direction "
+                                     "(in = prompt, out = generated, cached = prompt tokens served from a cache)")
+metrics.describe("llm_prompt_eval_seconds", "Time the model spent processing the prompt, by backend, model and stage",
+                 kind="histogram")
+metrics.describe("turn_prompt_eval_seconds", "Prompt processing time summed over the LLM requests of one turn",
+                 kind="histogram")
+
+_trace = contextvars.ContextVar("trace", default=None)  # (call_sid, trace_id, turn usage totals)
+_parent_span = contextvars.ContextVar("parent_span", default=None)
+_spans = deque(maxlen=TRACE_BUFFER_SPANS)
+_spans_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def trace(call_sid):
+    """ Start a trace for one turn; spans opened inside it carry the call_sid and trace_id.
+
+    The turn span also records the turn's LLM usage totals (prompt tokens, cached tokens, prompt eval time).
+    """
+    usage = {}
+    token = _trace.set((call_sid, uuid.uuid4().hex[:16], usage))
+    try:
+        with span("turn") as attributes:
+            try:
+                yield
+            finally:
+                attributes.update(usage)
+                if "prompt_eval_ms" in usage:
+                    metrics.observe("turn_prompt_eval_seconds", usage["prompt_eval_ms"] / 1000)
+    finally:
+        _trace.reset(token)
+
+
+def current_call_sid():
+    current = _trace.get()
+    return current[0] if current else None
+
+
+@contextlib.contextmanager
+def span(stage, call_sid=None, **attributes):
+    """ Time one stage of a turn into turn_stage_seconds and record it as a span.
+
+    Spans nest through a context variable, so they work unchanged in coroutines and in tasks started
+    within the turn. ``call_sid`` is only needed outside a trace, e.g. in the Flask thread. Yields the
+    span's attributes, which the caller may add to before the span ends.
+    """
+    current = _trace.get()
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _parent_span.get()
+    token = _parent_span.set(span_id)
+    error = None
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _parent_span.reset(token)
+        metrics.observe("turn_stage_seconds", duration, stage=stage)
+        if "tool" in attributes:
+            metrics.observe("tool_call_seconds", duration, tool=attributes["tool"])
+        if error is not None:
+            metrics.inc("turn_stage_errors_total", stage=stage, error=error)
+
+        record = {
+            "call_sid": call_sid or (current[0] if current else None),
+            "trace_id": current[1] if current else None,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "stage": stage,
+            "start": round(time.time() - duration, 6),
+            "duration_ms": round(duration * 1000, 3),
+            **attributes,
+        }
+        if error is not None:
+            record["error"] = error
+        with _spans_lock:
+            _spans.append(record)
+        if duration >= TRACE_SLOW_SPAN_SECONDS:
+            logger.warning(json.dumps(record, default=str))
+        elif TRACE_LOG_SPANS:
+            logger.info(json.dumps(record, default=str))
+
+
+def record_llm_usage(backend, model, stage, tokens_in, tokens_out, prompt_eval_seconds=None, cached_tokens=None):
+    """ Count one LLM request, the tokens it consumed and produced and the time spent on its prompt
+    (None when the backend did not say), adding them to the current turn's totals """
+    metrics.inc("llm_calls_total", backend=backend, model=model, stage=stage)
+    if tokens_in:
+        metrics.inc("llm_tokens_total", tokens_in, backend=backend, model=model, stage=stage, direction="in")
+    if tokens_out:
+        metrics.inc("llm_tokens_total", tokens_out, backend=backend, model=model, stage=stage, direction="out")
+    if cached_tokens:
+        metrics.inc("llm_tokens_total", cached_tokens, backend=backend, model=model, stage=stage, direction="cached")
+    if prompt_eval_seconds is not None:
+        metrics.observe("llm_prompt_eval_seconds", prompt_eval_seconds, backend=backend, model=model, stage=stage)
+
+    current = _trace.get()
+    if current is not None:
+        usage = current[2]
+        for key, value in (("prompt_tokens", tokens_in), ("cached_tokens", cached_tokens),
+                           ("prompt_eval_ms", None if prompt_eval_seconds is None else prompt_eval_seconds * 1000)):
+            if value is not None:
+                usage[key] = round(usage.get(key, 0) + value, 3)
+
+
+def recent_spans(call_sid=None, limit=500):
+    """ The most recent finished spans, oldest first, optionally only those of one call """
+    with _spans_lock:
+        spans = [record for record in _spans if call_sid is None or record["call_sid"] == call_sid]
+    return spans[-limit:]